@@ -1,10 +1,11 @@
 """Inquiry endpoints for theme and single-product flows."""
 
-from typing import List, Optional
+from typing import List, Optional, Union
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, Query, status
+from fastapi import APIRouter, Depends, Header, Query, Response, status
 
+from ..core.etag import check_etag
 from ..schemas import (
     InquiryHistoryResponse,
     InquiryMessageCreate,
@@ -40,10 +41,16 @@ async def create_session(
 
 @router.get("/{session_id}/messages", response_model=InquiryHistoryResponse)
 async def get_history(
-    session_id: UUID, service: InquiryService = Depends(get_inquiry_service)
-) -> InquiryHistoryResponse:
-    """返回会话的完整消息历史。"""
+    session_id: UUID,
+    response: Response,
+    service: InquiryService = Depends(get_inquiry_service),
+    if_none_match: Optional[str] = Header(None),
+) -> Union[InquiryHistoryResponse, Response]:
+    """返回会话的完整消息历史。支持 ``If-None-Match``，没有新消息时返回 304。"""
 
+    not_modified = check_etag(await service.history_version(session_id), if_none_match, response)
+    if not_modified is not None:
+        return not_modified
     return await service.list_messages(session_id)
 
 
@@ -1,22 +1,87 @@
 """Product-centric endpoints."""
 
-from typing import List
+from dataclasses import asdict
+from typing import AsyncIterator, List, Literal, Optional, Union
 from urllib.parse import urlparse
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
 
-from ..schemas import ProductCreate, ProductImportRequest, ProductResponse
+from ..core.etag import check_etag
+from ..core.ndjson import NDJSONResponse, encode_lines, iter_rows
+from ..schemas import ProductCreate, ProductFacetsResponse, ProductImportRequest, ProductResponse
 from ..services import ProductService, get_product_service
+from ..services.catalog import ProductFilter
 
 router = APIRouter()
 
 
+def product_filter(
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    currency: Optional[str] = Query(None, max_length=3),
+    shop: Optional[str] = Query(None, description="店铺名"),
+    tags: List[str] = Query([], description="需同时包含的标签，可重复"),
+) -> ProductFilter:
+    return ProductFilter(
+        min_price=min_price,
+        max_price=max_price,
+        currency=currency,
+        shop=shop,
+        tags=tuple(tags),
+    )
+
+
 @router.get("", response_model=List[ProductResponse])
-async def list_products(service: ProductService = Depends(get_product_service)) -> List[ProductResponse]:
-    """返回全部商品，按照最近更新时间倒序。"""
+async def list_products(
+    response: Response,
+    query: ProductFilter = Depends(product_filter),
+    sort: Literal["updated", "price_asc", "price_desc"] = Query("updated"),
+    service: ProductService = Depends(get_product_service),
+    if_none_match: Optional[str] = Header(None),
+) -> Union[List[ProductResponse], Response]:
+    """返回商品，默认按照最近更新时间倒序。
+
+    可按价格区间、币种、店铺与标签筛选，并可按价格排序；筛选在内存列式索引上以向量化方式完成。
+    支持 ``If-None-Match``，数据未变时返回 304。
+    """
+
+    not_modified = check_etag(await service.products_version(), if_none_match, response)
+    if not_modified is not None:
+        return not_modified
+    return await service.list_products(query, sort=sort)
+
+
+# declared before /{product_id} so that "facets" and "search" are not parsed as ids
+@router.get("/facets", response_model=ProductFacetsResponse)
+async def product_facets(
+    response: Response,
+    query: ProductFilter = Depends(product_filter),
+    service: ProductService = Depends(get_product_service),
+    if_none_match: Optional[str] = Header(None),
+) -> Union[ProductFacetsResponse, Response]:
+    """按与 ``GET /products`` 相同的筛选条件，统计各币种、店铺与标签的商品数及价格区间。"""
+
+    not_modified = check_etag(await service.products_version(), if_none_match, response)
+    if not_modified is not None:
+        return not_modified
+    return ProductFacetsResponse(**asdict(await service.facets(query)))
+
 
-    return await service.list_products()
+@router.get("/search", response_model=List[ProductResponse])
+async def search_products(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    service: ProductService = Depends(get_product_service),
+    if_none_match: Optional[str] = Header(None),
+) -> Union[List[ProductResponse], Response]:
+    """全文搜索商品（标题、标签、描述与参数），按 BM25 相关度排序。中文按相邻二字切分，无需分词词典。"""
+
+    not_modified = check_etag(await service.products_version(), if_none_match, response)
+    if not_modified is not None:
+        return not_modified
+    return await service.search(q, limit=limit)
 
 
 @router.post("", response_model=ProductResponse, status_code=status.HTTP_201_CREATED)
@@ -28,10 +93,38 @@ async def create_or_update_product(
     return await service.upsert_product(payload)
 
 
+@router.post("/bulk", response_class=NDJSONResponse)
+async def bulk_upsert_products(
+    request: Request, service: ProductService = Depends(get_product_service)
+) -> NDJSONResponse:
+    """批量创建或更新商品。
+
+    请求体为 NDJSON（每行一个商品，``Content-Type: application/x-ndjson``）或 JSON 数组
+    （``application/json``），边接收边解析；每 500 行校验后在一次存储提交中写入。
+    响应为 NDJSON，按行序给出每行结果：``created``、``updated`` 或带原因的 ``error``，
+    单行出错不影响其他行；每批提交后即返回该批结果，无需等待整个请求体。
+    """
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    rows = iter_rows(request.stream(), array=content_type == "application/json")
+
+    async def results() -> AsyncIterator[bytes]:
+        async for chunk in service.bulk_upsert(rows):
+            yield encode_lines(chunk)
+
+    return NDJSONResponse(results())
+
+
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(
-    product_id: UUID, service: ProductService = Depends(get_product_service)
-) -> ProductResponse:
+    product_id: UUID,
+    response: Response,
+    service: ProductService = Depends(get_product_service),
+    if_none_match: Optional[str] = Header(None),
+) -> Union[ProductResponse, Response]:
+    not_modified = check_etag(await service.product_version(product_id), if_none_match, response)
+    if not_modified is not None:
+        return not_modified
     product = await service.get_product(product_id)
     if not product:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
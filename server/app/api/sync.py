@@ -1,17 +1,82 @@
 """Sync endpoints backed by the JSON storage change log."""
 
-from fastapi import APIRouter, Depends, Query
+from typing import List, Literal, Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, Header, Query
+from fastapi.responses import Response, StreamingResponse
 
 from ..schemas import SyncResponse
 from ..services import SyncService, get_sync_service
+from ..services.sync import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MAX_WAIT
 
 router = APIRouter()
 
 
 @router.get("/changes", response_model=SyncResponse)
 async def list_changes(
-    since: int = Query(0, ge=0), service: SyncService = Depends(get_sync_service)
-) -> SyncResponse:
-    """返回自某版本号之后的变更列表。"""
+    since: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    coalesce: bool = Query(False),
+    entity_type: Optional[List[str]] = Query(None),
+    theme_id: Optional[UUID] = Query(None),
+    payload_format: Literal["full", "patch"] = Query("full", alias="format"),
+    wait: float = Query(0, ge=0, le=MAX_WAIT),
+    accept_encoding: Optional[str] = Header(None),
+    service: SyncService = Depends(get_sync_service),
+) -> Response:
+    """返回自某版本号之后的变更列表。
+
+    每页最多 ``limit`` 条；``has_more`` 为真时以 ``next_since`` 作为 ``since`` 继续拉取。
+    ``coalesce`` 时每个实体只返回区间内的最新状态，删除仅返回不含 payload 的墓碑；
+    ``entity_type`` 可多次传入按实体类型过滤，``theme_id`` 只返回该主题相关的变更。
+    ``format=patch`` 时更新只返回 ``patch``（相对上一版本的 merge patch），删除不含 payload；
+    默认 ``format=full`` 返回物化后的完整实体。
+    ``wait`` 大于 0 时为长轮询：没有新变更则最多挂起 ``wait`` 秒，有提交立即返回。
+    响应按 ``Accept-Encoding`` 压缩；已写满的历史页不会再变化，会缓存序列化结果。
+    """
+
+    body, encoding = await service.list_changes_encoded(
+        since,
+        limit,
+        coalesce=coalesce,
+        entity_types=entity_type,
+        theme_id=theme_id,
+        payload_format=payload_format,
+        wait=wait,
+        accept_encoding=accept_encoding,
+    )
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/stream")
+async def stream_changes(
+    since: int = Query(0, ge=0),
+    coalesce: bool = Query(False),
+    entity_type: Optional[List[str]] = Query(None),
+    theme_id: Optional[UUID] = Query(None),
+    payload_format: Literal["full", "patch"] = Query("full", alias="format"),
+    last_event_id: Optional[int] = Header(None, ge=0),
+    service: SyncService = Depends(get_sync_service),
+) -> StreamingResponse:
+    """以 SSE 推送变更，每个事件的数据与 ``/sync/changes`` 的响应相同。
+
+    事件 id 为 ``next_since``，断线重连时浏览器会通过 ``Last-Event-ID`` 从断点继续；
+    空闲时定期发送注释行保活。
+    """
 
-    return await service.list_changes(since)
+    events = service.stream(
+        last_event_id if last_event_id is not None else since,
+        coalesce=coalesce,
+        entity_types=entity_type,
+        theme_id=theme_id,
+        payload_format=payload_format,
+    )
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
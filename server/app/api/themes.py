@@ -1,10 +1,12 @@
 """REST endpoints covering themes and their product associations."""
 
-from typing import List, Optional
+from typing import List, Optional, Union
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
 
+from ..core.etag import check_etag
+from ..core.pagination import NEXT_CURSOR_HEADER, cursor_param
 from ..schemas import (
     InquirySummaryResponse,
     ThemeCreate,
@@ -22,19 +24,43 @@ router = APIRouter()
 
 @router.get("", response_model=List[ThemeResponse])
 async def list_themes(
+    response: Response,
     *,
     service: ThemeService = Depends(get_theme_service),
     page_size: int = Query(20, ge=1, le=100),
     page: int = Query(1, ge=1),
     updated_after: Optional[str] = Query(None),
-) -> List[ThemeResponse]:
-    """按最近更新时间倒序列出主题。"""
-
-    return await service.list_themes(page=page, page_size=page_size, updated_after=updated_after)
+    cursor: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+) -> Union[List[ThemeResponse], Response]:
+    """按最近更新时间倒序列出主题。支持 ``If-None-Match``，数据未变时返回 304。
+
+    还有下一页时响应头 ``X-Next-Cursor`` 给出游标，作为 ``cursor`` 传入即可继续翻页
+    （优先于 ``page``），翻页期间数据变化也不会重复或遗漏。
+    """
+
+    after = cursor_param(cursor)
+    not_modified = check_etag(await service.themes_version(), if_none_match, response)
+    if not_modified is not None:
+        return not_modified
+    themes, next_cursor = await service.list_themes(
+        page=page, page_size=page_size, updated_after=updated_after, after=after
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return themes
 
 
 @router.get("/{theme_id}", response_model=ThemeResponse)
-async def get_theme(theme_id: UUID, service: ThemeService = Depends(get_theme_service)) -> ThemeResponse:
+async def get_theme(
+    theme_id: UUID,
+    response: Response,
+    service: ThemeService = Depends(get_theme_service),
+    if_none_match: Optional[str] = Header(None),
+) -> Union[ThemeResponse, Response]:
+    not_modified = check_etag(await service.theme_version(theme_id), if_none_match, response)
+    if not_modified is not None:
+        return not_modified
     theme = await service.get_theme(theme_id)
     if not theme:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Theme not found")
@@ -78,14 +104,28 @@ async def delete_theme(
 @router.get("/{theme_id}/products", response_model=List[ThemeProductResponse])
 async def list_theme_products(
     theme_id: UUID,
+    response: Response,
     *,
     service: ThemeService = Depends(get_theme_service),
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
-) -> List[ThemeProductResponse]:
-    """列出某主题下的商品。"""
-
-    return await service.list_theme_products(theme_id, page=page, page_size=page_size)
+    cursor: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+) -> Union[List[ThemeProductResponse], Response]:
+    """按加入时间倒序列出某主题下的商品。支持 ``If-None-Match`` 与 ``cursor`` 游标翻页。"""
+
+    after = cursor_param(cursor)
+    not_modified = check_etag(
+        await service.theme_products_version(theme_id), if_none_match, response
+    )
+    if not_modified is not None:
+        return not_modified
+    items, next_cursor = await service.list_theme_products(
+        theme_id, page=page, page_size=page_size, after=after
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return items
 
 
 @router.post("/{theme_id}/products", response_model=List[ThemeProductResponse])
@@ -0,0 +1,121 @@
+"""Response compression and an LRU cache of encoded response bodies.
+
+Used by endpoints whose responses are pure functions of their parameters
+(full sync pages): the body is serialised once, compressed once per content
+coding a client asks for, and then served as bytes.
+"""
+
+from __future__ import annotations
+
+import gzip
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+try:  # optional dependency
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+# bodies smaller than this are sent uncompressed; the framing costs more
+MIN_COMPRESS_BYTES = 512
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    """Content codings this server can produce, most preferred first."""
+
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the best supported coding allowed by an ``Accept-Encoding`` header."""
+
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        token, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[token.strip().lower()] = quality
+    for encoding in supported_encodings():
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    if encoding == "br":
+        return brotli.compress(body)
+    return body
+
+
+class EncodedBodyCache:
+    """LRU of serialised bodies and their compressed variants, bounded in bytes."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._entries: "OrderedDict[Hashable, Dict[Optional[str], bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, key: Hashable, accept_encoding: Optional[str]
+    ) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Return ``(body, encoding)`` for a cached key, compressing on demand."""
+
+        variants = self._entries.get(key)
+        if variants is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        result = self._variant(variants, accept_encoding)
+        self._evict()
+        return result
+
+    def put(
+        self, key: Hashable, body: bytes, accept_encoding: Optional[str]
+    ) -> Tuple[bytes, Optional[str]]:
+        """Store ``body`` and return the variant for ``accept_encoding``."""
+
+        if key not in self._entries:
+            self._entries[key] = {None: body}
+            self._size += len(body)
+        result = self._variant(self._entries[key], accept_encoding)
+        self._evict()
+        return result
+
+    def _variant(
+        self, variants: Dict[Optional[str], bytes], accept_encoding: Optional[str]
+    ) -> Tuple[bytes, Optional[str]]:
+        identity = variants[None]
+        encoding = choose_encoding(accept_encoding) if len(identity) >= MIN_COMPRESS_BYTES else None
+        if encoding is None:
+            return identity, None
+        encoded = variants.get(encoding)
+        if encoded is None:
+            encoded = variants[encoding] = compress(identity, encoding)
+            self._size += len(encoded)
+        return encoded, encoding
+
+    def _evict(self) -> None:
+        while self._size > self._max_bytes and len(self._entries) > 1:
+            _, variants = self._entries.popitem(last=False)
+            self._size -= sum(len(body) for body in variants.values())
+
+
+def encode_body(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """Compress an uncached body for ``accept_encoding`` if worthwhile."""
+
+    encoding = choose_encoding(accept_encoding) if len(body) >= MIN_COMPRESS_BYTES else None
+    return compress(body, encoding), encoding
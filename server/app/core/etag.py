@@ -0,0 +1,48 @@
+"""Version-based entity tags for conditional GET requests.
+
+Storage versions only ever grow, and any change to an entity or collection
+moves its last-modified version, so the highest version among the records a
+response is built from identifies that response. Endpoints look it up (a
+cheap storage read), answer a matching ``If-None-Match`` with ``304`` and only
+otherwise run the service and build the response models.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from fastapi import Response, status
+
+
+def make_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of ``etag`` against an ``If-None-Match`` header."""
+
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def check_etag(
+    version: int, if_none_match: Optional[str], response: Response
+) -> Optional[Response]:
+    """Tag ``response`` with ``version``; return a 304 if the client is current.
+
+    A zero version means the resource does not exist, so nothing is tagged
+    and the endpoint goes on to produce its 404.
+    """
+
+    if not version:
+        return None
+    etag = make_etag(version)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
@@ -0,0 +1,176 @@
+"""Incremental parsing of JSON row streams (NDJSON or one JSON array).
+
+Request bodies are consumed chunk by chunk and rows are yielded as soon as
+they are complete, so memory stays bounded by the largest single row rather
+than by the body. A row that fails to parse is yielded as a
+:class:`RowError` in its place; NDJSON parsing then continues with the next
+line, while a broken array ends the stream because its framing is lost (an
+array row is only known to be broken at the end of the body or once it
+outgrows :data:`MAX_ROW_BYTES`).
+
+:class:`NDJSONResponse` streams result lines back while the body is still
+being read.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Tuple, Union
+
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# rows larger than this are rejected instead of buffered
+MAX_ROW_BYTES = 1 << 20
+
+_WHITESPACE = " \t\r\n"
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+class RowError(ValueError):
+    """A row of the stream that could not be parsed."""
+
+
+Row = Tuple[int, Union[Any, RowError]]
+
+
+class NDJSONResponse(StreamingResponse):
+    """Streaming NDJSON response that may read the request body as it goes.
+
+    :class:`StreamingResponse` also consumes ``receive`` to notice client
+    disconnects, which would steal body messages from a body iterator
+    reading :meth:`Request.stream`. Here the body iterator is the only
+    reader; a disconnect surfaces as ``ClientDisconnect`` from the request
+    stream instead.
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def encode_lines(values: Iterable[Any]) -> bytes:
+    return b"".join(
+        json.dumps(value, ensure_ascii=False).encode("utf-8") + b"\n" for value in values
+    )
+
+
+async def iter_rows(chunks: AsyncIterable[bytes], *, array: bool = False) -> AsyncIterator[Row]:
+    """Yield ``(row number, value)`` pairs, numbered from 1."""
+
+    rows = _iter_array(chunks) if array else _iter_lines(chunks)
+    async for row in rows:
+        yield row
+
+
+async def _iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[Row]:
+    buffer = b""
+    number = 0
+    skipping = False  # inside an oversized line, dropping bytes until its end
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if skipping:
+                skipping = False
+                continue
+            if line.strip():
+                number += 1
+                yield number, _decode(line)
+        if len(buffer) > MAX_ROW_BYTES:
+            if not skipping:
+                number += 1
+                yield number, RowError(f"row exceeds {MAX_ROW_BYTES} bytes")
+            skipping, buffer = True, b""
+    if buffer.strip() and not skipping:
+        yield number + 1, _decode(buffer)
+
+
+async def _iter_array(chunks: AsyncIterable[bytes]) -> AsyncIterator[Row]:
+    decoder = json.JSONDecoder()
+    text = ""
+    pending = b""  # bytes of a UTF-8 sequence split across chunks
+    number = 0
+    state = "start"  # start -> value <-> separator -> end
+    async for chunk in chunks:
+        data = pending + chunk
+        try:
+            text += data.decode("utf-8")
+            pending = b""
+        except UnicodeDecodeError as exc:
+            if exc.start < len(data) - 3:
+                yield number + 1, RowError("body is not valid UTF-8")
+                return
+            text += data[: exc.start].decode("utf-8")
+            pending = data[exc.start :]
+        position = 0
+        while True:
+            position = _skip_whitespace(text, position)
+            if position == len(text):
+                break
+            if state == "start":
+                if text[position] != "[":
+                    yield number + 1, RowError("body must be a JSON array")
+                    return
+                position += 1
+                state = "first"
+            elif state in ("first", "value"):
+                if state == "first" and text[position] == "]":
+                    state, position = "end", position + 1
+                    continue
+                try:
+                    value, end = decoder.raw_decode(text, position)
+                except json.JSONDecodeError:
+                    # most likely incomplete; judged at the end of the body
+                    # or once the row outgrows MAX_ROW_BYTES
+                    break
+                if isinstance(value, (int, float)) and (
+                    end == len(text) or text[end] in _NUMBER_CHARS
+                ):
+                    break  # a number may continue in the next chunk
+                number += 1
+                yield number, value
+                position, state = end, "separator"
+            elif state == "separator":
+                if text[position] == ",":
+                    state = "value"
+                elif text[position] == "]":
+                    state = "end"
+                else:
+                    yield number + 1, RowError("expected ',' or ']' between rows")
+                    return
+                position += 1
+            else:
+                yield number + 1, RowError("unexpected data after the array")
+                return
+        text = text[position:]
+        if len(text) > MAX_ROW_BYTES:
+            yield number + 1, RowError(f"row is not valid JSON or exceeds {MAX_ROW_BYTES} bytes")
+            return
+    if state == "end" and not text.strip() and not pending:
+        return
+    try:
+        decoder.raw_decode(text, _skip_whitespace(text, 0))
+    except json.JSONDecodeError as exc:
+        if state in ("first", "value") and text.strip():
+            yield number + 1, RowError(f"invalid JSON: {exc}")
+            return
+    yield number + 1, RowError("truncated JSON array")
+
+
+def _decode(line: bytes) -> Union[Any, RowError]:
+    try:
+        return json.loads(line)
+    except (UnicodeDecodeError, ValueError) as exc:
+        return RowError(f"invalid JSON: {exc}")
+
+
+def _skip_whitespace(text: str, position: int) -> int:
+    while position < len(text) and text[position] in _WHITESPACE:
+        position += 1
+    return position
@@ -0,0 +1,59 @@
+"""Opaque keyset cursors for list endpoints.
+
+A cursor is the sort key of the last item on a page, ``(field value, id)``,
+serialised as URL-safe base64 JSON. Clients pass it back unchanged; the
+next page starts strictly after it, so it neither repeats nor skips items
+when rows are inserted or removed between requests.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(value: Any, entity_id: str) -> str:
+    raw = json.dumps([value, entity_id], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    """Inverse of :func:`encode_cursor`; raises ``ValueError`` if malformed."""
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, entity_id = json.loads(raw.decode("utf-8"))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as exc:
+        raise ValueError("invalid cursor") from exc
+    if not isinstance(entity_id, str):
+        raise ValueError("invalid cursor")
+    return value, entity_id
+
+
+def cursor_param(cursor: Optional[str]) -> Optional[Tuple[Any, str]]:
+    """Decode a ``cursor`` query parameter, answering 400 if it is malformed."""
+
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def next_cursor(
+    items: List[Dict[str, Any]], field: str, page_size: int
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Split a page fetched with one extra row into ``(page, next cursor)``."""
+
+    if len(items) <= page_size:
+        return items, None
+    page = items[:page_size]
+    last = page[-1]
+    return page, encode_cursor(last.get(field), last["id"])
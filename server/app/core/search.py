@@ -0,0 +1,114 @@
+"""In-process full-text index with BM25 ranking.
+
+Text is tokenised into lower-cased alphanumeric words plus, for runs of CJK
+characters (which carry no spaces), overlapping character bigrams: "露营帐篷"
+becomes 露营 / 营帐 / 帐篷, so any two-character query substring matches
+without a dictionary. Documents also index every CJK character on its own,
+so a one-character query (鞋, 包) matches inside longer words; a query run
+of two or more characters only looks up its far more selective bigrams.
+
+Documents are added, replaced and removed one at a time, so the index
+follows the data incrementally instead of being rebuilt per query.
+"""
+
+from __future__ import annotations
+
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# Hiragana/Katakana, CJK extension A, unified ideographs, compatibility
+# ideographs and Hangul syllables
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN = re.compile(f"([{_CJK}]+)|([^\\W_{_CJK}]+)")
+
+# standard BM25 parameters: term-frequency saturation and length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str, *, query: bool = False) -> List[str]:
+    """Split ``text`` into index terms (words, CJK characters and bigrams).
+
+    With ``query=True`` CJK runs longer than one character yield only their
+    bigrams.
+    """
+
+    tokens: List[str] = []
+    for cjk, word in _TOKEN.findall(unicodedata.normalize("NFKC", text).lower()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            if not query:
+                tokens.extend(cjk)
+            tokens.extend(cjk[i : i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+class InvertedIndex:
+    """Term postings with per-document frequencies, scored with BM25.
+
+    Not thread-safe; callers serialise access.
+    """
+
+    def __init__(self) -> None:
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._terms: Dict[str, Counter] = {}
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def put(self, doc_id: str, text: str) -> None:
+        """Index ``text`` as the content of ``doc_id``, replacing any previous one."""
+
+        self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        if not terms:
+            return
+        self._terms[doc_id] = terms
+        self._lengths[doc_id] = sum(terms.values())
+        self._total_length += self._lengths[doc_id]
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+
+    def remove(self, doc_id: str) -> None:
+        terms = self._terms.pop(doc_id, None)
+        if terms is None:
+            return
+        self._total_length -= self._lengths.pop(doc_id)
+        for term in terms:
+            posting = self._postings[term]
+            del posting[doc_id]
+            if not posting:
+                del self._postings[term]
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        """Best ``limit`` ``(doc_id, score)`` pairs for ``query``, best first.
+
+        A document matches if it contains any query term; ties are broken by
+        id so results are stable.
+        """
+
+        count = len(self._terms)
+        if not count or limit <= 0:
+            return []
+        average_length = self._total_length / count
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query, query=True)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, frequency in posting.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (
+                    frequency + norm
+                )
+        return heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
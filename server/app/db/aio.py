@@ -0,0 +1,332 @@
+"""Asyncio facade over the blocking storage backends.
+
+The services are ``async def`` and run on the event loop, while committing to
+either backend may block on file I/O (appending to the WAL, rewriting the
+snapshot, ``fsync``). :class:`AsyncStorage` runs every write, and every
+transaction body, on a small bounded thread pool so a slow flush only holds a
+worker thread instead of stalling all requests on the loop.
+
+Reads from :class:`~app.db.storage.JsonStorage` are served from the published
+in-memory snapshot without locks or I/O, so they stay inline. Backends that
+have to query a file to read (``blocking_reads = True``) are read from the
+pool as well.
+
+:class:`ChangeNotifier` bridges commits back onto the loop: coroutines
+waiting for a newer version share one :class:`asyncio.Event`, so idle
+long-poll and stream clients cost nothing until a commit wakes them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+)
+
+from .storage import Dependent, JsonStorage, get_storage
+
+if TYPE_CHECKING:  # pragma: no cover - import cycle guard
+    from .snapshot import StorageSnapshot
+    from .sqlite import SqliteSnapshot, SqliteStorage
+
+_DEFAULT_WORKERS = 4
+
+T = TypeVar("T")
+
+
+class AsyncStorage:
+    """Awaitable counterpart of the storage API backed by a bounded executor."""
+
+    def __init__(
+        self,
+        backend: Union[JsonStorage, "SqliteStorage"],
+        *,
+        max_workers: int = _DEFAULT_WORKERS,
+    ) -> None:
+        self._backend = backend
+        self._blocking_reads = getattr(backend, "blocking_reads", True)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="sdshop-storage"
+        )
+        self._notifier = ChangeNotifier(backend)
+
+    @property
+    def backend(self) -> Union[JsonStorage, "SqliteStorage"]:
+        """The synchronous storage, for code already running on a worker."""
+
+        return self._backend
+
+    # ------------------------------------------------------------------
+    # execution helpers
+    # ------------------------------------------------------------------
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run a blocking callable on the storage executor."""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def read(
+        self,
+        fn: Callable[..., T],
+        *args: Any,
+    ) -> T:
+        """Call ``fn(snapshot, *args)`` against one consistent snapshot.
+
+        Runs inline when the backend's snapshots are in memory and on the
+        executor otherwise; ``fn`` must not keep the snapshot past its return.
+        """
+
+        if self._blocking_reads:
+            return await self.run(self._read_sync, fn, args)
+        return self._read_sync(fn, args)
+
+    async def transact(self, fn: Callable[..., T], *args: Any) -> T:
+        """Call ``fn(backend, *args)`` inside one storage transaction.
+
+        The whole body runs on a single worker thread, which is what the
+        backends' thread-owned transactions require.
+        """
+
+        return await self.run(self._transact_sync, fn, args)
+
+    def _read_sync(self, fn: Callable[..., T], args: tuple) -> T:
+        with self._backend.snapshot() as snapshot:
+            return fn(snapshot, *args)
+
+    def _transact_sync(self, fn: Callable[..., T], args: tuple) -> T:
+        with self._backend.transaction():
+            return fn(self._backend, *args)
+
+    # ------------------------------------------------------------------
+    # reads
+    # ------------------------------------------------------------------
+    async def list_values(self, collection: str) -> List[Dict[str, Any]]:
+        return await self.read(_list_values, collection)
+
+    async def get(self, collection: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        return await self.read(_get, collection, entity_id)
+
+    async def get_many(
+        self, collection: str, entity_ids: Sequence[str]
+    ) -> List[Optional[Dict[str, Any]]]:
+        return await self.read(_get_many, collection, entity_ids)
+
+    async def find(self, collection: str, field: str, value: Any) -> List[Dict[str, Any]]:
+        return await self.read(_find, collection, field, value)
+
+    async def count(self, collection: str, field: str, value: Any) -> int:
+        return await self.read(_count, collection, field, value)
+
+    async def last_modified(self, entity_type: str, entity_id: Optional[str] = None) -> int:
+        return await self.read(_last_modified, entity_type, entity_id)
+
+    # ------------------------------------------------------------------
+    # writes
+    # ------------------------------------------------------------------
+    async def insert(
+        self,
+        collection: str,
+        entity: Dict[str, Any],
+        *,
+        entity_type: str,
+        action: str,
+    ) -> Dict[str, Any]:
+        return await self.run(
+            self._backend.insert, collection, entity, entity_type=entity_type, action=action
+        )
+
+    async def update(
+        self,
+        collection: str,
+        entity_id: str,
+        entity: Dict[str, Any],
+        *,
+        entity_type: str,
+        action: str,
+    ) -> Dict[str, Any]:
+        return await self.run(
+            self._backend.update,
+            collection,
+            entity_id,
+            entity,
+            entity_type=entity_type,
+            action=action,
+        )
+
+    async def delete(
+        self,
+        collection: str,
+        entity_id: str,
+        *,
+        entity_type: str,
+        action: str,
+    ) -> None:
+        await self.run(
+            self._backend.delete, collection, entity_id, entity_type=entity_type, action=action
+        )
+
+    async def delete_cascade(
+        self,
+        collection: str,
+        entity_id: str,
+        *,
+        entity_type: str,
+        action: str,
+        dependents: Sequence[Dependent] = (),
+    ) -> Optional[Dict[str, Any]]:
+        return await self.run(
+            self._backend.delete_cascade,
+            collection,
+            entity_id,
+            entity_type=entity_type,
+            action=action,
+            dependents=dependents,
+        )
+
+    async def wait_for_change(self, version: int, timeout: float) -> bool:
+        """Wait until the storage moves past ``version``; ``False`` on timeout."""
+
+        return await self._notifier.wait(version, timeout)
+
+    async def wait_durable(
+        self, version: Optional[int] = None, timeout: Optional[float] = None
+    ) -> bool:
+        """Wait until ``version`` (default: the latest) is on disk; ``False`` on timeout.
+
+        Commits return once they are visible; with the background writer
+        enabled they reach disk on its next flush. The blocking wait runs on
+        the executor so the event loop keeps serving other requests.
+        """
+
+        return await self.run(self._backend.wait_durable, version, timeout)
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+    def close(self) -> None:
+        """Wait for queued storage work, then close the backend."""
+
+        self._executor.shutdown(wait=True)
+        self._backend.close()
+
+
+class ChangeNotifier:
+    """Wakes coroutines waiting for the storage to pass a version.
+
+    The storage calls :meth:`_on_commit` from the committing thread; it only
+    schedules :meth:`_publish` on the event loop, which sets the current
+    event (waking every waiter at once) and replaces it with a fresh one.
+    """
+
+    def __init__(self, backend: Union[JsonStorage, "SqliteStorage"]) -> None:
+        self._backend = backend
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+        self._subscribed = False
+
+    async def wait(self, version: int, timeout: float) -> bool:
+        loop = self._bind()
+        deadline = loop.time() + timeout
+        # the backend version is authoritative; events only say "look again"
+        while self._backend.version <= version:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            assert self._event is not None
+            try:
+                await asyncio.wait_for(self._event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def _bind(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._event = asyncio.Event()
+        if not self._subscribed:
+            self._backend.add_listener(self._on_commit)
+            self._subscribed = True
+        return loop
+
+    def _on_commit(self, changes: List[Dict[str, Any]]) -> None:
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._publish)
+
+    def _publish(self) -> None:
+        event, self._event = self._event, asyncio.Event()
+        if event is not None:
+            event.set()
+
+
+def _list_values(
+    snapshot: Union["StorageSnapshot", "SqliteSnapshot"], collection: str
+) -> List[Dict[str, Any]]:
+    return snapshot.list_values(collection)
+
+
+def _get(
+    snapshot: Union["StorageSnapshot", "SqliteSnapshot"], collection: str, entity_id: str
+) -> Optional[Dict[str, Any]]:
+    return snapshot.get(collection, entity_id)
+
+
+def _get_many(
+    snapshot: Union["StorageSnapshot", "SqliteSnapshot"],
+    collection: str,
+    entity_ids: Sequence[str],
+) -> List[Optional[Dict[str, Any]]]:
+    return snapshot.get_many(collection, entity_ids)
+
+
+def _find(
+    snapshot: Union["StorageSnapshot", "SqliteSnapshot"],
+    collection: str,
+    field: str,
+    value: Any,
+) -> List[Dict[str, Any]]:
+    return snapshot.find(collection, field, value)
+
+
+def _count(
+    snapshot: Union["StorageSnapshot", "SqliteSnapshot"],
+    collection: str,
+    field: str,
+    value: Any,
+) -> int:
+    return snapshot.count(collection, field, value)
+
+
+def _last_modified(
+    snapshot: Union["StorageSnapshot", "SqliteSnapshot"],
+    entity_type: str,
+    entity_id: Optional[str],
+) -> int:
+    return snapshot.last_modified(entity_type, entity_id)
+
+
+_async_storage: Optional[AsyncStorage] = None
+
+
+def get_async_storage() -> AsyncStorage:
+    """Return the process-wide async facade over :func:`get_storage`."""
+
+    global _async_storage
+    if _async_storage is None:
+        _async_storage = AsyncStorage(
+            get_storage(),
+            max_workers=int(os.getenv("SDSHOP_STORAGE_WORKERS", _DEFAULT_WORKERS)),
+        )
+    return _async_storage
@@ -0,0 +1,211 @@
+"""Version-ordered change log backing the incremental sync endpoints.
+
+Changes are appended with strictly increasing versions, so lookups by version
+are a bisect over a parallel array of version numbers. Old history can be
+compacted: every change at or below the *baseline* version is collapsed into
+the latest surviving state of its entity, and entities deleted before the
+baseline drop out entirely. A client whose last synced version is older than
+the baseline may therefore have missed deletions and must resync from
+scratch.
+
+Updates are logged as merge patches (see :mod:`app.db.mergepatch`); every
+entity's history starts with an entry carrying the full payload, and
+compaction materialises the surviving entry so that this stays true.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import mergepatch
+
+EntityKey = Tuple[str, str]
+
+
+class ChangeLog:
+    """Append-only change list with O(log n) lookup by version."""
+
+    def __init__(self, entries: List[Dict[str, Any]], *, baseline: int = 0) -> None:
+        self._entries = entries
+        self._versions = [entry["version"] for entry in entries]
+        self._baseline = baseline
+        # versions of each entity's (and entity type's) entries, for
+        # materialising patches and for last-modified lookups
+        self._history: Dict[EntityKey, List[int]] = {}
+        self._type_history: Dict[str, List[int]] = {}
+        for entry in entries:
+            self._index(entry)
+
+    @property
+    def entries(self) -> List[Dict[str, Any]]:
+        return self._entries
+
+    @property
+    def baseline(self) -> int:
+        """Highest version folded into the compacted baseline."""
+
+        return self._baseline
+
+    @property
+    def latest_version(self) -> int:
+        return self._versions[-1] if self._versions else self._baseline
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def append(self, change: Dict[str, Any]) -> None:
+        self._entries.append(change)
+        self._versions.append(change["version"])
+        self._index(change)
+
+    def truncate(self, version: int) -> None:
+        """Drop changes newer than ``version`` (used to roll back)."""
+
+        cut = bisect_right(self._versions, version)
+        for change in self._entries[cut:]:
+            self._history[_entity_key(change)].pop()
+            self._type_history[change["entity_type"]].pop()
+        del self._entries[cut:]
+        del self._versions[cut:]
+
+    def since(
+        self,
+        version: int,
+        limit: Optional[int] = None,
+        *,
+        upto: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Return changes with a version greater than ``version``.
+
+        ``upto`` bounds the result to a snapshot's version so that entries a
+        writer is still appending stay invisible.
+        """
+
+        start = bisect_right(self._versions, version)
+        end = len(self._entries) if upto is None else bisect_right(self._versions, upto)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self._entries[start:end]
+
+    def last_modified(
+        self,
+        entity_type: str,
+        entity_id: Optional[str] = None,
+        *,
+        upto: Optional[int] = None,
+    ) -> int:
+        """Version of the latest change to one entity, or to any of ``entity_type``.
+
+        Returns 0 for an unknown entity. For a whole type the result is at
+        least the baseline, since compaction may have dropped the deletion
+        that last touched it; the state as of the baseline is still the
+        current one in that case.
+        """
+
+        if entity_id is None:
+            versions = self._type_history.get(entity_type, [])
+            floor = self._baseline
+        else:
+            versions = self._history.get((entity_type, entity_id), [])
+            floor = 0
+        end = len(versions) if upto is None else bisect_right(versions, upto)
+        return max(floor, versions[end - 1]) if end else floor
+
+    def materialize(self, change: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Full entity as of ``change``, replaying patches from its history."""
+
+        if change.get("patch") is None:
+            return change["payload"]
+        return mergepatch.rebuild(self._history_of(change))
+
+    def materialize_many(self, changes: Sequence[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """:meth:`materialize` for every change of a version-ordered page.
+
+        The last state rebuilt for each entity is kept, so a later change to
+        the same entity only replays the patches in between rather than its
+        whole history.
+        """
+
+        states: Dict[EntityKey, Tuple[int, Optional[Dict[str, Any]]]] = {}
+        entities: List[Optional[Dict[str, Any]]] = []
+        for change in changes:
+            key = _entity_key(change)
+            if change.get("patch") is None:
+                entity = change["payload"]
+            else:
+                after, base = states.get(key, (0, None))
+                if after > change["version"]:
+                    after, base = 0, None
+                entity = mergepatch.rebuild(self._history_of(change, after), base)
+            states[key] = (change["version"], entity)
+            entities.append(entity)
+        return entities
+
+    def _history_of(
+        self, change: Dict[str, Any], after: int = 0
+    ) -> Iterator[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """The entity's entries newer than ``after`` up to ``change``, newest first."""
+
+        versions = self._history.get(_entity_key(change), [])
+        stop = bisect_right(versions, after)
+        for position in range(bisect_right(versions, change["version"]) - 1, stop - 1, -1):
+            entry = self._entries[bisect_left(self._versions, versions[position])]
+            yield entry["payload"], entry.get("patch")
+
+    def _index(self, change: Dict[str, Any]) -> None:
+        version = change["version"]
+        self._history.setdefault(_entity_key(change), []).append(version)
+        self._type_history.setdefault(change["entity_type"], []).append(version)
+
+    def requires_reset(self, version: int) -> bool:
+        """Whether a client synced up to ``version`` has to resync from zero."""
+
+        return 0 < version < self._baseline
+
+    def compactable(self, horizon: int) -> int:
+        """Number of entries that fall behind ``horizon`` and are not yet compacted."""
+
+        cutoff = self.latest_version - horizon
+        if cutoff <= self._baseline:
+            return 0
+        return bisect_right(self._versions, cutoff) - bisect_right(self._versions, self._baseline)
+
+    def compacted(self, horizon: int) -> Tuple["ChangeLog", int]:
+        """Return a copy with history older than ``horizon`` versions collapsed.
+
+        The log itself is left untouched because published snapshots may still
+        be reading it. Returns ``(log, removed)``.
+        """
+
+        cutoff = self.latest_version - horizon
+        if cutoff <= self._baseline:
+            return self, 0
+        split = bisect_right(self._versions, cutoff)
+        latest: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for change in self._entries[:split]:
+            latest[(change["entity_type"], change["entity_id"])] = change
+        survivors = sorted(
+            (
+                full_entry(change, self.materialize(change))
+                for change in latest.values()
+                if change["action"] != "deleted"
+            ),
+            key=lambda change: change["version"],
+        )
+        log = ChangeLog(survivors + self._entries[split:], baseline=cutoff)
+        return log, split - len(survivors)
+
+
+def _entity_key(change: Dict[str, Any]) -> EntityKey:
+    return change["entity_type"], change["entity_id"]
+
+
+def full_entry(change: Dict[str, Any], payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Copy of ``change`` carrying the full ``payload`` instead of a patch."""
+
+    if change.get("patch") is None:
+        return change
+    entry = {key: value for key, value in change.items() if key not in ("patch", "refs")}
+    entry["payload"] = payload
+    return entry
@@ -0,0 +1,158 @@
+"""Serialisation codecs for the JSON storage snapshot and write-ahead log.
+
+``json`` (compact) is the default and ``json-pretty`` keeps the original
+``indent=2`` layout for people who read the file by hand. The binary codecs
+prefix the snapshot with a magic header so :func:`detect` can pick the right
+decoder on load, whatever codec the storage is configured with now:
+
+``marshal``
+    Standard library only and the fastest to load, but its format is
+    specific to the Python version that wrote it: there is no compatibility
+    guarantee between releases. The header therefore records that version
+    and a file written by another one is refused; switch the codec back to
+    ``json`` or ``msgpack`` (under the old Python) before upgrading. Not
+    meant for untrusted input, which a local storage file is not.
+``msgpack``
+    Portable and compact; needs the optional ``msgpack`` package.
+"""
+
+from __future__ import annotations
+
+import json
+import marshal
+import sys
+from typing import Any, Dict, Optional
+
+try:  # optional dependency
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+DEFAULT_CODEC = "json"
+
+
+class Codec:
+    """Encodes one document or log record to bytes and back."""
+
+    name = ""
+    # empty for text formats, which are recognised by their first byte
+    magic = b""
+
+    @property
+    def binary(self) -> bool:
+        return bool(self.magic)
+
+    def dumps(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def loads(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    def __init__(self, name: str, indent: Optional[int] = None) -> None:
+        self.name = name
+        self._indent = indent
+        self._separators = None if indent else (",", ":")
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(
+            obj, ensure_ascii=False, indent=self._indent, separators=self._separators
+        ).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class MarshalCodec(Codec):
+    name = "marshal"
+    family = b"SDMA"
+    # followed by the (major, minor) version of the Python that wrote the file
+    magic = family + bytes(sys.version_info[:2])
+
+    def dumps(self, obj: Any) -> bytes:
+        return marshal.dumps(obj, 4)
+
+    def loads(self, data: bytes) -> Any:
+        return marshal.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    magic = b"SDMP"
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+CODECS: Dict[str, Codec] = {
+    codec.name: codec
+    for codec in (
+        JsonCodec("json"),
+        JsonCodec("json-pretty", indent=2),
+        MarshalCodec(),
+        MsgpackCodec(),
+    )
+}
+
+
+# bytes of a file needed to recognise any magic
+MAGIC_SIZE = max(len(codec.magic) for codec in CODECS.values())
+
+
+def available_codecs() -> Dict[str, Codec]:
+    """Codecs usable in this environment."""
+
+    return {
+        name: codec
+        for name, codec in CODECS.items()
+        if not (isinstance(codec, MsgpackCodec) and msgpack is None)
+    }
+
+
+def get_codec(name: str) -> Codec:
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"codec must be one of {', '.join(CODECS)}")
+    if name not in available_codecs():
+        raise ValueError(f"the {name} codec requires the {name} package")
+    return codec
+
+
+def detect(prefix: bytes) -> Codec:
+    """Return the codec that wrote a file starting with ``prefix``.
+
+    Raises ``ValueError`` for a file this process cannot decode.
+    """
+
+    if prefix.startswith(MarshalCodec.family) and not prefix.startswith(MarshalCodec.magic):
+        written = prefix[len(MarshalCodec.family) : len(MarshalCodec.magic)]
+        # files written before the version was recorded have none
+        version = (
+            f"Python {written[0]}.{written[1]}"
+            if len(written) == 2 and written[0] == sys.version_info[0]
+            else "an unknown Python version"
+        )
+        raise ValueError(
+            f"storage file was written with the marshal codec by {version}, "
+            f"which Python {sys.version_info[0]}.{sys.version_info[1]} cannot read reliably; "
+            "load it with that Python and switch to the json or msgpack codec first"
+        )
+    for codec in CODECS.values():
+        if codec.binary and prefix.startswith(codec.magic):
+            if codec.name not in available_codecs():
+                raise ValueError(f"storage file needs the {codec.name} package to load")
+            return codec
+    return CODECS[DEFAULT_CODEC]
+
+
+def encode_document(codec: Codec, document: Dict[str, Any]) -> bytes:
+    return codec.magic + codec.dumps(document)
+
+
+def decode_document(data: bytes) -> Dict[str, Any]:
+    codec = detect(data[:MAGIC_SIZE])
+    return codec.loads(data[len(codec.magic):])
@@ -0,0 +1,316 @@
+"""Secondary index declarations and in-memory index structures.
+
+Indexes are declared per collection as the list of fields that foreign-key
+lookups filter on. Storage backends keep them in sync with every write and
+rebuild them when data is loaded, so "all links of a theme" costs
+O(matches) instead of a scan over the whole collection.
+
+Published indexes are shared with lock-free readers, so writers work on a
+:meth:`SecondaryIndex.copy` that shares untouched buckets and copies a bucket
+the first time it is modified. Bucket tables and buckets are
+:class:`~app.db.persistent.PersistentMap` instances, so neither copy grows
+with the size of what it copies.
+
+Unique indexes map a composite key, e.g. ``(theme_id, product_id)``, to the
+single entity carrying it, so "the link between this theme and this product"
+is one dictionary lookup and storage backends can refuse a second entity
+with the same key.
+
+Ordered indexes keep a collection (or each partition of it, e.g. the links of
+one theme) sorted by a timestamp field plus the entity id, so "newest first"
+listings, "changed after T" filters and keyset pagination walk the index
+instead of sorting every row. Timestamps are stored as epoch seconds, parsed
+once when an entity is written or loaded rather than on every query.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from .persistent import PersistentMap, PersistentSortedList
+
+SECONDARY_INDEXES: Dict[str, Tuple[str, ...]] = {
+    "theme_products": ("theme_id", "product_id"),
+    "inquiry_sessions": ("theme_id", "product_id"),
+    "inquiry_messages": ("session_id",),
+}
+
+# collection -> ((sort field, partition field or None), ...); the index is
+# looked up by its sort field
+ORDERED_INDEXES: Dict[str, Tuple[Tuple[str, Optional[str]], ...]] = {
+    "themes": (("updated_at", None), ("created_at", None)),
+    "products": (("updated_at", None), ("created_at", None)),
+    "theme_products": (("added_at", "theme_id"),),
+    "inquiry_sessions": (("created_at", None),),
+    "inquiry_messages": (("created_at", "session_id"),),
+}
+
+# collection -> (key fields, ...); every key field must also have a secondary
+# index, which is where the SQLite backend keeps its column
+UNIQUE_INDEXES: Dict[str, Tuple[Tuple[str, ...], ...]] = {
+    "theme_products": (("theme_id", "product_id"),),
+}
+
+INDEXED_COLLECTIONS: Tuple[str, ...] = tuple(
+    dict.fromkeys([*SECONDARY_INDEXES, *ORDERED_INDEXES, *UNIQUE_INDEXES])
+)
+
+
+class DuplicateKeyError(ValueError):
+    """A write would give a second entity the key of a unique index."""
+
+
+def unique_index_name(fields: Iterable[str]) -> str:
+    return ",".join(fields)
+
+
+class SecondaryIndex:
+    """Maps a field value to the ids of the entities carrying it."""
+
+    def __init__(self, field: str) -> None:
+        self.field = field
+        # maps of maps keep insertion order and give O(1) removal
+        self._buckets: PersistentMap[Any, PersistentMap[str, None]] = PersistentMap()
+        # buckets this instance may modify in place (not shared with a copy source)
+        self._owned: Set[Any] = set()
+
+    def copy(self) -> "SecondaryIndex":
+        clone = SecondaryIndex(self.field)
+        clone._buckets = self._buckets.copy()
+        return clone
+
+    def add(self, entity: Dict[str, Any]) -> None:
+        value = entity.get(self.field)
+        if value is None:
+            return
+        self._writable(value)[entity["id"]] = None
+
+    def remove(self, entity: Dict[str, Any]) -> None:
+        value = entity.get(self.field)
+        if value not in self._buckets:
+            return
+        bucket = self._writable(value)
+        bucket.pop(entity["id"], None)
+        if not bucket:
+            del self._buckets[value]
+            self._owned.discard(value)
+
+    def replace(self, old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> None:
+        if old is not None:
+            if old.get(self.field) == new.get(self.field):
+                return
+            self.remove(old)
+        self.add(new)
+
+    def ids(self, value: Any) -> List[str]:
+        return list(self._buckets.get(value, ()))
+
+    def count(self, value: Any) -> int:
+        return len(self._buckets.get(value, ()))
+
+    def _writable(self, value: Any) -> PersistentMap[str, None]:
+        bucket = self._buckets.get(value)
+        if bucket is None:
+            bucket = self._buckets[value] = PersistentMap()
+        elif value not in self._owned:
+            bucket = self._buckets[value] = bucket.copy()
+        self._owned.add(value)
+        return bucket
+
+
+class UniqueIndex:
+    """Maps a composite key to the id of the one entity carrying it.
+
+    Entries are bucketed by the first key field and buckets are copied on
+    first write like :class:`SecondaryIndex` buckets. Entities with a missing
+    key field are not indexed. If loaded data already holds duplicates, the
+    first entity added keeps the key.
+    """
+
+    def __init__(self, fields: Tuple[str, ...]) -> None:
+        self.fields = fields
+        self._buckets: PersistentMap[Any, PersistentMap[Tuple[Any, ...], str]] = PersistentMap()
+        self._owned: Set[Any] = set()
+
+    @property
+    def name(self) -> str:
+        return unique_index_name(self.fields)
+
+    def copy(self) -> "UniqueIndex":
+        clone = UniqueIndex(self.fields)
+        clone._buckets = self._buckets.copy()
+        return clone
+
+    def add(self, entity: Dict[str, Any]) -> None:
+        key = self._key(entity)
+        if key is not None:
+            self._writable(key[0]).setdefault(key[1:], entity["id"])
+
+    def remove(self, entity: Dict[str, Any]) -> None:
+        key = self._key(entity)
+        if key is None or self._buckets.get(key[0], {}).get(key[1:]) != entity["id"]:
+            return
+        bucket = self._writable(key[0])
+        del bucket[key[1:]]
+        if not bucket:
+            del self._buckets[key[0]]
+            self._owned.discard(key[0])
+
+    def replace(self, old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> None:
+        if old is not None:
+            if self._key(old) == self._key(new):
+                return
+            self.remove(old)
+        self.add(new)
+
+    def get(self, values: Tuple[Any, ...]) -> Optional[str]:
+        return self._buckets.get(values[0], {}).get(values[1:])
+
+    def check(self, entity: Dict[str, Any]) -> None:
+        """Raise :class:`DuplicateKeyError` if another entity holds ``entity``'s key."""
+
+        key = self._key(entity)
+        holder = self.get(key) if key is not None else None
+        if holder is not None and holder != entity["id"]:
+            raise DuplicateKeyError(f"{self.name}={key!r} already belongs to {holder}")
+
+    def _key(self, entity: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+        key = tuple(entity.get(field) for field in self.fields)
+        return None if None in key else key
+
+    def _writable(self, head: Any) -> PersistentMap[Tuple[Any, ...], str]:
+        bucket = self._buckets.get(head)
+        if bucket is None:
+            bucket = self._buckets[head] = PersistentMap()
+        elif head not in self._owned:
+            bucket = self._buckets[head] = bucket.copy()
+        self._owned.add(head)
+        return bucket
+
+
+def ordered_key(value: Any) -> float:
+    """Epoch seconds an ordered index stores for an ISO-8601 timestamp.
+
+    Naive times count as UTC; missing or unparsable values sort first.
+    """
+
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+        except ValueError:
+            return 0.0
+    if not isinstance(value, datetime):
+        return 0.0
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class OrderedIndex:
+    """Entity ids sorted by ``(ordered_key(field), id)``, optionally per partition.
+
+    Each partition is a :class:`~app.db.persistent.PersistentSortedList`,
+    copied on first write like :class:`SecondaryIndex` buckets; the copy
+    shares every chunk a write does not touch, so published entries are
+    never modified under a reader.
+    """
+
+    def __init__(self, field: str, group: Optional[str] = None) -> None:
+        self.field = field
+        self.group = group
+        self._partitions: PersistentMap[Any, PersistentSortedList[Tuple[Any, str]]] = (
+            PersistentMap()
+        )
+        self._owned: Set[Any] = set()
+
+    def copy(self) -> "OrderedIndex":
+        clone = OrderedIndex(self.field, self.group)
+        clone._partitions = self._partitions.copy()
+        return clone
+
+    def add(self, entity: Dict[str, Any]) -> None:
+        partition = self._partition_of(entity)
+        self._writable(partition).add(self._entry(entity))
+
+    def remove(self, entity: Dict[str, Any]) -> None:
+        partition = self._partition_of(entity)
+        if partition not in self._partitions:
+            return
+        entries = self._writable(partition)
+        if not entries.remove(self._entry(entity)):
+            return
+        if not entries:
+            del self._partitions[partition]
+            self._owned.discard(partition)
+
+    def replace(self, old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> None:
+        if old is not None:
+            if self._partition_of(old) == self._partition_of(new) and (
+                self._entry(old) == self._entry(new)
+            ):
+                return
+            self.remove(old)
+        self.add(new)
+
+    def count(self, partition: Any = None) -> int:
+        return len(self._partitions.get(partition, ()))
+
+    def scan(
+        self,
+        partition: Any = None,
+        *,
+        after: Optional[Tuple[Any, str]] = None,
+        above: Any = None,
+    ) -> Iterator[str]:
+        """Yield ids in descending order, starting below the ``after`` cursor.
+
+        ``after`` is ``(field value, id)`` of the last entity already seen;
+        with ``above`` the scan stops at the first entity whose field is not
+        later than it.
+        """
+
+        entries = self._partitions.get(partition)
+        if entries is None:
+            return
+        below = (ordered_key(after[0]), after[1]) if after is not None else None
+        floor = ordered_key(above) if above is not None else None
+        for key, entity_id in entries.descending(below):
+            if floor is not None and key <= floor:
+                return
+            yield entity_id
+
+    def _entry(self, entity: Dict[str, Any]) -> Tuple[Any, str]:
+        return ordered_key(entity.get(self.field)), entity["id"]
+
+    def _partition_of(self, entity: Dict[str, Any]) -> Any:
+        return entity.get(self.group) if self.group is not None else None
+
+    def _writable(self, partition: Any) -> PersistentSortedList[Tuple[Any, str]]:
+        entries = self._partitions.get(partition)
+        if entries is None:
+            entries = self._partitions[partition] = PersistentSortedList()
+        elif partition not in self._owned:
+            entries = self._partitions[partition] = entries.copy()
+        self._owned.add(partition)
+        return entries
+
+
+Index = Union[SecondaryIndex, OrderedIndex, UniqueIndex]
+
+
+def build_indexes(collection: str, entities: Iterable[Dict[str, Any]]) -> Dict[str, Index]:
+    """Create and populate the declared indexes of ``collection``."""
+
+    indexes: Dict[str, Index] = {
+        field: SecondaryIndex(field) for field in SECONDARY_INDEXES.get(collection, ())
+    }
+    for field, group in ORDERED_INDEXES.get(collection, ()):
+        indexes[field] = OrderedIndex(field, group)
+    for fields in UNIQUE_INDEXES.get(collection, ()):
+        indexes[unique_index_name(fields)] = UniqueIndex(fields)
+    if indexes:
+        for entity in entities:
+            for index in indexes.values():
+                index.add(entity)
+    return indexes
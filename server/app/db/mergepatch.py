@@ -0,0 +1,72 @@
+"""JSON Merge Patch (RFC 7396) helpers for change-log payloads.
+
+An update is logged as the merge patch that turns the previous version of the
+entity into the new one instead of the whole entity: changed keys carry their
+new value, nested objects are diffed recursively and removed keys map to
+``null``. As in the RFC, ``null`` cannot be told apart from a missing key, so
+a field set to ``None`` is absent from a materialised entity.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+def diff(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the merge patch that turns ``old`` into ``new``."""
+
+    patch: Dict[str, Any] = {key: None for key in old if key not in new}
+    for key, value in new.items():
+        if key not in old:
+            if value is not None:
+                patch[key] = value
+            continue
+        previous = old[key]
+        if previous == value:
+            continue
+        if isinstance(previous, dict) and isinstance(value, dict):
+            patch[key] = diff(previous, value)
+        else:
+            patch[key] = value
+    return patch
+
+
+def apply(target: Any, patch: Any) -> Any:
+    """Apply a merge patch, returning a new value; ``target`` is not modified."""
+
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply(result.get(key), value)
+    return result
+
+
+def rebuild(
+    history: Iterable[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]],
+    base: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Materialise an entity from its ``(payload, patch)`` history, newest first.
+
+    Walks back to the latest entry that carries a full payload and replays the
+    newer patches on top of it. ``base`` is the entity as it was just before
+    the oldest entry of ``history``, if the caller already knows it; it is
+    used when no entry carries a full payload.
+    """
+
+    patches = []
+    for payload, patch in history:
+        if patch is None:
+            entity = payload
+            break
+        patches.append(patch)
+    else:
+        if base is None:
+            return None
+        entity = base
+    for patch in reversed(patches):
+        entity = apply(entity, patch)
+    return entity
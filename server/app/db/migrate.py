@@ -0,0 +1,94 @@
+"""Convert a JSON storage file into the SQLite backend.
+
+Usage::
+
+    python -m app.db.migrate [--source data/storage.json] [--target data/storage.sqlite3]
+
+The JSON store is opened read-only, in the codec and layout (single file or
+shard directory) it was written with: a pending ``storage.wal`` is replayed
+in memory and nothing under the source is rewritten. It is copied with its
+versions and change history intact, so clients keep syncing from the
+version they already have.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from .codec import DEFAULT_CODEC, MAGIC_SIZE, detect, get_codec
+from .shards import CHANGES_SHARD, ShardDirectory
+from .sqlite import SqliteStorage
+from .storage import COLLECTIONS, JsonStorage, default_storage_path
+
+
+def open_source(source: Path) -> JsonStorage:
+    """Open the JSON store at ``source`` read-only, as it was written."""
+
+    shards = _shard_directory(source)
+    sharded = shards.exists()
+    codec = DEFAULT_CODEC
+    for path in (shards.path(CHANGES_SHARD) if sharded else source, source.with_suffix(".wal")):
+        if path.exists() and path.stat().st_size:
+            with path.open("rb") as handle:
+                codec = detect(handle.read(MAGIC_SIZE)).name
+            break
+    return JsonStorage(source, codec=codec, sharded=sharded, read_only=True)
+
+
+def source_exists(source: Path) -> bool:
+    return (
+        source.exists()
+        or source.with_suffix(".wal").exists()
+        or _shard_directory(source).exists()
+    )
+
+
+def _shard_directory(source: Path) -> ShardDirectory:
+    # the codec only matters for writing shards, which never happens here
+    return ShardDirectory(source.with_suffix(""), get_codec(DEFAULT_CODEC))
+
+
+def migrate(source: Path, target: Path) -> int:
+    """Copy ``source`` into a new SQLite database at ``target``.
+
+    Returns the number of entities copied.
+    """
+
+    if target.exists():
+        raise FileExistsError(f"{target} already exists")
+    json_storage = open_source(source)
+    try:
+        document = {
+            collection: {entity["id"]: entity for entity in json_storage.list_values(collection)}
+            for collection in COLLECTIONS
+        }
+        document["changes"] = json_storage.list_changes_since(0)
+        document["version"] = json_storage.version
+        document["changes_baseline"] = json_storage.changes_baseline
+    finally:
+        json_storage.close()
+    sqlite_storage = SqliteStorage(target)
+    try:
+        sqlite_storage.import_document(document)
+    finally:
+        sqlite_storage.close()
+    return sum(len(document[collection]) for collection in COLLECTIONS)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", type=Path, default=default_storage_path("json"))
+    parser.add_argument("--target", type=Path, default=default_storage_path("sqlite"))
+    args = parser.parse_args(argv)
+    if not source_exists(args.source):
+        parser.error(f"{args.source} does not exist")
+    copied = migrate(args.source, args.target)
+    print(f"migrated {copied} entities from {args.source} to {args.target}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""Copy-on-write containers for the structures storage snapshots share.
+
+Published snapshots are read without a lock, so a writer may never modify
+anything a reader can reach. Copying a whole collection or index for that
+makes every write cost O(collection size). The containers here split their
+contents into small blocks instead: ``copy()`` duplicates only the list of
+block references, and a write copies just the block it modifies, the first
+time it modifies it after a copy.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import ItemsView, ValuesView
+from itertools import chain
+from operator import itemgetter
+from typing import (
+    Any,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+K = TypeVar("K")
+V = TypeVar("V")
+T = TypeVar("T")
+
+# average entries per hash bucket before the bucket count doubles
+BUCKET_SIZE = 256
+# entries per ordered chunk before it is split
+CHUNK_SIZE = 512
+
+# fields of a chunk entry, (sequence, key, value)
+_KEY = itemgetter(1)
+_VALUE = itemgetter(2)
+_ITEM = itemgetter(1, 2)
+
+
+class PersistentMap(MutableMapping[K, V]):
+    """Insertion-ordered mapping whose copies share unmodified blocks.
+
+    Lookups go through hash buckets of ``key -> (sequence, value)``;
+    iteration walks chunks of ``(sequence, key, value)`` in insertion order,
+    so the map iterates like a ``dict`` (replacing a value keeps its
+    position). Only the owner of a copy may modify it.
+    """
+
+    __slots__ = (
+        "_buckets",
+        "_mask",
+        "_bucket_owned",
+        "_chunks",
+        "_firsts",
+        "_chunk_owned",
+        "_next",
+        "_len",
+    )
+
+    def __init__(self, items: Optional[Mapping[K, V]] = None) -> None:
+        pairs = list(items.items()) if items else []
+        count = 1
+        while count * BUCKET_SIZE < len(pairs):
+            count *= 2
+        entries = [(sequence, key, value) for sequence, (key, value) in enumerate(pairs)]
+        self._buckets: List[Dict[K, Tuple[int, V]]] = [{} for _ in range(count)]
+        for sequence, key, value in entries:
+            self._buckets[hash(key) & (count - 1)][key] = (sequence, value)
+        self._mask = count - 1
+        self._bucket_owned = bytearray(b"\x01") * count
+        self._chunks: List[List[Tuple[int, K, V]]] = [
+            entries[start : start + CHUNK_SIZE] for start in range(0, len(entries), CHUNK_SIZE)
+        ]
+        # sequence number of the first entry of each chunk
+        self._firsts = [chunk[0][0] for chunk in self._chunks]
+        self._chunk_owned = bytearray(b"\x01") * len(self._chunks)
+        self._next = len(entries)
+        self._len = len(entries)
+
+    def copy(self) -> "PersistentMap[K, V]":
+        clone: PersistentMap[K, V] = PersistentMap.__new__(PersistentMap)
+        clone._buckets = list(self._buckets)
+        clone._mask = self._mask
+        clone._chunks = list(self._chunks)
+        clone._firsts = list(self._firsts)
+        clone._next = self._next
+        clone._len = self._len
+        # every block is now shared, so neither side may modify it in place;
+        # ownership flags are bytearrays so resetting them is one zeroed allocation
+        clone._bucket_owned = bytearray(len(self._buckets))
+        clone._chunk_owned = bytearray(len(self._chunks))
+        self._bucket_owned = bytearray(len(self._buckets))
+        self._chunk_owned = bytearray(len(self._chunks))
+        return clone
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._buckets[hash(key) & self._mask]
+
+    def __getitem__(self, key: K) -> V:
+        return self._buckets[hash(key) & self._mask][key][1]
+
+    def get(self, key: K, default: Any = None) -> Any:
+        entry = self._buckets[hash(key) & self._mask].get(key)
+        return default if entry is None else entry[1]
+
+    def __iter__(self) -> Iterator[K]:
+        return map(_KEY, chain.from_iterable(self._chunks))
+
+    def values(self) -> ValuesView:
+        return _Values(self)
+
+    def items(self) -> ItemsView:
+        return _Items(self)
+
+    def __setitem__(self, key: K, value: V) -> None:
+        position = hash(key) & self._mask
+        entry = self._buckets[position].get(key)
+        if entry is None:
+            sequence = self._next
+            self._next += 1
+            self._len += 1
+            self._append((sequence, key, value))
+            self._bucket(position)[key] = (sequence, value)
+            if self._len > len(self._buckets) * BUCKET_SIZE:
+                self._rehash()
+            return
+        sequence = entry[0]
+        index = bisect_right(self._firsts, sequence) - 1
+        chunk = self._chunk(index)
+        chunk[bisect_left(chunk, (sequence,))] = (sequence, key, value)
+        self._bucket(position)[key] = (sequence, value)
+
+    def __delitem__(self, key: K) -> None:
+        position = hash(key) & self._mask
+        entry = self._buckets[position].get(key)
+        if entry is None:
+            raise KeyError(key)
+        del self._bucket(position)[key]
+        self._len -= 1
+        sequence = entry[0]
+        index = bisect_right(self._firsts, sequence) - 1
+        chunk = self._chunk(index)
+        offset = bisect_left(chunk, (sequence,))
+        del chunk[offset]
+        if not chunk:
+            del self._chunks[index], self._firsts[index], self._chunk_owned[index]
+            return
+        if offset == 0:
+            self._firsts[index] = chunk[0][0]
+        if len(chunk) < CHUNK_SIZE // 4:
+            left = _merge_neighbour(self._chunks, self._chunk_owned, index)
+            if left is not None:
+                del self._firsts[left + 1]
+
+    def __repr__(self) -> str:
+        return f"PersistentMap({dict(self.items())!r})"
+
+    def _append(self, entry: Tuple[int, K, V]) -> None:
+        if not self._chunks or len(self._chunks[-1]) >= CHUNK_SIZE:
+            self._chunks.append([entry])
+            self._firsts.append(entry[0])
+            self._chunk_owned.append(1)
+        else:
+            self._chunk(len(self._chunks) - 1).append(entry)
+
+    def _bucket(self, position: int) -> Dict[K, Tuple[int, V]]:
+        if not self._bucket_owned[position]:
+            self._buckets[position] = dict(self._buckets[position])
+            self._bucket_owned[position] = 1
+        return self._buckets[position]
+
+    def _chunk(self, index: int) -> List[Tuple[int, K, V]]:
+        if not self._chunk_owned[index]:
+            self._chunks[index] = list(self._chunks[index])
+            self._chunk_owned[index] = 1
+        return self._chunks[index]
+
+    def _rehash(self) -> None:
+        count = 2 * len(self._buckets)
+        buckets: List[Dict[K, Tuple[int, V]]] = [{} for _ in range(count)]
+        for chunk in self._chunks:
+            for sequence, key, value in chunk:
+                buckets[hash(key) & (count - 1)][key] = (sequence, value)
+        self._buckets = buckets
+        self._mask = count - 1
+        self._bucket_owned = bytearray(b"\x01") * count
+
+
+class _Values(ValuesView):
+    def __iter__(self) -> Iterator[Any]:
+        return map(_VALUE, chain.from_iterable(self._mapping._chunks))
+
+
+class _Items(ItemsView):
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        return map(_ITEM, chain.from_iterable(self._mapping._chunks))
+
+
+class PersistentSortedList(Generic[T]):
+    """Sorted list split into chunks; copies share unmodified chunks.
+
+    Only the owner of a copy may modify it.
+    """
+
+    __slots__ = ("_chunks", "_maxes", "_owned", "_len")
+
+    def __init__(self, items: Iterable[T] = ()) -> None:
+        ordered = sorted(items)
+        self._chunks: List[List[T]] = [
+            ordered[start : start + CHUNK_SIZE] for start in range(0, len(ordered), CHUNK_SIZE)
+        ]
+        # last (largest) item of each chunk
+        self._maxes: List[T] = [chunk[-1] for chunk in self._chunks]
+        self._owned = bytearray(b"\x01") * len(self._chunks)
+        self._len = len(ordered)
+
+    def copy(self) -> "PersistentSortedList[T]":
+        clone: PersistentSortedList[T] = PersistentSortedList.__new__(PersistentSortedList)
+        clone._chunks = list(self._chunks)
+        clone._maxes = list(self._maxes)
+        clone._len = self._len
+        clone._owned = bytearray(len(self._chunks))
+        self._owned = bytearray(len(self._chunks))
+        return clone
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, item: T) -> None:
+        self._len += 1
+        if not self._chunks:
+            self._chunks.append([item])
+            self._maxes.append(item)
+            self._owned.append(1)
+            return
+        index = min(bisect_left(self._maxes, item), len(self._chunks) - 1)
+        chunk = self._chunk(index)
+        insort(chunk, item)
+        self._maxes[index] = chunk[-1]
+        if len(chunk) > CHUNK_SIZE:
+            half = len(chunk) // 2
+            self._chunks[index : index + 1] = [chunk[:half], chunk[half:]]
+            self._maxes[index : index + 1] = [chunk[half - 1], chunk[-1]]
+            self._owned[index : index + 1] = b"\x01\x01"
+
+    def remove(self, item: T) -> bool:
+        """Remove ``item``; returns ``False`` if it is not in the list."""
+
+        index = bisect_left(self._maxes, item)
+        if index == len(self._chunks):
+            return False
+        position = bisect_left(self._chunks[index], item)
+        if self._chunks[index][position] != item:
+            return False
+        chunk = self._chunk(index)
+        del chunk[position]
+        self._len -= 1
+        if not chunk:
+            del self._chunks[index], self._maxes[index], self._owned[index]
+            return True
+        self._maxes[index] = chunk[-1]
+        if len(chunk) < CHUNK_SIZE // 4:
+            left = _merge_neighbour(self._chunks, self._owned, index)
+            if left is not None:
+                del self._maxes[left]
+        return True
+
+    def descending(self, below: Optional[T] = None) -> Iterator[T]:
+        """Yield items in descending order, only those below ``below`` if given."""
+
+        chunks = self._chunks
+        index = len(chunks) - 1
+        position = len(chunks[index]) if chunks else 0
+        if below is not None:
+            index = bisect_left(self._maxes, below)
+            if index == len(chunks):
+                index -= 1
+                position = len(chunks[index]) if chunks else 0
+            else:
+                position = bisect_left(chunks[index], below)
+        while index >= 0:
+            chunk = chunks[index]
+            for offset in range(position - 1, -1, -1):
+                yield chunk[offset]
+            index -= 1
+            position = len(chunks[index]) if index >= 0 else 0
+
+    def _chunk(self, index: int) -> List[T]:
+        if not self._owned[index]:
+            self._chunks[index] = list(self._chunks[index])
+            self._owned[index] = 1
+        return self._chunks[index]
+
+
+def _merge_neighbour(chunks: List[List[Any]], owned: bytearray, index: int) -> Optional[int]:
+    """Merge a shrunken chunk with a neighbour so chunks stay reasonably full.
+
+    Returns the index of the merged chunk, or ``None`` if neither neighbour
+    has room.
+    """
+
+    for left in (index - 1, index):
+        right = left + 1
+        if left < 0 or right >= len(chunks):
+            continue
+        if len(chunks[left]) + len(chunks[right]) > CHUNK_SIZE:
+            continue
+        chunks[left : right + 1] = [chunks[left] + chunks[right]]
+        owned[left : right + 1] = b"\x01"
+        return left
+    return None
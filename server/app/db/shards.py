@@ -0,0 +1,136 @@
+"""Per-collection shard files for :class:`~app.db.storage.JsonStorage`.
+
+With sharding enabled, the single snapshot file is replaced by a directory
+holding one file per collection, plus ``changes.shard`` for the change log
+and the storage version. A checkpoint rewrites only the shards that changed
+since the previous one, so posting an inquiry message no longer re-serialises
+every product.
+
+Every shard records the storage version it was written at. On startup only
+the change log is read eagerly. Log records are replayed into the shards
+they touch, skipping versions that shard already holds, and every other
+collection (and its secondary indexes) is loaded the first time it is read.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, Optional, Tuple
+
+from .codec import Codec, decode_document, encode_document
+
+SHARD_SUFFIX = ".shard"
+CHANGES_SHARD = "changes"
+
+
+class ShardDirectory:
+    """Reads and encodes the shard files under one directory."""
+
+    def __init__(self, directory: Path, codec: Codec) -> None:
+        self._directory = directory
+        self._codec = codec
+
+    @property
+    def directory(self) -> Path:
+        return self._directory
+
+    def exists(self) -> bool:
+        return self.path(CHANGES_SHARD).exists()
+
+    def path(self, name: str) -> Path:
+        return self._directory / f"{name}{SHARD_SUFFIX}"
+
+    def read(self, name: str) -> Tuple[int, Optional[Any]]:
+        """Return ``(version, data)`` of a shard; ``(0, None)`` if missing."""
+
+        path = self.path(name)
+        if not path.exists():
+            return 0, None
+        document = decode_document(path.read_bytes())
+        return int(document["version"]), document["data"]
+
+    def encode(self, version: int, data: Any) -> bytes:
+        return encode_document(self._codec, {"version": version, "data": data})
+
+    def remove(self) -> None:
+        """Delete every shard file (after converting back to a single file)."""
+
+        if self._directory.is_dir():
+            for path in self._directory.glob(f"*{SHARD_SUFFIX}"):
+                path.unlink()
+
+
+class _LoadOnce:
+    """Thread-safe cache that loads each key at most once."""
+
+    def __init__(self, loader: Callable[[str], Any]) -> None:
+        self._loader = loader
+        self._values: Dict[str, Any] = {}
+        self._lock = Lock()
+
+    def get(self, key: str) -> Any:
+        try:
+            return self._values[key]
+        except KeyError:
+            with self._lock:
+                if key not in self._values:
+                    self._values[key] = self._loader(key)
+                return self._values[key]
+
+    def preload(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._values[key] = value
+
+    def loaded(self, key: str) -> bool:
+        return key in self._values
+
+
+class LazyMapping(Mapping[str, Any]):
+    """Read-only mapping whose values are loaded on first access.
+
+    Values written since startup live in ``overrides``; :meth:`merged`
+    returns a new mapping with more overrides and shares the loaded values,
+    so snapshots published by successive commits never load a shard twice.
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        source: _LoadOnce,
+        overrides: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self._keys = tuple(dict.fromkeys(keys))
+        self._source = source
+        self._overrides = overrides or {}
+
+    @classmethod
+    def of(cls, keys: Iterable[str], loader: Callable[[str], Any]) -> "LazyMapping":
+        return cls(keys, _LoadOnce(loader))
+
+    @property
+    def source(self) -> _LoadOnce:
+        return self._source
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._overrides:
+            return self._overrides[key]
+        if key not in self._keys:
+            raise KeyError(key)
+        return self._source.get(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def is_loaded(self, key: str) -> bool:
+        return key in self._overrides or self._source.loaded(key)
+
+    def merged(self, updates: Mapping[str, Any]) -> "LazyMapping":
+        return LazyMapping(
+            self._keys + tuple(key for key in updates if key not in self._keys),
+            self._source,
+            {**self._overrides, **updates},
+        )
@@ -0,0 +1,174 @@
+"""Immutable read views over :class:`~app.db.storage.JsonStorage`.
+
+Writers never modify anything a reader can reach: they copy the blocks of the
+collections and indexes they touch (see :mod:`app.db.persistent`), and
+publish a new :class:`StorageSnapshot` when the transaction commits. Taking a
+snapshot is therefore just reading an attribute, needs no lock, and every
+read made through one snapshot (a theme and then its products, say) observes
+the same version.
+"""
+
+from __future__ import annotations
+
+from types import MappingProxyType
+from itertools import islice
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .changelog import ChangeLog
+from .indexes import Index, OrderedIndex, SecondaryIndex, UniqueIndex, unique_index_name
+
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+
+class StorageSnapshot:
+    """Version-stamped, read-only view of the storage.
+
+    Entities returned from a snapshot are shared with the storage and must be
+    treated as read-only; copy a record before changing it.
+    """
+
+    __slots__ = ("_version", "_collections", "_indexes", "_changes")
+
+    def __init__(
+        self,
+        version: int,
+        collections: Mapping[str, Mapping[str, Any]],
+        indexes: Mapping[str, Dict[str, Index]],
+        changes: ChangeLog,
+    ) -> None:
+        self._version = version
+        self._collections = collections
+        self._indexes = indexes
+        self._changes = changes
+
+    def __enter__(self) -> "StorageSnapshot":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        return None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def collections(self) -> Mapping[str, Mapping[str, Any]]:
+        return self._collections
+
+    @property
+    def indexes(self) -> Mapping[str, Dict[str, Index]]:
+        return self._indexes
+
+    @property
+    def changes(self) -> ChangeLog:
+        return self._changes
+
+    @property
+    def changes_baseline(self) -> int:
+        return self._changes.baseline
+
+    def list_values(self, collection: str) -> List[Dict[str, Any]]:
+        return list(self._collections.get(collection, _EMPTY).values())
+
+    def get(self, collection: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        return self._collections.get(collection, _EMPTY).get(entity_id)
+
+    def get_many(
+        self, collection: str, entity_ids: Sequence[str]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Entities for ``entity_ids`` in order, ``None`` where one is missing."""
+
+        coll = self._collections.get(collection, _EMPTY)
+        return [coll.get(entity_id) for entity_id in entity_ids]
+
+    def find(self, collection: str, field: str, value: Any) -> List[Dict[str, Any]]:
+        """Return entities whose indexed ``field`` equals ``value``."""
+
+        coll = self._collections.get(collection, _EMPTY)
+        return [coll[entity_id] for entity_id in self._index(collection, field).ids(value)]
+
+    def count(self, collection: str, field: str, value: Any) -> int:
+        return self._index(collection, field).count(value)
+
+    def lookup(self, collection: str, key: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the entity whose unique-index key is ``key``, if any.
+
+        ``key`` maps the index fields, in declaration order, to their values.
+        """
+
+        entity_id = self._unique(collection, key).get(tuple(key.values()))
+        if entity_id is None:
+            return None
+        return self._collections.get(collection, _EMPTY).get(entity_id)
+
+    def scan(
+        self,
+        collection: str,
+        field: str,
+        *,
+        partition: Any = None,
+        after: Optional[Tuple[Any, str]] = None,
+        above: Any = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Entities in descending ``(field, id)`` order from an ordered index.
+
+        ``partition`` selects one group of a partitioned index (the links of
+        one theme, say); ``after`` is the ``(field value, id)`` keyset cursor
+        of the last entity of the previous page; ``above`` keeps only
+        entities whose field is strictly later than that timestamp.
+        """
+
+        coll = self._collections.get(collection, _EMPTY)
+        ids = islice(
+            self._ordered(collection, field).scan(partition, after=after, above=above),
+            offset,
+            None if limit is None else offset + limit,
+        )
+        return [coll[entity_id] for entity_id in ids]
+
+    def list_changes_since(
+        self, version: int, limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        return self._changes.since(version, limit, upto=self._version)
+
+    def last_modified(self, entity_type: str, entity_id: Optional[str] = None) -> int:
+        """Version of the latest change to an entity, or to an entity type."""
+
+        return self._changes.last_modified(entity_type, entity_id, upto=self._version)
+
+    def last_modified_many(self, entity_type: str, entity_ids: Sequence[str]) -> List[int]:
+        return [
+            self._changes.last_modified(entity_type, entity_id, upto=self._version)
+            for entity_id in entity_ids
+        ]
+
+    def materialize(self, change: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Full entity as of ``change`` (``None`` for a deletion)."""
+
+        return self._changes.materialize(change)
+
+    def materialize_many(self, changes: Sequence[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """Full entities as of each of ``changes``, given in version order."""
+
+        return self._changes.materialize_many(changes)
+
+    def _index(self, collection: str, field: str) -> SecondaryIndex:
+        index = self._indexes.get(collection, _EMPTY).get(field)
+        if not isinstance(index, SecondaryIndex):
+            raise ValueError(f"{collection}.{field} is not an indexed field")
+        return index
+
+    def _unique(self, collection: str, key: Mapping[str, Any]) -> UniqueIndex:
+        name = unique_index_name(key)
+        index = self._indexes.get(collection, _EMPTY).get(name)
+        if not isinstance(index, UniqueIndex):
+            raise ValueError(f"{collection} has no unique index on ({name})")
+        return index
+
+    def _ordered(self, collection: str, field: str) -> OrderedIndex:
+        index = self._indexes.get(collection, _EMPTY).get(field)
+        if not isinstance(index, OrderedIndex):
+            raise ValueError(f"{collection}.{field} has no ordered index")
+        return index
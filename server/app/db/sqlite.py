@@ -0,0 +1,800 @@
+"""SQLite storage backend implementing the :class:`JsonStorage` contract.
+
+Sits between the single JSON file and a PostgreSQL server: every collection
+is a table holding the JSON document plus the foreign-key columns declared in
+:data:`app.db.indexes.SECONDARY_INDEXES` (each with a real index), and the
+change log is a table keyed by version. The database runs in WAL journal mode
+so a write only touches the pages it changes. Select it with
+``SDSHOP_STORAGE_BACKEND=sqlite``; ``python -m app.db.migrate`` converts an
+existing ``storage.json``.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import RLock, get_ident, local
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from . import mergepatch
+from .indexes import (
+    ORDERED_INDEXES,
+    SECONDARY_INDEXES,
+    UNIQUE_INDEXES,
+    DuplicateKeyError,
+    ordered_key,
+    unique_index_name,
+)
+from .storage import (
+    _DEFAULT_SYNC_HORIZON,
+    COLLECTIONS,
+    ChangeListener,
+    CommitListeners,
+    Dependent,
+    Transaction,
+    change_entry,
+)
+from .writer import FSYNC_POLICIES, FlushStats
+
+_SYNCHRONOUS = {"always": "FULL", "interval": "NORMAL", "never": "OFF"}
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class SqliteStorage:
+    """Document store on top of SQLite with indexed foreign keys."""
+
+    # reads query the database file
+    blocking_reads = True
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        sync_horizon: int = _DEFAULT_SYNC_HORIZON,
+        fsync: str = "never",
+    ) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+        self._path = path
+        self._lock = RLock()
+        self._tx: Optional[Transaction] = None
+        self._sync_horizon = max(1, sync_horizon)
+        self._fsync = fsync
+        self._flush_stats = FlushStats()
+        self._listeners = CommitListeners()
+        self._tables = set()
+        self._readers = local()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={_SYNCHRONOUS[fsync]}")
+        self._create_schema()
+        self._version = self._committed_version = self._meta("version")
+        self._baseline = self._meta("changes_baseline")
+
+    # ------------------------------------------------------------------
+    # public helpers
+    # ------------------------------------------------------------------
+    def snapshot(self) -> "SqliteSnapshot":
+        """Return a consistent read view; use it as a context manager.
+
+        Each thread reads through its own connection, so thanks to WAL mode
+        readers neither take the storage lock nor block the writer. Inside a
+        transaction the owning thread reads through the write connection and
+        sees its own uncommitted writes.
+        """
+
+        tx = self._tx
+        if tx is not None and tx.owner == get_ident():
+            return SqliteSnapshot(self, self._conn, begin=False)
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = sqlite3.connect(str(self._path), isolation_level=None)
+        return SqliteSnapshot(self, conn, begin=True)
+
+    def list_values(self, collection: str) -> List[Dict[str, Any]]:
+        with self.snapshot() as snap:
+            return snap.list_values(collection)
+
+    def get(self, collection: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        with self.snapshot() as snap:
+            return snap.get(collection, entity_id)
+
+    def get_many(
+        self, collection: str, entity_ids: Sequence[str]
+    ) -> List[Optional[Dict[str, Any]]]:
+        with self.snapshot() as snap:
+            return snap.get_many(collection, entity_ids)
+
+    def find(self, collection: str, field: str, value: Any) -> List[Dict[str, Any]]:
+        """Return entities whose indexed ``field`` equals ``value``."""
+
+        with self.snapshot() as snap:
+            return snap.find(collection, field, value)
+
+    def count(self, collection: str, field: str, value: Any) -> int:
+        with self.snapshot() as snap:
+            return snap.count(collection, field, value)
+
+    def lookup(self, collection: str, key: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the entity whose unique-index key is ``key``, if any."""
+
+        with self.snapshot() as snap:
+            return snap.lookup(collection, key)
+
+    def insert(
+        self,
+        collection: str,
+        entity: Dict[str, Any],
+        *,
+        entity_type: str,
+        action: str,
+    ) -> Dict[str, Any]:
+        with self.transaction():
+            self._put_locked(collection, entity["id"], entity, entity_type, action)
+        return entity
+
+    def update(
+        self,
+        collection: str,
+        entity_id: str,
+        entity: Dict[str, Any],
+        *,
+        entity_type: str,
+        action: str,
+    ) -> Dict[str, Any]:
+        with self.transaction():
+            self._put_locked(collection, entity_id, entity, entity_type, action)
+        return entity
+
+    def delete(
+        self,
+        collection: str,
+        entity_id: str,
+        *,
+        entity_type: str,
+        action: str,
+    ) -> Optional[Dict[str, Any]]:
+        table = self._table(collection)
+        with self.transaction():
+            existing = self._row(collection, entity_id)
+            if existing is None:
+                return None
+            self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (entity_id,))
+            self._record_change_locked(
+                collection, entity_type, entity_id, action, None, existing
+            )
+            return existing
+
+    def delete_cascade(
+        self,
+        collection: str,
+        entity_id: str,
+        *,
+        entity_type: str,
+        action: str,
+        dependents: Sequence[Dependent] = (),
+    ) -> Optional[Dict[str, Any]]:
+        """Delete an entity and the records referencing it in one commit."""
+
+        with self.transaction():
+            existing = self.delete(collection, entity_id, entity_type=entity_type, action=action)
+            if existing is None:
+                return None
+            for dependent, field, dependent_type in dependents:
+                table = self._indexed(dependent, field)
+                records = self.find(dependent, field, entity_id)
+                self._conn.execute(f"DELETE FROM {table} WHERE {field} = ?", (entity_id,))
+                for record in records:
+                    self._record_change_locked(
+                        dependent, dependent_type, record["id"], action, None, record
+                    )
+            return existing
+
+    @contextmanager
+    def transaction(self) -> Iterator[Transaction]:
+        """Group several writes into one SQLite transaction.
+
+        Same semantics as :meth:`JsonStorage.transaction`: one commit, a
+        contiguous version range, rollback on exception, nested blocks join
+        the enclosing transaction.
+        """
+
+        with self._lock:
+            if self._tx is not None:
+                yield self._tx
+                return
+            tx = self._tx = Transaction(self._version)
+            started = time.perf_counter()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield tx
+                if tx.versions is not None:
+                    self._set_meta("version", self._version)
+                    # amortised: compact once a full horizon's worth of history
+                    # has piled up behind the cutoff
+                    if self._version - self._baseline >= 2 * self._sync_horizon:
+                        self._compact_changes_locked()
+                self._conn.execute("COMMIT")
+                self._committed_version = self._version
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._version = tx.base_version
+                self._baseline = self._meta("changes_baseline")
+                raise
+            finally:
+                self._tx = None
+            if tx.versions is not None:
+                first, last = tx.versions
+                self._flush_stats.observe(last - first + 1, time.perf_counter() - started)
+                self._listeners.notify(tx.changes)
+
+    def add_listener(self, callback: ChangeListener) -> None:
+        """Call ``callback(changes)`` after every commit (see :class:`CommitListeners`)."""
+
+        self._listeners.add(callback)
+
+    def remove_listener(self, callback: ChangeListener) -> None:
+        self._listeners.remove(callback)
+
+    def list_changes_since(self, version: int) -> List[Dict[str, Any]]:
+        with self.snapshot() as snap:
+            return snap.list_changes_since(version)
+
+    @property
+    def changes_baseline(self) -> int:
+        """Versions at or below this value have been compacted away."""
+
+        return self._baseline
+
+    @property
+    def version(self) -> int:
+        tx = self._tx
+        if tx is not None and tx.owner == get_ident():
+            return self._version
+        return self._committed_version
+
+    def compact_changes(self) -> int:
+        """Compact change history older than the sync horizon."""
+
+        with self.transaction():
+            return self._compact_changes_locked()
+
+    def wait_durable(self, version: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        # commits are durable (per the synchronous pragma) when they return
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._flush_stats.as_dict()
+        stats.update(
+            {
+                "writer": "sqlite",
+                "fsync": self._fsync,
+                "pending": 0,
+                "version": self._version,
+                "durable_version": self._version,
+            }
+        )
+        return stats
+
+    def checkpoint(self) -> None:
+        """Fold the SQLite WAL back into the main database file."""
+
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        with self._lock:
+            self.checkpoint()
+            self._conn.close()
+
+    def import_document(self, data: Dict[str, Any]) -> None:
+        """Load a full JSON storage document, keeping versions and history.
+
+        Used by the migration tool; the target is expected to be empty.
+        """
+
+        with self.transaction():
+            for collection in COLLECTIONS:
+                for entity in data.get(collection, {}).values():
+                    self._upsert_row(collection, entity["id"], entity)
+            self._conn.executemany(
+                _INSERT_CHANGE,
+                (_change_params(change) for change in data.get("changes", [])),
+            )
+            self._version = self._committed_version = int(data.get("version", 0))
+            self._baseline = int(data.get("changes_baseline", 0))
+            self._set_meta("version", self._version)
+            self._set_meta("changes_baseline", self._baseline)
+
+    # ------------------------------------------------------------------
+    # internal helpers
+    # ------------------------------------------------------------------
+    def _create_schema(self) -> None:
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS changes ("
+            " version INTEGER PRIMARY KEY,"
+            " entity_type TEXT NOT NULL,"
+            " entity_id TEXT NOT NULL,"
+            " action TEXT NOT NULL,"
+            " timestamp TEXT NOT NULL,"
+            " payload TEXT,"
+            " patch TEXT,"
+            " refs TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(changes)")}
+        for column in ("patch", "refs"):
+            if column not in columns:  # databases created before patch payloads
+                self._conn.execute(f"ALTER TABLE changes ADD COLUMN {column} TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_changes_entity ON changes (entity_type, entity_id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_changes_type ON changes (entity_type, version)"
+        )
+        for collection in COLLECTIONS:
+            self._table(collection)
+        if self._meta("ordered_keys") < _ORDERED_KEY_VERSION:
+            # (re)compute ordered columns added by, or written before, the
+            # current ordered_key() encoding
+            self._conn.execute("BEGIN IMMEDIATE")
+            for collection in ORDERED_INDEXES:
+                fields = _ordered_columns(collection)
+                if fields:
+                    self._backfill(self._table(collection), list(fields))
+            self._set_meta("ordered_keys", _ORDERED_KEY_VERSION)
+            self._conn.execute("COMMIT")
+
+    def _table(self, collection: str) -> str:
+        if collection in self._tables:
+            return collection
+        if not collection.isidentifier():
+            raise ValueError(f"Invalid collection name: {collection!r}")
+        fields = SECONDARY_INDEXES.get(collection, ())
+        ordered = _ordered_columns(collection)
+        # ordered columns hold ordered_key() values and are declared without
+        # a type so that SQLite keeps each key's own type
+        columns = "".join(f", {field} TEXT" for field in fields)
+        columns += "".join(f", {field}" for field in ordered)
+        with self._lock:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {collection}"
+                f" (id TEXT PRIMARY KEY, body TEXT NOT NULL{columns})"
+            )
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({collection})")}
+            for field in ordered:
+                if field not in existing:  # tables created before the ordered index
+                    self._conn.execute(f"ALTER TABLE {collection} ADD COLUMN {field}")
+            for field in fields:
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS ix_{collection}_{field}"
+                    f" ON {collection} ({field})"
+                )
+            for key_fields in UNIQUE_INDEXES.get(collection, ()):
+                # not declared UNIQUE: older databases may hold duplicates
+                # until they are repaired, so _put_locked enforces it instead
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS ix_{collection}_{'_'.join(key_fields)}"
+                    f" ON {collection} ({', '.join(key_fields)})"
+                )
+            for field, group in ORDERED_INDEXES.get(collection, ()):
+                key = f"{group}, {field}, id" if group else f"{field}, id"
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS ix_{collection}_{field}_order"
+                    f" ON {collection} ({key})"
+                )
+        self._tables.add(collection)
+        return collection
+
+    def _backfill(self, collection: str, fields: List[str]) -> None:
+        updates = []
+        for entity_id, body in self._conn.execute(f"SELECT id, body FROM {collection}").fetchall():
+            entity = json.loads(body)
+            updates.append((*(ordered_key(entity.get(field)) for field in fields), entity_id))
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        self._conn.executemany(f"UPDATE {collection} SET {assignments} WHERE id = ?", updates)
+
+    def _indexed(self, collection: str, field: str) -> str:
+        if field not in SECONDARY_INDEXES.get(collection, ()):
+            raise ValueError(f"{collection}.{field} is not an indexed field")
+        return self._table(collection)
+
+    def _unique(self, collection: str, fields: Tuple[str, ...]) -> str:
+        if fields not in UNIQUE_INDEXES.get(collection, ()):
+            raise ValueError(f"{collection} has no unique index on ({unique_index_name(fields)})")
+        return self._table(collection)
+
+    def _ordered(self, collection: str, field: str) -> Optional[str]:
+        """Partition field of the ordered index on ``collection.field``."""
+
+        for name, group in ORDERED_INDEXES.get(collection, ()):
+            if name == field:
+                return group
+        raise ValueError(f"{collection}.{field} has no ordered index")
+
+    def _meta(self, key: str) -> int:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def _set_meta(self, key: str, value: int) -> None:
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def _upsert_row(self, collection: str, entity_id: str, entity: Dict[str, Any]) -> None:
+        table = self._table(collection)
+        fields = SECONDARY_INDEXES.get(collection, ())
+        ordered = _ordered_columns(collection)
+        columns = ", ".join(("id", "body") + fields + ordered)
+        placeholders = ", ".join("?" for _ in range(2 + len(fields) + len(ordered)))
+        assignments = ", ".join(
+            f"{column} = excluded.{column}" for column in ("body",) + fields + ordered
+        )
+        # an upsert keeps the rowid, so list_values preserves insertion order
+        self._conn.execute(
+            f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+            f" ON CONFLICT(id) DO UPDATE SET {assignments}",
+            (
+                entity_id,
+                _dumps(entity),
+                *(entity.get(field) for field in fields),
+                *(ordered_key(entity.get(field)) for field in ordered),
+            ),
+        )
+
+    def _put_locked(
+        self,
+        collection: str,
+        entity_id: str,
+        entity: Dict[str, Any],
+        entity_type: str,
+        action: str,
+    ) -> None:
+        previous = self._row(collection, entity_id)
+        for fields in UNIQUE_INDEXES.get(collection, ()):
+            key = {field: entity.get(field) for field in fields}
+            if None in key.values():
+                continue
+            with self.snapshot() as snap:
+                holder = snap.lookup(collection, key)
+            if holder is not None and holder["id"] != entity_id:
+                raise DuplicateKeyError(
+                    f"{unique_index_name(fields)}={tuple(key.values())!r}"
+                    f" already belongs to {holder['id']}"
+                )
+        self._upsert_row(collection, entity_id, entity)
+        self._record_change_locked(collection, entity_type, entity_id, action, entity, previous)
+
+    def _row(self, collection: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        table = self._table(collection)
+        row = self._conn.execute(f"SELECT body FROM {table} WHERE id = ?", (entity_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _record_change_locked(
+        self,
+        collection: str,
+        entity_type: str,
+        entity_id: str,
+        action: str,
+        entity: Optional[Dict[str, Any]],
+        previous: Optional[Dict[str, Any]],
+    ) -> None:
+        self._version += 1
+        change = change_entry(
+            self._version, collection, entity_type, entity_id, action, entity, previous
+        )
+        self._conn.execute(_INSERT_CHANGE, _change_params(change))
+        if self._tx is not None:
+            self._tx.last_version = self._version
+            self._tx.changes.append(change)
+
+    def _compact_changes_locked(self) -> int:
+        cutoff = self._version - self._sync_horizon
+        if cutoff <= self._baseline:
+            return 0
+        # surviving patch entries become the base of their entity's history
+        survivors = self._conn.execute(
+            "SELECT version, entity_type, entity_id FROM changes"
+            " WHERE version <= :cutoff AND patch IS NOT NULL AND version IN"
+            " (SELECT MAX(version) FROM changes WHERE version <= :cutoff"
+            "  GROUP BY entity_type, entity_id)",
+            {"cutoff": cutoff},
+        ).fetchall()
+        for version, entity_type, entity_id in survivors:
+            payload = _materialize(self._conn, entity_type, entity_id, version)
+            self._conn.execute(
+                "UPDATE changes SET payload = ?, patch = NULL, refs = NULL WHERE version = ?",
+                (_dumps(payload), version),
+            )
+        removed = self._conn.execute(
+            "DELETE FROM changes WHERE version <= :cutoff AND (action = 'deleted' OR version NOT IN"
+            " (SELECT MAX(version) FROM changes WHERE version <= :cutoff"
+            "  GROUP BY entity_type, entity_id))",
+            {"cutoff": cutoff},
+        ).rowcount
+        self._baseline = cutoff
+        self._set_meta("changes_baseline", cutoff)
+        return removed
+
+
+class SqliteSnapshot:
+    """Read view over one SQLite read transaction.
+
+    Mirrors :class:`~app.db.snapshot.StorageSnapshot`; the version stamp and
+    every query inside the ``with`` block see the same committed state.
+    """
+
+    def __init__(self, storage: SqliteStorage, conn: sqlite3.Connection, *, begin: bool) -> None:
+        self._storage = storage
+        self._conn = conn
+        self._begin = begin
+        self._version = 0
+        self._baseline = 0
+
+    def __enter__(self) -> "SqliteSnapshot":
+        if self._begin:
+            self._conn.execute("BEGIN")
+            # the first read pins the snapshot the rest of the block sees
+            meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+            self._version = int(meta.get("version", 0))
+            self._baseline = int(meta.get("changes_baseline", 0))
+        else:
+            self._version = self._storage.version
+            self._baseline = self._storage.changes_baseline
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._begin:
+            self._conn.execute("COMMIT")
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def changes_baseline(self) -> int:
+        return self._baseline
+
+    def list_values(self, collection: str) -> List[Dict[str, Any]]:
+        table = self._storage._table(collection)
+        rows = self._conn.execute(f"SELECT body FROM {table} ORDER BY rowid").fetchall()
+        return [json.loads(body) for (body,) in rows]
+
+    def get(self, collection: str, entity_id: str) -> Optional[Dict[str, Any]]:
+        table = self._storage._table(collection)
+        row = self._conn.execute(f"SELECT body FROM {table} WHERE id = ?", (entity_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(
+        self, collection: str, entity_ids: Sequence[str]
+    ) -> List[Optional[Dict[str, Any]]]:
+        """Entities for ``entity_ids`` in order, ``None`` where one is missing."""
+
+        table = self._storage._table(collection)
+        found: Dict[str, Dict[str, Any]] = {}
+        for chunk in _chunks(entity_ids):
+            rows = self._conn.execute(
+                f"SELECT id, body FROM {table} WHERE id IN ({_placeholders(chunk)})", chunk
+            )
+            found.update((entity_id, json.loads(body)) for entity_id, body in rows)
+        return [found.get(entity_id) for entity_id in entity_ids]
+
+    def find(self, collection: str, field: str, value: Any) -> List[Dict[str, Any]]:
+        table = self._storage._indexed(collection, field)
+        rows = self._conn.execute(
+            f"SELECT body FROM {table} WHERE {field} = ? ORDER BY rowid", (value,)
+        ).fetchall()
+        return [json.loads(body) for (body,) in rows]
+
+    def count(self, collection: str, field: str, value: Any) -> int:
+        table = self._storage._indexed(collection, field)
+        (total,) = self._conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE {field} = ?", (value,)
+        ).fetchone()
+        return int(total)
+
+    def lookup(self, collection: str, key: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+        table = self._storage._unique(collection, tuple(key))
+        # the first row keeps the key if older data holds duplicates
+        row = self._conn.execute(
+            f"SELECT body FROM {table} WHERE {' AND '.join(f'{field} = ?' for field in key)}"
+            " ORDER BY rowid LIMIT 1",
+            tuple(key.values()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_changes_since(
+        self, version: int, limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        rows = self._conn.execute(
+            f"SELECT {_CHANGE_COLUMNS} FROM changes WHERE version > ? ORDER BY version LIMIT ?",
+            (version, -1 if limit is None else limit),
+        ).fetchall()
+        return [_change_from_row(row) for row in rows]
+
+    def last_modified(self, entity_type: str, entity_id: Optional[str] = None) -> int:
+        """Version of the latest change to an entity, or to an entity type."""
+
+        if entity_id is None:
+            (latest,) = self._conn.execute(
+                "SELECT MAX(version) FROM changes WHERE entity_type = ? AND version <= ?",
+                (entity_type, self._version),
+            ).fetchone()
+            return max(latest or 0, self._baseline)
+        (latest,) = self._conn.execute(
+            "SELECT MAX(version) FROM changes"
+            " WHERE entity_type = ? AND entity_id = ? AND version <= ?",
+            (entity_type, entity_id, self._version),
+        ).fetchone()
+        return latest or 0
+
+    def scan(
+        self,
+        collection: str,
+        field: str,
+        *,
+        partition: Any = None,
+        after: Optional[Tuple[Any, str]] = None,
+        above: Any = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Entities in descending ``(field, id)`` order; see ``StorageSnapshot.scan``."""
+
+        table = self._storage._table(collection)
+        group = self._storage._ordered(collection, field)
+        conditions: List[str] = []
+        params: List[Any] = []
+        if group is not None:
+            conditions.append(f"{group} IS ?")
+            params.append(partition)
+        if after is not None:
+            conditions.append(f"({field}, id) < (?, ?)")
+            params.extend((ordered_key(after[0]), after[1]))
+        if above is not None:
+            conditions.append(f"{field} > ?")
+            params.append(ordered_key(above))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._conn.execute(
+            f"SELECT body FROM {table}{where} ORDER BY {field} DESC, id DESC LIMIT ? OFFSET ?",
+            (*params, -1 if limit is None else limit, offset),
+        ).fetchall()
+        return [json.loads(body) for (body,) in rows]
+
+    def last_modified_many(self, entity_type: str, entity_ids: Sequence[str]) -> List[int]:
+        found: Dict[str, int] = {}
+        for chunk in _chunks(entity_ids):
+            rows = self._conn.execute(
+                "SELECT entity_id, MAX(version) FROM changes"
+                f" WHERE entity_type = ? AND version <= ? AND entity_id IN ({_placeholders(chunk)})"
+                " GROUP BY entity_id",
+                (entity_type, self._version, *chunk),
+            )
+            found.update(rows)
+        return [found.get(entity_id, 0) for entity_id in entity_ids]
+
+    def materialize(self, change: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Full entity as of ``change`` (``None`` for a deletion)."""
+
+        if change.get("patch") is None:
+            return change["payload"]
+        return _materialize(
+            self._conn, change["entity_type"], change["entity_id"], change["version"]
+        )
+
+    def materialize_many(self, changes: Sequence[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """Full entities as of each of ``changes``, given in version order.
+
+        Like :meth:`ChangeLog.materialize_many`, later changes to an entity
+        replay only the patches since the state rebuilt for the previous one.
+        """
+
+        states: Dict[Tuple[str, str], Tuple[int, Optional[Dict[str, Any]]]] = {}
+        entities: List[Optional[Dict[str, Any]]] = []
+        for change in changes:
+            key = (change["entity_type"], change["entity_id"])
+            if change.get("patch") is None:
+                entity = change["payload"]
+            else:
+                after, base = states.get(key, (0, None))
+                if after > change["version"]:
+                    after, base = 0, None
+                entity = _materialize(self._conn, *key, change["version"], after=after, base=base)
+            states[key] = (change["version"], entity)
+            entities.append(entity)
+        return entities
+
+
+def _ordered_columns(collection: str) -> Tuple[str, ...]:
+    fields = SECONDARY_INDEXES.get(collection, ())
+    return tuple(
+        field for field, _ in ORDERED_INDEXES.get(collection, ()) if field not in fields
+    )
+
+
+# bump when ordered_key() changes so existing ordered columns are recomputed
+_ORDERED_KEY_VERSION = 1
+
+# stays well below SQLite's limit on bound parameters
+_IN_CHUNK = 500
+
+
+def _chunks(values: Sequence[str]) -> Iterator[Sequence[str]]:
+    for start in range(0, len(values), _IN_CHUNK):
+        yield values[start : start + _IN_CHUNK]
+
+
+def _placeholders(values: Sequence[Any]) -> str:
+    return ", ".join("?" for _ in values)
+
+
+_CHANGE_COLUMNS = "version, entity_type, entity_id, action, timestamp, payload, patch, refs"
+_INSERT_CHANGE = (
+    f"INSERT INTO changes ({_CHANGE_COLUMNS}) VALUES"
+    " (:version, :entity_type, :entity_id, :action, :timestamp, :payload, :patch, :refs)"
+)
+
+
+def _change_params(change: Dict[str, Any]) -> Dict[str, Any]:
+    params = {key: change[key] for key in ("version", "entity_type", "entity_id", "action")}
+    params["timestamp"] = change["timestamp"]
+    for key in ("payload", "patch", "refs"):
+        value = change.get(key)
+        params[key] = _dumps(value) if value is not None else None
+    return params
+
+
+def _change_from_row(row: Iterable[Any]) -> Dict[str, Any]:
+    version, entity_type, entity_id, action, timestamp, payload, patch, refs = row
+    change = {
+        "version": version,
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "action": action,
+        "timestamp": timestamp,
+        "payload": json.loads(payload) if payload is not None else None,
+    }
+    if patch is not None:
+        change["patch"] = json.loads(patch)
+    if refs is not None:
+        change["refs"] = json.loads(refs)
+    return change
+
+
+def _materialize(
+    conn: sqlite3.Connection,
+    entity_type: str,
+    entity_id: str,
+    version: int,
+    *,
+    after: int = 0,
+    base: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """Rebuild an entity as of ``version``; ``base`` is its state at ``after``, if known."""
+
+    rows = conn.execute(
+        "SELECT payload, patch FROM changes WHERE entity_type = ? AND entity_id = ?"
+        " AND version > ? AND version <= ? ORDER BY version DESC",
+        (entity_type, entity_id, after, version),
+    )
+    return mergepatch.rebuild(
+        (
+            (
+                json.loads(payload) if payload is not None else None,
+                json.loads(patch) if patch is not None else None,
+            )
+            for payload, patch in rows
+        ),
+        base,
+    )
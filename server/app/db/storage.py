@@ -4,18 +4,95 @@ The real system will use PostgreSQL, but for early iterations we persist data to
 JSON file so that API endpoints exhibit stateful behaviour across requests and
 run without additional infrastructure. The storage engine keeps track of entity
 changes to support incremental sync endpoints.
+
+By default mutations are appended to a write-ahead log next to the snapshot
+file (``storage.wal``) rather than re-dumping the whole document on every
+write. The log is checkpointed into the snapshot every ``checkpoint_interval``
+records and replayed on startup.
+
+Persistence can optionally be handed to a background group-commit writer
+(:mod:`app.db.writer`) so request threads never wait for the disk, with an
+``fsync`` policy of ``always``, ``interval`` or ``never``.
+
+The change log is kept version-ordered (see :mod:`app.db.changelog`) and
+history older than ``sync_horizon`` versions is compacted into a baseline.
+
+Both files are written with a configurable codec (:mod:`app.db.codec`);
+whatever codec wrote an existing file is detected when it is loaded.
+
+With ``sharded=True`` the snapshot is split into one file per collection
+(:mod:`app.db.shards`): only collections changed since the last write are
+rewritten, and untouched collections are loaded on first access.
+
+With ``read_only=True`` the files are only ever read: the log is replayed in
+memory, a torn tail or a layout or codec change is left as it is, and
+writes are refused.
 """
 
 from __future__ import annotations
 
-import json
+import logging
 import os
+import time
+from collections import ChainMap
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from threading import Lock
-from typing import Any, Dict, List, Optional
+from threading import RLock, get_ident
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from . import mergepatch
+from .changelog import ChangeLog
+from .codec import DEFAULT_CODEC, decode_document, encode_document, get_codec
+from .indexes import (
+    INDEXED_COLLECTIONS,
+    SECONDARY_INDEXES,
+    Index,
+    UniqueIndex,
+    build_indexes,
+)
+from .persistent import PersistentMap
+from .shards import CHANGES_SHARD, LazyMapping, ShardDirectory
+from .snapshot import StorageSnapshot
+from .wal import WriteAheadLog
+from .writer import FSYNC_POLICIES, BackgroundWriter, FlushStats
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .sqlite import SqliteStorage
+
+logger = logging.getLogger(__name__)
 
 _ISO_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+_DEFAULT_CHECKPOINT_INTERVAL = 1000
+_DEFAULT_SYNC_HORIZON = 10000
+_DEFAULT_FLUSH_INTERVAL = 0.05
+_DEFAULT_FLUSH_BATCH = 256
+_DEFAULT_FSYNC_INTERVAL = 1.0
+
+COLLECTIONS = (
+    "themes",
+    "products",
+    "theme_products",
+    "inquiry_sessions",
+    "inquiry_messages",
+    "tool_invocations",
+)
+
+# (collection, foreign-key field, entity type) of records deleted along with
+# the entity they reference; the field must have a secondary index
+Dependent = Tuple[str, str, str]
 
 
 def utcnow() -> str:
@@ -24,22 +101,231 @@ def utcnow() -> str:
     return datetime.utcnow().strftime(_ISO_FORMAT)
 
 
+class Transaction:
+    """Bookkeeping for an open :meth:`JsonStorage.transaction` block."""
+
+    def __init__(self, base_version: int) -> None:
+        self.owner = get_ident()
+        self.base_version = base_version
+        self.last_version = base_version
+        self.records: List[Dict[str, Any]] = []
+        # change log entries written so far, handed to commit listeners
+        self.changes: List[Dict[str, Any]] = []
+        # private copies of every collection / index the transaction touched;
+        # published as a new snapshot on commit, dropped on rollback. Copies
+        # share every block they do not modify with the published state.
+        self.collections: Dict[str, PersistentMap] = {}
+        self.indexes: Dict[str, Dict[str, Index]] = {}
+
+    @property
+    def versions(self) -> Optional[Tuple[int, int]]:
+        """Inclusive version range written by the transaction, if any."""
+
+        if self.last_version == self.base_version:
+            return None
+        return self.base_version + 1, self.last_version
+
+    def writable(self, collection: str, state: StorageSnapshot) -> PersistentMap:
+        coll = self.collections.get(collection)
+        if coll is None:
+            published = state.collections.get(collection)
+            coll = self.collections[collection] = (
+                published.copy() if published is not None else PersistentMap()
+            )
+            self.indexes[collection] = {
+                field: index.copy() for field, index in state.indexes.get(collection, {}).items()
+            }
+        return coll
+
+    def view(self, state: StorageSnapshot, changes: ChangeLog) -> StorageSnapshot:
+        """Snapshot that also shows this transaction's uncommitted writes."""
+
+        return StorageSnapshot(
+            self.last_version,
+            ChainMap(self.collections, state.collections),
+            ChainMap(self.indexes, state.indexes),
+            changes,
+        )
+
+
+ChangeListener = Callable[[List[Dict[str, Any]]], None]
+
+
+class CommitListeners:
+    """Callbacks invoked with the change entries of every commit.
+
+    They run on the committing thread while the storage lock is held, after
+    the new state is visible to readers, so they must return quickly (hand
+    the work to another thread or event loop) and must not write to the
+    storage. A failing listener is logged and does not affect the commit.
+    """
+
+    def __init__(self) -> None:
+        self._callbacks: List[ChangeListener] = []
+
+    def add(self, callback: ChangeListener) -> None:
+        self._callbacks = [*self._callbacks, callback]
+
+    def remove(self, callback: ChangeListener) -> None:
+        self._callbacks = [item for item in self._callbacks if item is not callback]
+
+    def notify(self, changes: List[Dict[str, Any]]) -> None:
+        for callback in self._callbacks:
+            try:
+                callback(changes)
+            except Exception:  # pragma: no cover - listener bugs must not fail writes
+                logger.exception("storage commit listener failed")
+
+
 class JsonStorage:
-    """Very small JSON document store with optimistic locking."""
+    """Very small JSON document store with optimistic locking.
+
+    Reads never take the lock: they go through the most recently published
+    :class:`~app.db.snapshot.StorageSnapshot`. Writes are serialised by the
+    lock, copy the blocks they touch (see :mod:`app.db.persistent`) and
+    publish a new snapshot when they commit.
+    """
 
-    def __init__(self, path: Path) -> None:
+    # reads are served from the in-memory snapshot
+    blocking_reads = False
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        wal: bool = True,
+        checkpoint_interval: int = _DEFAULT_CHECKPOINT_INTERVAL,
+        sync_horizon: int = _DEFAULT_SYNC_HORIZON,
+        background_writer: bool = False,
+        fsync: str = "never",
+        flush_interval: float = _DEFAULT_FLUSH_INTERVAL,
+        flush_batch: int = _DEFAULT_FLUSH_BATCH,
+        fsync_interval: float = _DEFAULT_FSYNC_INTERVAL,
+        codec: str = DEFAULT_CODEC,
+        sharded: bool = False,
+        read_only: bool = False,
+    ) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
         self._path = path
-        self._lock = Lock()
-        self._data = self._load()
+        self._codec = get_codec(codec)
+        self._lock = RLock()
+        # serialises file I/O between request threads and the background writer;
+        # always acquired after ``_lock`` when both are needed
+        self._io_lock = RLock()
+        # version last written to each snapshot / shard file
+        self._file_versions: Dict[Path, int] = {}
+        # shard name -> version that last modified it, until that is on disk
+        self._dirty: Dict[str, int] = {}
+        self._tx: Optional[Transaction] = None
+        self._read_only = read_only
+        self._wal = (
+            WriteAheadLog(path.with_suffix(".wal"), self._codec, read_only=read_only)
+            if wal
+            else None
+        )
+        self._checkpoint_interval = max(1, checkpoint_interval)
+        self._sync_horizon = max(1, sync_horizon)
+        self._fsync = fsync
+        self._fsync_interval = fsync_interval
+        self._last_fsync = time.monotonic()
+        self._flush_stats = FlushStats()
+        self._listeners = CommitListeners()
+        shards = ShardDirectory(path.with_suffix(""), self._codec)
+        self._shards = shards if sharded else None
+        collections: Mapping[str, PersistentMap]
+        indexes: Mapping[str, Dict[str, Index]]
+        if self._shards is not None and shards.exists():
+            self._version, changes, baseline, collections = self._load_shards()
+            indexes = LazyMapping.of(
+                INDEXED_COLLECTIONS, lambda name: build_indexes(name, collections[name].values())
+            )
+            convert = False
+        else:
+            # a layout switch reads the other layout once and rewrites it
+            convert = self._shards is not None and self._path.exists()
+            if self._shards is None and not self._path.exists() and shards.exists():
+                document = self._load_all_shards(shards)
+                convert = True
+            else:
+                document = self._load()
+            self._version = int(document.get("version", 0))
+            changes = document.get("changes", [])
+            baseline = int(document.get("changes_baseline", 0))
+            collections = {
+                name: PersistentMap(value)
+                for name, value in document.items()
+                if isinstance(value, dict)
+            }
+            for collection in COLLECTIONS:
+                collections.setdefault(collection, PersistentMap())
+            indexes = {
+                collection: build_indexes(collection, collections[collection].values())
+                for collection in INDEXED_COLLECTIONS
+            }
+            if self._shards is not None:
+                self._dirty = dict.fromkeys([*collections, CHANGES_SHARD], self._version)
+        self._changes = ChangeLog(changes, baseline=baseline)
+        self._state = StorageSnapshot(self._version, collections, indexes, self._changes)
+        if not read_only and (convert or (self._wal is not None and self._wal.codec_mismatch)):
+            # fold the log into a snapshot in the current layout and codec
+            # before appending anything
+            with self._io_lock:
+                self._save_locked(self._state)
+                if self._wal is not None:
+                    self._wal.truncate()
+            if convert and self._shards is None:
+                shards.remove()
+            elif convert:
+                self._path.unlink()
+        self._writer: Optional[BackgroundWriter] = None
+        if background_writer and not read_only:
+            self._writer = BackgroundWriter(
+                self._write_batch,
+                interval=flush_interval,
+                max_batch=flush_batch,
+                durable_version=self.version,
+                stats=self._flush_stats,
+            )
 
     # ------------------------------------------------------------------
     # public helpers
     # ------------------------------------------------------------------
+    def snapshot(self) -> StorageSnapshot:
+        """Return a consistent, version-stamped view for multi-step reads.
+
+        Free to obtain and safe to use from any thread. Inside a transaction
+        the owning thread sees its own uncommitted writes.
+        """
+
+        tx = self._tx
+        if tx is not None and tx.owner == get_ident():
+            return tx.view(self._state, self._changes)
+        return self._state
+
     def list_values(self, collection: str) -> List[Dict[str, Any]]:
-        return list(self._data.setdefault(collection, {}).values())
+        return self.snapshot().list_values(collection)
 
     def get(self, collection: str, entity_id: str) -> Optional[Dict[str, Any]]:
-        return self._data.setdefault(collection, {}).get(entity_id)
+        return self.snapshot().get(collection, entity_id)
+
+    def get_many(
+        self, collection: str, entity_ids: Sequence[str]
+    ) -> List[Optional[Dict[str, Any]]]:
+        return self.snapshot().get_many(collection, entity_ids)
+
+    def find(self, collection: str, field: str, value: Any) -> List[Dict[str, Any]]:
+        """Return entities whose indexed ``field`` equals ``value``."""
+
+        return self.snapshot().find(collection, field, value)
+
+    def count(self, collection: str, field: str, value: Any) -> int:
+        return self.snapshot().count(collection, field, value)
+
+    def lookup(self, collection: str, key: Mapping[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return the entity whose unique-index key is ``key``, if any."""
+
+        return self.snapshot().lookup(collection, key)
 
     def insert(
         self,
@@ -49,11 +335,10 @@ class JsonStorage:
         entity_type: str,
         action: str,
     ) -> Dict[str, Any]:
-        entity_id = entity["id"]
-        with self._lock:
-            self._data.setdefault(collection, {})[entity_id] = entity
-            self._record_change_locked(entity_type, entity_id, action, entity)
-            self._save_locked()
+        with self.transaction():
+            self._put_locked(
+                collection, entity["id"], entity, entity_type=entity_type, action=action
+            )
         return entity
 
     def update(
@@ -65,10 +350,10 @@ class JsonStorage:
         entity_type: str,
         action: str,
     ) -> Dict[str, Any]:
-        with self._lock:
-            self._data.setdefault(collection, {})[entity_id] = entity
-            self._record_change_locked(entity_type, entity_id, action, entity)
-            self._save_locked()
+        with self.transaction():
+            self._put_locked(
+                collection, entity_id, entity, entity_type=entity_type, action=action
+            )
         return entity
 
     def delete(
@@ -79,78 +364,571 @@ class JsonStorage:
         entity_type: str,
         action: str,
     ) -> Optional[Dict[str, Any]]:
-        with self._lock:
-            coll = self._data.setdefault(collection, {})
-            existing = coll.pop(entity_id, None)
+        with self.transaction():
+            return self._delete_locked(
+                collection, entity_id, entity_type=entity_type, action=action
+            )
+
+    def delete_cascade(
+        self,
+        collection: str,
+        entity_id: str,
+        *,
+        entity_type: str,
+        action: str,
+        dependents: Sequence[Dependent] = (),
+    ) -> Optional[Dict[str, Any]]:
+        """Delete an entity and the records referencing it in one commit.
+
+        Dependents are found through their secondary index and their
+        tombstones follow the entity's in one contiguous version range.
+        Returns the deleted entity, or ``None`` (and deletes nothing) if it
+        does not exist.
+        """
+
+        with self.transaction():
+            existing = self._delete_locked(
+                collection, entity_id, entity_type=entity_type, action=action
+            )
             if existing is None:
                 return None
-            self._record_change_locked(entity_type, entity_id, action, existing)
-            self._save_locked()
+            for dependent, field, dependent_type in dependents:
+                for record in self.find(dependent, field, entity_id):
+                    self._delete_locked(
+                        dependent, record["id"], entity_type=dependent_type, action=action
+                    )
             return existing
 
+    @contextmanager
+    def transaction(self) -> Iterator[Transaction]:
+        """Group several writes into one atomic, singly-persisted commit.
+
+        Writes inside the block hold the storage lock, so their versions form
+        one contiguous range. They work on private copies of the touched
+        collections, which are published to readers and persisted once when
+        the outermost block exits; if it raises, the copies are discarded.
+        Nested blocks join the enclosing transaction.
+        """
+
+        if self._read_only:
+            raise RuntimeError(f"{self._path} was opened read-only")
+        with self._lock:
+            if self._tx is not None:
+                yield self._tx
+                return
+            tx = self._tx = Transaction(self._version)
+            try:
+                yield tx
+            except BaseException:
+                self._tx = None
+                self._changes.truncate(tx.base_version)
+                self._version = tx.base_version
+                raise
+            self._tx = None
+            if tx.records:
+                self._commit_locked(tx)
+
+    def add_listener(self, callback: ChangeListener) -> None:
+        """Call ``callback(changes)`` after every commit (see :class:`CommitListeners`)."""
+
+        self._listeners.add(callback)
+
+    def remove_listener(self, callback: ChangeListener) -> None:
+        self._listeners.remove(callback)
+
     def list_changes_since(self, version: int) -> List[Dict[str, Any]]:
-        return [
-            change
-            for change in self._data.setdefault("changes", [])
-            if change["version"] > version
-        ]
+        return self.snapshot().list_changes_since(version)
+
+    @property
+    def changes_baseline(self) -> int:
+        """Versions at or below this value have been compacted away."""
+
+        return self._changes.baseline
+
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
+
+    def compact_changes(self) -> int:
+        """Compact change history older than the sync horizon.
+
+        Returns the number of change entries removed.
+        """
+
+        with self._lock:
+            return self._compact_changes_locked()
+
+    def wait_durable(self, version: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        """Block until ``version`` (default: the latest) has been flushed.
+
+        Writes are flushed before they return unless the background writer is
+        enabled, in which case this is how a caller waits for its commit.
+        Returns ``False`` if ``timeout`` expires first.
+        """
+
+        if self._writer is None:
+            return True
+        return self._writer.wait(self.version if version is None else version, timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Flush counters plus the writer configuration."""
+
+        stats = self._flush_stats.as_dict()
+        stats.update(
+            {
+                "writer": "background" if self._writer is not None else "inline",
+                "fsync": self._fsync,
+                "codec": self._codec.name,
+                "sharded": self._shards is not None,
+                "dirty_shards": sorted(self._dirty) if self._shards is not None else [],
+                "pending": self._writer.pending if self._writer is not None else 0,
+                "version": self.version,
+                "durable_version": (
+                    self._writer.durable_version if self._writer is not None else self.version
+                ),
+            }
+        )
+        return stats
+
+    def checkpoint(self) -> None:
+        """Fold the write-ahead log into the snapshot file."""
+
+        if self._read_only:
+            raise RuntimeError(f"{self._path} was opened read-only")
+        with self._lock:
+            self._checkpoint_locked()
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+        with self._lock:
+            if self._wal is not None:
+                if not self._read_only:
+                    self._checkpoint_locked()
+                self._wal.close()
 
     # ------------------------------------------------------------------
     # internal helpers
     # ------------------------------------------------------------------
     def _load(self) -> Dict[str, Any]:
-        if self._path.exists():
-            with self._path.open("r", encoding="utf-8") as handle:
-                return json.load(handle)
-        return {
-            "version": 0,
-            "themes": {},
-            "products": {},
-            "theme_products": {},
-            "inquiry_sessions": {},
-            "inquiry_messages": {},
-            "tool_invocations": {},
-            "changes": [],
+        data = self._load_snapshot()
+        if self._wal is not None:
+            for record in self._wal.replay():
+                # records at or below the snapshot version were already
+                # checkpointed before the log could be truncated
+                last = record["records"][-1] if record["op"] == "batch" else record
+                if last["change"]["version"] <= int(data.get("version", 0)):
+                    continue
+                self._apply_record(data, record)
+        return data
+
+    def _load_shards(self) -> Tuple[int, List[Dict[str, Any]], int, LazyMapping]:
+        """Read the change log shard and replay the log into the shards it touches."""
+
+        shards = self._shards
+        assert shards is not None
+        version, log = shards.read(CHANGES_SHARD)
+        changes: List[Dict[str, Any]] = log["changes"]
+        collections = LazyMapping.of(
+            [*COLLECTIONS, *log["collections"]],
+            lambda name: PersistentMap(shards.read(name)[1] or {}),
+        )
+        pending: Dict[str, List[Dict[str, Any]]] = {}
+        last = version
+        if self._wal is not None:
+            for record in self._wal.replay():
+                for item in record["records"] if record["op"] == "batch" else (record,):
+                    change = item["change"]
+                    if change["version"] > version:
+                        changes.append(change)
+                    last = max(last, change["version"])
+                    pending.setdefault(item["collection"], []).append(item)
+        for name, items in pending.items():
+            shard_version, entities = shards.read(name)
+            data = {name: entities or {}}
+            for item in items:
+                # a crash mid-checkpoint can leave some shards newer than others
+                if item["change"]["version"] > shard_version:
+                    self._apply_record(data, item)
+            collections.source.preload(name, PersistentMap(data[name]))
+            self._dirty[name] = last
+        if pending:
+            self._dirty[CHANGES_SHARD] = last
+        return last, changes, int(log["changes_baseline"]), collections
+
+    def _load_all_shards(self, shards: ShardDirectory) -> Dict[str, Any]:
+        version, log = shards.read(CHANGES_SHARD)
+        document: Dict[str, Any] = {
+            "version": version,
+            "changes": log["changes"],
+            "changes_baseline": log["changes_baseline"],
         }
+        for name in [*COLLECTIONS, *log["collections"]]:
+            document[name] = shards.read(name)[1] or {}
+        if self._wal is not None:
+            for record in self._wal.replay():
+                for item in record["records"] if record["op"] == "batch" else (record,):
+                    # collection shards are written before the change log
+                    # shard, so they hold everything up to its version
+                    if item["change"]["version"] > version:
+                        self._apply_record(document, item)
+        return document
 
-    def _save_locked(self) -> None:
-        self._path.parent.mkdir(parents=True, exist_ok=True)
-        tmp_path = self._path.with_suffix(".tmp")
-        with tmp_path.open("w", encoding="utf-8") as handle:
-            json.dump(self._data, handle, ensure_ascii=False, indent=2)
-        tmp_path.replace(self._path)
+    def _load_snapshot(self) -> Dict[str, Any]:
+        if self._path.exists():
+            return decode_document(self._path.read_bytes())
+        data: Dict[str, Any] = {"version": 0}
+        data.update({collection: {} for collection in COLLECTIONS})
+        data.update({"changes": [], "changes_baseline": 0})
+        return data
 
-    def _record_change_locked(
+    def _put_locked(
         self,
+        collection: str,
+        entity_id: str,
+        entity: Dict[str, Any],
+        *,
         entity_type: str,
+        action: str,
+    ) -> None:
+        tx = self._tx
+        coll = tx.writable(collection, self._state)
+        previous = coll.get(entity_id)
+        indexes = tx.indexes[collection].values()
+        for index in indexes:
+            if isinstance(index, UniqueIndex):
+                index.check(entity)
+        for index in indexes:
+            index.replace(previous, entity)
+        coll[entity_id] = entity
+        change = self._record_change_locked(
+            collection, entity_type, entity_id, action, entity, previous
+        )
+        tx.records.append(
+            {"op": "put", "collection": collection, "entity": entity, "change": change}
+        )
+
+    def _delete_locked(
+        self,
+        collection: str,
         entity_id: str,
+        *,
+        entity_type: str,
         action: str,
-        payload: Optional[Dict[str, Any]],
+    ) -> Optional[Dict[str, Any]]:
+        tx = self._tx
+        if self.snapshot().get(collection, entity_id) is None:
+            return None
+        coll = tx.writable(collection, self._state)
+        existing = coll.pop(entity_id)
+        for index in tx.indexes[collection].values():
+            index.remove(existing)
+        change = self._record_change_locked(
+            collection, entity_type, entity_id, action, None, existing
+        )
+        tx.records.append(
+            {"op": "delete", "collection": collection, "id": entity_id, "change": change}
+        )
+        return existing
+
+    def _commit_locked(self, tx: Transaction) -> None:
+        collections = _merged(self._state.collections, tx.collections)
+        indexes = _merged(self._state.indexes, tx.indexes)
+        for name in tx.collections:
+            self._dirty[name] = self._version
+        self._dirty[CHANGES_SHARD] = self._version
+        state = StorageSnapshot(self._version, collections, indexes, self._changes)
+        # persist before publishing: lock-free readers must never see a
+        # version that a failed flush could still hand out again
+        try:
+            self._persist_locked(tx.records, state)
+        except BaseException:
+            self._changes.truncate(tx.base_version)
+            self._version = tx.base_version
+            raise
+        self._state = state
+        self._listeners.notify(tx.changes)
+
+    @classmethod
+    def _apply_record(cls, data: Dict[str, Any], record: Dict[str, Any]) -> None:
+        if record["op"] == "batch":
+            for item in record["records"]:
+                cls._apply_record(data, item)
+            return
+        coll = data.setdefault(record["collection"], {})
+        if record["op"] == "put":
+            entity = record["entity"]
+            coll[entity["id"]] = entity
+        else:
+            coll.pop(record["id"], None)
+        change = record["change"]
+        data.setdefault("changes", []).append(change)
+        data["version"] = change["version"]
+
+    def _persist_locked(self, records: List[Dict[str, Any]], state: StorageSnapshot) -> None:
+        # a transaction is logged as a single line so a torn append drops it
+        # as a whole instead of replaying half of it
+        if len(records) > 1:
+            records = [{"op": "batch", "records": records}]
+        if self._writer is not None:
+            self._writer.submit(records, state.version)
+            return
+        self._write_batch(records, state)
+
+    def _write_batch(
+        self, records: List[Dict[str, Any]], state: Optional[StorageSnapshot] = None
     ) -> None:
-        self._data["version"] = int(self._data.get("version", 0)) + 1
-        change = {
-            "version": self._data["version"],
-            "entity_type": entity_type,
-            "entity_id": entity_id,
-            "action": action,
-            "timestamp": utcnow(),
-            "payload": payload,
+        """Persist ``records``; runs inline or on the background writer thread.
+
+        Inline, ``state`` is the commit being persisted, which is published
+        only once this returns. The background writer runs after publication
+        and passes nothing, meaning the published state.
+        """
+
+        started = time.perf_counter()
+        if self._wal is None:
+            # without a log every flush is a full snapshot, so a batch of
+            # writes collapses into a single dump; only the serialisation
+            # needs the storage lock, the file write happens outside it
+            with self._lock:
+                if self._changes.compactable(self._sync_horizon) >= self._sync_horizon:
+                    self._compact_changes_locked()
+                state = self._pending_locked(state)
+                version, files = state.version, self._dump_locked(state)
+            self._write_snapshot(version, files)
+            with self._lock:
+                self._mark_clean_locked(version)
+        else:
+            with self._io_lock:
+                fsync = self._fsync_due()
+                self._wal.append(records, fsync=fsync)
+            if self._wal.records >= self._checkpoint_interval:
+                # the records are durable in the log now; a failed checkpoint
+                # must not undo the commit, the next flush retries it
+                try:
+                    with self._lock:
+                        self._checkpoint_locked(state)
+                except Exception:
+                    self._flush_stats.errors += 1
+                    logger.exception("storage checkpoint failed; the log keeps the commit")
+        self._flush_stats.observe(len(records), time.perf_counter() - started)
+
+    def _fsync_due(self) -> bool:
+        if self._fsync == "never":
+            return False
+        now = time.monotonic()
+        if self._fsync == "interval" and now - self._last_fsync < self._fsync_interval:
+            return False
+        self._last_fsync = now
+        self._flush_stats.fsyncs += 1
+        return True
+
+    def _checkpoint_locked(self, state: Optional[StorageSnapshot] = None) -> None:
+        """Fold the log into the snapshot of ``state`` (default: the published state)."""
+
+        if self._wal is None:
+            self._save_locked(self._pending_locked(state))
+            return
+        if not self._wal.records:
+            return
+        self._compact_changes_locked()
+        state = self._pending_locked(state)
+        # the snapshot must be durable before the log is dropped; a crash in
+        # between is harmless because replay skips already-applied versions.
+        # Records the background writer has not appended yet are covered by
+        # the snapshot and skipped on replay for the same reason.
+        with self._io_lock:
+            self._save_locked(state)
+            self._wal.truncate()
+
+    def _pending_locked(self, state: Optional[StorageSnapshot]) -> StorageSnapshot:
+        """``state`` over the current change log, or the published state if ``None``.
+
+        Compaction replaces the change log, so a commit that is still being
+        persisted has to pick up the compacted one.
+        """
+
+        if state is None:
+            return self._state
+        return StorageSnapshot(state.version, state.collections, state.indexes, self._changes)
+
+    def _save_locked(self, state: StorageSnapshot) -> None:
+        self._write_snapshot(state.version, self._dump_locked(state))
+        self._mark_clean_locked(state.version)
+
+    def _mark_clean_locked(self, version: int) -> None:
+        if self._dirty:
+            self._dirty = {name: dirty for name, dirty in self._dirty.items() if dirty > version}
+
+    def _dump_locked(self, state: StorageSnapshot) -> Dict[Path, bytes]:
+        """Serialise the files a save of ``state`` has to write, keyed by path."""
+
+        if self._shards is not None:
+            return self._dump_shards_locked(state)
+        document: Dict[str, Any] = {"version": state.version}
+        document.update({name: dict(coll) for name, coll in state.collections.items()})
+        document["changes"] = state.changes.since(0, upto=state.version)
+        document["changes_baseline"] = state.changes.baseline
+        return {self._path: encode_document(self._codec, document)}
+
+    def _dump_shards_locked(self, state: StorageSnapshot) -> Dict[Path, bytes]:
+        shards = self._shards
+        assert shards is not None
+        if not self._dirty:
+            return {}
+        files = {
+            shards.path(name): shards.encode(state.version, dict(state.collections.get(name, {})))
+            for name in sorted(self._dirty)
+            if name != CHANGES_SHARD
         }
-        self._data.setdefault("changes", []).append(change)
+        # written last: the version it records tells replay what is on disk
+        files[shards.path(CHANGES_SHARD)] = shards.encode(
+            state.version,
+            {
+                "changes": state.changes.since(0, upto=state.version),
+                "changes_baseline": state.changes.baseline,
+                "collections": [name for name in state.collections if name not in COLLECTIONS],
+            },
+        )
+        return files
 
+    def _write_snapshot(self, version: int, files: Dict[Path, bytes]) -> None:
+        with self._io_lock:
+            for path, data in files.items():
+                # the background writer serialises outside the storage lock,
+                # so never let an older dump overwrite a newer one
+                if version < self._file_versions.get(path, 0):
+                    continue
+                self._file_versions[path] = version
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                with tmp_path.open("wb") as handle:
+                    handle.write(data)
+                    if self._fsync != "never":
+                        handle.flush()
+                        os.fsync(handle.fileno())
+                        self._flush_stats.fsyncs += 1
+                tmp_path.replace(path)
 
-def default_storage_path() -> Path:
-    base = Path(os.getenv("SDSHOP_STORAGE_PATH", Path("data") / "storage.json"))
+    def _record_change_locked(
+        self,
+        collection: str,
+        entity_type: str,
+        entity_id: str,
+        action: str,
+        entity: Optional[Dict[str, Any]],
+        previous: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        self._version += 1
+        change = change_entry(
+            self._version, collection, entity_type, entity_id, action, entity, previous
+        )
+        self._changes.append(change)
+        self._tx.last_version = self._version
+        self._tx.changes.append(change)
+        return change
+
+    def _compact_changes_locked(self) -> int:
+        if not self._changes.compactable(self._sync_horizon):
+            return 0
+        self._changes, removed = self._changes.compacted(self._sync_horizon)
+        state = self._state
+        self._state = StorageSnapshot(
+            state.version, state.collections, state.indexes, self._changes
+        )
+        self._dirty[CHANGES_SHARD] = self._version
+        return removed
+
+
+def change_entry(
+    version: int,
+    collection: str,
+    entity_type: str,
+    entity_id: str,
+    action: str,
+    entity: Optional[Dict[str, Any]],
+    previous: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Build a change-log entry for ``previous`` becoming ``entity``.
+
+    Creations carry the full entity as ``payload``. Updates carry only a
+    merge ``patch`` against ``previous``, and deletions no body at all; both
+    keep the entity's foreign keys in ``refs`` so sync filters can scope them
+    without materialising the entity.
+    """
+
+    change: Dict[str, Any] = {
+        "version": version,
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "action": action,
+        "timestamp": utcnow(),
+        "payload": entity if previous is None else None,
+    }
+    if previous is None:
+        return change
+    if entity is not None:
+        change["patch"] = mergepatch.diff(previous, entity)
+    current = entity if entity is not None else previous
+    refs = {field: current.get(field) for field in SECONDARY_INDEXES.get(collection, ())}
+    if refs:
+        change["refs"] = refs
+    return change
+
+
+def _merged(base: Mapping[str, Any], updates: Dict[str, Any]) -> Mapping[str, Any]:
+    if isinstance(base, LazyMapping):
+        return base.merged(updates)
+    merged = dict(base)
+    merged.update(updates)
+    return merged
+
+
+def default_storage_path(backend: str = "json") -> Path:
+    default = Path("data") / ("storage.sqlite3" if backend == "sqlite" else "storage.json")
+    base = Path(os.getenv("SDSHOP_STORAGE_PATH", default))
     if not base.is_absolute():
         base = Path(__file__).resolve().parents[2] / base
     return base
 
 
-_storage_instance: Optional[JsonStorage] = None
+_storage_instance: Optional[Union[JsonStorage, "SqliteStorage"]] = None
 
 
-def get_storage() -> JsonStorage:
+def get_storage() -> Union[JsonStorage, "SqliteStorage"]:
+    """Return the process-wide storage selected by ``SDSHOP_STORAGE_BACKEND``."""
+
     global _storage_instance
     if _storage_instance is None:
-        _storage_instance = JsonStorage(default_storage_path())
+        backend = os.getenv("SDSHOP_STORAGE_BACKEND", "json")
+        fsync = os.getenv("SDSHOP_STORAGE_FSYNC", "never")
+        sync_horizon = int(os.getenv("SDSHOP_SYNC_HORIZON", _DEFAULT_SYNC_HORIZON))
+        if backend == "sqlite":
+            from .sqlite import SqliteStorage
+
+            _storage_instance = SqliteStorage(
+                default_storage_path(backend),
+                sync_horizon=sync_horizon,
+                fsync=fsync,
+            )
+        elif backend == "json":
+            _storage_instance = JsonStorage(
+                default_storage_path(backend),
+                wal=os.getenv("SDSHOP_STORAGE_WAL", "1") != "0",
+                checkpoint_interval=int(
+                    os.getenv("SDSHOP_STORAGE_CHECKPOINT", _DEFAULT_CHECKPOINT_INTERVAL)
+                ),
+                sync_horizon=sync_horizon,
+                background_writer=os.getenv("SDSHOP_STORAGE_WRITER", "inline") == "background",
+                fsync=fsync,
+                flush_interval=float(
+                    os.getenv("SDSHOP_STORAGE_FLUSH_INTERVAL", _DEFAULT_FLUSH_INTERVAL)
+                ),
+                flush_batch=int(os.getenv("SDSHOP_STORAGE_FLUSH_BATCH", _DEFAULT_FLUSH_BATCH)),
+                codec=os.getenv("SDSHOP_STORAGE_CODEC", DEFAULT_CODEC),
+                sharded=os.getenv("SDSHOP_STORAGE_SHARDED", "0") == "1",
+            )
+        else:
+            raise ValueError(f"Unknown SDSHOP_STORAGE_BACKEND: {backend}")
     return _storage_instance
@@ -0,0 +1,176 @@
+"""Append-only write-ahead log used by :class:`~app.db.storage.JsonStorage`.
+
+Each mutation is written as one record so that a write costs O(size of the
+record) instead of O(size of the database). With the JSON codecs a record is
+one compact JSON line; binary codecs (see :mod:`app.db.codec`) start the file
+with their magic and write length-prefixed, CRC-checked frames. The storage
+folds the log into its snapshot file at checkpoints and replays whatever is
+left in the log on startup.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+
+from .codec import CODECS, DEFAULT_CODEC, MAGIC_SIZE, Codec, detect
+
+# payload length and CRC32 of every binary frame
+_FRAME = struct.Struct(">II")
+
+
+class WriteAheadLog:
+    """Log of storage mutations in the configured codec."""
+
+    def __init__(
+        self, path: Path, codec: Optional[Codec] = None, *, read_only: bool = False
+    ) -> None:
+        codec = codec or CODECS[DEFAULT_CODEC]
+        self._path = path
+        # replay leaves a torn tail in place instead of cutting it off
+        self._read_only = read_only
+        # every JSON codec logs the same compact lines
+        self._codec = codec if codec.binary else CODECS[DEFAULT_CODEC]
+        self._handle: Optional[IO[bytes]] = None
+        self._records = 0
+        self._file_magic = self._codec.magic
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def records(self) -> int:
+        """Number of mutations logged since the last truncate.
+
+        A transaction's ``batch`` record counts every mutation it holds, so
+        the storage's checkpoint interval bounds what replay has to apply.
+        """
+
+        return self._records
+
+    @property
+    def codec_mismatch(self) -> bool:
+        """Whether the replayed file was written with a different codec.
+
+        New records cannot be appended to it; the storage checkpoints and
+        truncates the log first.
+        """
+
+        return self._file_magic != self._codec.magic
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """Yield logged records in append order.
+
+        A torn final record (the process died mid-append) is cut off so that
+        new appends do not land behind it (unless the log is read-only);
+        everything before it has already been flushed and is replayed.
+        """
+
+        if not self._path.exists():
+            return
+        with self._path.open("rb") as handle:
+            codec = detect(handle.read(MAGIC_SIZE))
+            handle.seek(0)
+            if handle.read(1):
+                self._file_magic = codec.magic
+            handle.seek(len(codec.magic))
+            reader = self._read_frames if codec.binary else self._read_lines
+            valid_bytes = len(codec.magic)
+            torn = False
+            for record, size in reader(handle, codec):
+                if record is None:
+                    torn = True
+                    break
+                valid_bytes += size
+                self._records += _mutations(record)
+                yield record
+        if torn and not self._read_only:
+            with self._path.open("r+b") as handle:
+                handle.truncate(valid_bytes)
+
+    def append(self, records: List[Dict[str, Any]], *, fsync: bool = False) -> None:
+        handle = self._open()
+        if self._codec.binary:
+            chunks = [self._codec.magic] if handle.tell() == 0 else []
+            for record in records:
+                payload = self._codec.dumps(record)
+                chunks.append(_FRAME.pack(len(payload), zlib.crc32(payload)))
+                chunks.append(payload)
+            handle.write(b"".join(chunks))
+        else:
+            handle.write(
+                "".join(
+                    json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+                    for record in records
+                ).encode("utf-8")
+            )
+        handle.flush()
+        if fsync:
+            os.fsync(handle.fileno())
+        self._records += sum(map(_mutations, records))
+
+    def truncate(self) -> None:
+        self.close()
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._path.write_bytes(b"")
+        self._records = 0
+        self._file_magic = self._codec.magic
+
+    def close(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def _open(self) -> IO[bytes]:
+        if self._handle is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._handle = self._path.open("ab")
+        return self._handle
+
+    @staticmethod
+    def _read_lines(
+        handle: IO[bytes], codec: Codec
+    ) -> Iterator[Tuple[Optional[Dict[str, Any]], int]]:
+        blank = 0
+        for raw in handle:
+            if not raw.endswith(b"\n"):
+                yield None, 0
+                return
+            if not raw.strip():
+                # counted with the next record so the valid prefix stays exact
+                blank += len(raw)
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError:
+                yield None, 0
+                return
+            yield record, blank + len(raw)
+            blank = 0
+
+    @staticmethod
+    def _read_frames(
+        handle: IO[bytes], codec: Codec
+    ) -> Iterator[Tuple[Optional[Dict[str, Any]], int]]:
+        while True:
+            header = handle.read(_FRAME.size)
+            if not header:
+                return
+            if len(header) < _FRAME.size:
+                yield None, 0
+                return
+            length, checksum = _FRAME.unpack(header)
+            payload = handle.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                yield None, 0
+                return
+            yield codec.loads(payload), _FRAME.size + length
+
+
+def _mutations(record: Dict[str, Any]) -> int:
+    return len(record["records"]) if record["op"] == "batch" else 1
@@ -0,0 +1,147 @@
+"""Group-commit background writer for :class:`~app.db.storage.JsonStorage`.
+
+Request threads only hand their log records to the writer and return; a
+daemon thread drains the queue every ``interval`` seconds (or as soon as
+``max_batch`` records are pending) and persists everything collected so far
+in one go. Callers that need to know their write reached disk can block on
+:meth:`BackgroundWriter.wait` for the version they produced.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from threading import Condition, Thread
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+class FlushStats:
+    """Counters describing how batches were flushed to disk."""
+
+    def __init__(self) -> None:
+        self.flushes = 0
+        self.records = 0
+        self.last_batch = 0
+        self.max_batch = 0
+        self.last_seconds = 0.0
+        self.max_seconds = 0.0
+        self.total_seconds = 0.0
+        self.fsyncs = 0
+        self.errors = 0
+
+    def observe(self, batch: int, seconds: float) -> None:
+        self.flushes += 1
+        self.records += batch
+        self.last_batch = batch
+        self.max_batch = max(self.max_batch, batch)
+        self.last_seconds = seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.total_seconds += seconds
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "flushes": self.flushes,
+            "records": self.records,
+            "last_batch": self.last_batch,
+            "max_batch": self.max_batch,
+            "avg_batch": self.records / self.flushes if self.flushes else 0.0,
+            "last_flush_seconds": self.last_seconds,
+            "max_flush_seconds": self.max_seconds,
+            "avg_flush_seconds": self.total_seconds / self.flushes if self.flushes else 0.0,
+            "fsyncs": self.fsyncs,
+            "errors": self.errors,
+        }
+
+
+class BackgroundWriter:
+    """Batches submitted records and hands them to ``sink`` from a thread."""
+
+    def __init__(
+        self,
+        sink: Callable[[List[Dict[str, Any]]], None],
+        *,
+        interval: float,
+        max_batch: int,
+        durable_version: int = 0,
+        stats: Optional[FlushStats] = None,
+    ) -> None:
+        self._sink = sink
+        # failed flushes are counted here; the sink reports the successful ones
+        self._stats = stats if stats is not None else FlushStats()
+        self._interval = interval
+        self._max_batch = max(1, max_batch)
+        self._cond = Condition()
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_version = durable_version
+        self._durable_version = durable_version
+        self._stopped = False
+        self._thread = Thread(target=self._run, name="sdshop-storage-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def durable_version(self) -> int:
+        return self._durable_version
+
+    def submit(self, records: List[Dict[str, Any]], version: int) -> None:
+        with self._cond:
+            self._pending.extend(records)
+            self._pending_version = version
+            if len(self._pending) >= self._max_batch:
+                self._cond.notify_all()
+
+    def wait(self, version: int, timeout: Optional[float] = None) -> bool:
+        """Block until ``version`` has been flushed; ``False`` on timeout."""
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._durable_version < version:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                if self._stopped and not self._thread.is_alive():
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stop(self) -> None:
+        """Flush whatever is pending and stop the thread."""
+
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._pending) < self._max_batch:
+                    self._cond.wait(self._interval)
+                batch, self._pending = self._pending, []
+                version = self._pending_version
+                stopping = self._stopped
+            if batch:
+                try:
+                    self._sink(batch)
+                except Exception:
+                    self._stats.errors += 1
+                    logger.exception("storage flush failed; retrying")
+                    with self._cond:
+                        self._pending[:0] = batch
+                    if stopping:
+                        return
+                    time.sleep(self._interval)
+                    continue
+            with self._cond:
+                self._durable_version = max(self._durable_version, version)
+                self._cond.notify_all()
+                if stopping and not self._pending:
+                    return
@@ -7,6 +7,8 @@
 from fastapi import FastAPI
 
 from .api import inquiries, products, themes, tools, sync
+from .db.aio import get_async_storage
+from .services import get_theme_service
 
 
 def create_app() -> FastAPI:
@@ -20,6 +22,14 @@ def create_app() -> FastAPI:
     app.include_router(tools.router, prefix="/tools", tags=["tools"])
     app.include_router(sync.router, prefix="/sync", tags=["sync"])
 
+    @app.on_event("startup")
+    async def _verify_counters() -> None:
+        await get_theme_service().repair_product_counts()
+
+    @app.on_event("shutdown")
+    def _flush_storage() -> None:
+        get_async_storage().close()
+
     return app
 
 
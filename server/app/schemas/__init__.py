@@ -8,7 +8,12 @@ from .inquiry import (
     InquirySessionResponse,
     InquirySummaryResponse,
 )
-from .product import ProductCreate, ProductImportRequest, ProductResponse
+from .product import (
+    ProductCreate,
+    ProductFacetsResponse,
+    ProductImportRequest,
+    ProductResponse,
+)
 from .sync import ChangeEntry, SyncResponse
 from .theme import (
     ThemeCreate,
@@ -30,6 +35,7 @@ __all__ = [
     "InquirySessionResponse",
     "InquirySummaryResponse",
     "ProductCreate",
+    "ProductFacetsResponse",
     "ProductImportRequest",
     "ProductResponse",
     "SyncResponse",
@@ -39,6 +39,15 @@ class ProductResponse(ProductBase):
     updated_at: datetime
 
 
+class ProductFacetsResponse(BaseModel):
+    total: int = Field(..., description="符合筛选条件的商品数")
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    currencies: Dict[str, int] = Field(default_factory=dict, description="币种 -> 商品数")
+    shops: Dict[str, int] = Field(default_factory=dict, description="店铺名 -> 商品数")
+    tags: Dict[str, int] = Field(default_factory=dict, description="标签 -> 商品数")
+
+
 class ProductImportRequest(BaseModel):
     source_url: str = Field(..., description="商品来源链接")
     title: Optional[str] = None
@@ -15,8 +15,19 @@ class ChangeEntry(BaseModel):
     action: str
     timestamp: datetime
     payload: Dict[str, Any] | None
+    patch: Dict[str, Any] | None = Field(
+        None, description="format=patch 时更新操作相对上一版本的 JSON Merge Patch（RFC 7396）"
+    )
 
 
 class SyncResponse(BaseModel):
     since: int = Field(ge=0)
     changes: List[ChangeEntry] = Field(default_factory=list)
+    version: int = Field(0, ge=0, description="服务端当前最新版本号")
+    baseline_version: int = Field(0, ge=0, description="早于该版本的历史已被压缩")
+    reset: bool = Field(
+        False,
+        description="客户端版本早于压缩基线，可能遗漏删除，需清空本地数据后从 0 全量同步",
+    )
+    next_since: int = Field(0, ge=0, description="下一页请求使用的 since 游标")
+    has_more: bool = Field(False, description="是否还有更多变更，需以 next_since 继续拉取")
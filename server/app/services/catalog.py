@@ -0,0 +1,273 @@
+"""Columnar view of the product catalogue for filtering, sorting and facets.
+
+Each product occupies one row of NumPy arrays (price, ``updated_at`` as epoch
+seconds, dictionary-coded currency and shop name), and every tag has a
+bitmap with one bit per row. A query turns its filters into one boolean
+mask with vectorised comparisons and bitmap ANDs, so cost grows with the
+number of rows only through NumPy kernels rather than Python loops over
+product dicts. Rows of deleted products are recycled.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..db.indexes import ordered_key
+
+# code of "no value" in the dictionary-coded columns
+_MISSING = 0
+
+# sort orders understood by ProductColumns.select
+SORTS = ("updated", "price_asc", "price_desc")
+
+# at most this many shops and tags are reported as facets
+MAX_FACET_VALUES = 50
+
+
+@dataclass(frozen=True)
+class ProductFilter:
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    currency: Optional[str] = None
+    shop: Optional[str] = None
+    # a product must carry every listed tag
+    tags: Tuple[str, ...] = ()
+
+    @property
+    def empty(self) -> bool:
+        return self == ProductFilter()
+
+
+@dataclass
+class Facets:
+    total: int = 0
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    currencies: Dict[str, int] = field(default_factory=dict)
+    shops: Dict[str, int] = field(default_factory=dict)
+    tags: Dict[str, int] = field(default_factory=dict)
+
+
+class _Dictionary:
+    """Interns strings as small integer codes; code 0 means missing."""
+
+    def __init__(self) -> None:
+        self.values: List[Optional[str]] = [None]
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, value: Optional[str]) -> int:
+        if value is None:
+            return _MISSING
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value: str) -> Optional[int]:
+        return self._codes.get(value)
+
+
+class ProductColumns:
+    """Row-per-product arrays kept in step with the product collection.
+
+    Not thread-safe; callers serialise access.
+    """
+
+    def __init__(self, capacity: int = 1024) -> None:
+        capacity = _round_up(capacity)
+        self._ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._price = np.zeros(capacity, dtype=np.float64)
+        self._updated = np.zeros(capacity, dtype=np.float64)
+        self._currency = np.zeros(capacity, dtype=np.int32)
+        self._shop = np.zeros(capacity, dtype=np.int32)
+        self._currencies = _Dictionary()
+        self._shops = _Dictionary()
+        # tag -> packed bitmap (little bit order), one bit per row
+        self._tag_bits: Dict[str, np.ndarray] = {}
+        self._tag_rows: Dict[str, int] = {}
+        self._row_tags: Dict[int, Tuple[str, ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def put(self, product: Dict[str, Any]) -> None:
+        """Insert or replace the row of ``product``."""
+
+        product_id = product["id"]
+        row = self._rows.get(product_id)
+        if row is None:
+            row = self._allocate()
+            self._rows[product_id] = row
+            self._ids[row] = product_id
+        else:
+            self._clear_tags(row)
+        self._alive[row] = True
+        self._price[row] = _as_float(product.get("price"))
+        self._updated[row] = ordered_key(product.get("updated_at"))
+        self._currency[row] = self._currencies.encode(product.get("currency"))
+        shop = product.get("shop")
+        self._shop[row] = self._shops.encode(
+            str(shop["name"]) if isinstance(shop, dict) and shop.get("name") else None
+        )
+        tags = tuple(dict.fromkeys(str(tag) for tag in product.get("tags") or ()))
+        byte, bit = divmod(row, 8)
+        for tag in tags:
+            bits = self._tag_bits.get(tag)
+            if bits is None:
+                bits = self._tag_bits[tag] = np.zeros(len(self._alive) // 8, dtype=np.uint8)
+            bits[byte] |= np.uint8(1 << bit)
+            self._tag_rows[tag] = self._tag_rows.get(tag, 0) + 1
+        self._row_tags[row] = tags
+
+    def remove(self, product_id: str) -> None:
+        row = self._rows.pop(product_id, None)
+        if row is None:
+            return
+        self._clear_tags(row)
+        self._alive[row] = False
+        self._ids[row] = None
+        self._free.append(row)
+
+    def select(
+        self,
+        query: ProductFilter,
+        sort: str = "updated",
+        *,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> List[str]:
+        """Ids of the products matching ``query`` in ``sort`` order.
+
+        ``updated`` is newest first; the price orders break ties newest first.
+        """
+
+        rows = np.flatnonzero(self._mask(query))
+        updated = -self._updated[rows]
+        if sort == "price_asc":
+            order = np.lexsort((updated, self._price[rows]))
+        elif sort == "price_desc":
+            order = np.lexsort((updated, -self._price[rows]))
+        elif sort == "updated":
+            order = np.argsort(updated, kind="stable")
+        else:
+            raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+        end = None if limit is None else offset + limit
+        return [self._ids[row] for row in rows[order[offset:end]].tolist()]
+
+    def facets(self, query: ProductFilter) -> Facets:
+        """Counts of the products matching ``query`` per currency, shop and tag."""
+
+        mask = self._mask(query)
+        total = int(np.count_nonzero(mask))
+        if not total:
+            return Facets()
+        prices = self._price[mask]
+        packed = np.packbits(mask, bitorder="little")
+        tags = {
+            tag: int(np.bitwise_count(packed & bits).sum())
+            for tag, bits in self._tag_bits.items()
+        }
+        return Facets(
+            total=total,
+            min_price=float(prices.min()),
+            max_price=float(prices.max()),
+            currencies=_count_codes(self._currency[mask], self._currencies),
+            shops=_count_codes(self._shop[mask], self._shops, MAX_FACET_VALUES),
+            tags=_top(tags, MAX_FACET_VALUES),
+        )
+
+    def _mask(self, query: ProductFilter) -> np.ndarray:
+        mask = self._alive.copy()
+        if query.min_price is not None:
+            mask &= self._price >= query.min_price
+        if query.max_price is not None:
+            mask &= self._price <= query.max_price
+        for column, dictionary, value in (
+            (self._currency, self._currencies, query.currency),
+            (self._shop, self._shops, query.shop),
+        ):
+            if value is not None:
+                code = dictionary.lookup(value)
+                if code is None:
+                    return np.zeros_like(mask)
+                mask &= column == code
+        if query.tags:
+            packed = np.packbits(mask, bitorder="little")
+            for tag in query.tags:
+                bits = self._tag_bits.get(tag)
+                if bits is None:
+                    return np.zeros_like(mask)
+                packed &= bits
+            mask = np.unpackbits(packed, count=len(mask), bitorder="little").astype(bool)
+        return mask
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        row = len(self._ids)
+        if row == len(self._alive):
+            self._grow(2 * row)
+        self._ids.append(None)
+        return row
+
+    def _grow(self, capacity: int) -> None:
+        def resized(array: np.ndarray, size: int) -> np.ndarray:
+            grown = np.zeros(size, dtype=array.dtype)
+            grown[: len(array)] = array
+            return grown
+
+        self._alive = resized(self._alive, capacity)
+        self._price = resized(self._price, capacity)
+        self._updated = resized(self._updated, capacity)
+        self._currency = resized(self._currency, capacity)
+        self._shop = resized(self._shop, capacity)
+        self._tag_bits = {tag: resized(bits, capacity // 8) for tag, bits in self._tag_bits.items()}
+
+    def _clear_tags(self, row: int) -> None:
+        byte, bit = divmod(row, 8)
+        for tag in self._row_tags.pop(row, ()):
+            self._tag_bits[tag][byte] &= np.uint8(~(1 << bit) & 0xFF)
+            self._tag_rows[tag] -= 1
+            if not self._tag_rows[tag]:
+                del self._tag_bits[tag], self._tag_rows[tag]
+
+
+def _round_up(capacity: int) -> int:
+    """Capacities stay multiples of 8 so bitmaps pack rows exactly."""
+
+    return max(8, -(-capacity // 8) * 8)
+
+
+def _as_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _count_codes(
+    codes: np.ndarray, dictionary: _Dictionary, limit: Optional[int] = None
+) -> Dict[str, int]:
+    counts = np.bincount(codes, minlength=len(dictionary.values))
+    found = {
+        dictionary.values[code]: int(counts[code])
+        for code in np.flatnonzero(counts).tolist()
+        if code != _MISSING
+    }
+    return _top(found, limit)
+
+
+def _top(counts: Dict[str, int], limit: Optional[int] = None) -> Dict[str, int]:
+    ranked = sorted(
+        ((value, count) for value, count in counts.items() if count),
+        key=lambda item: (-item[1], item[0]),
+    )
+    return dict(ranked[:limit])
+
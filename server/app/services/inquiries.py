@@ -3,12 +3,14 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import UUID, uuid4
 
 from fastapi import HTTPException
 
-from ..db.storage import JsonStorage, get_storage
+from ..db.aio import AsyncStorage, get_async_storage
+from ..db.snapshot import StorageSnapshot
+from ..db.storage import JsonStorage
 from ..schemas import (
     InquiryHistoryResponse,
     InquiryMessageCreate,
@@ -20,7 +22,7 @@ from ..schemas import (
 
 
 class InquiryService:
-    def __init__(self, storage: JsonStorage) -> None:
+    def __init__(self, storage: AsyncStorage) -> None:
         self._storage = storage
 
     # ------------------------------------------------------------------
@@ -32,11 +34,20 @@ class InquiryService:
         theme_id: Optional[UUID] = None,
         product_id: Optional[UUID] = None,
     ) -> List[InquirySessionResponse]:
-        sessions = self._storage.list_values("inquiry_sessions")
         if theme_id:
-            sessions = [s for s in sessions if s.get("theme_id") == str(theme_id)]
-        if product_id:
-            sessions = [s for s in sessions if s.get("product_id") == str(product_id)]
+            sessions = await self._storage.find("inquiry_sessions", "theme_id", str(theme_id))
+            if product_id:
+                sessions = [s for s in sessions if s.get("product_id") == str(product_id)]
+        elif product_id:
+            sessions = await self._storage.find("inquiry_sessions", "product_id", str(product_id))
+        else:
+            # already newest first
+            return [
+                self._to_session_model(item)
+                for item in await self._storage.read(
+                    lambda snapshot: snapshot.scan("inquiry_sessions", "created_at")
+                )
+            ]
         sessions.sort(key=lambda item: item["created_at"], reverse=True)
         return [self._to_session_model(item) for item in sessions]
 
@@ -52,7 +63,7 @@ class InquiryService:
             "created_at": now,
             "message_count": 0,
         }
-        stored = self._storage.insert(
+        stored = await self._storage.insert(
             "inquiry_sessions",
             record,
             entity_type="inquiry_session",
@@ -61,7 +72,7 @@ class InquiryService:
         return self._to_session_model(stored)
 
     async def get_session(self, session_id: UUID) -> InquirySessionResponse:
-        raw = self._storage.get("inquiry_sessions", str(session_id))
+        raw = await self._storage.get("inquiry_sessions", str(session_id))
         if not raw:
             raise HTTPException(status_code=404, detail="Session not found")
         return self._to_session_model(raw)
@@ -70,36 +81,41 @@ class InquiryService:
     # messages
     # ------------------------------------------------------------------
     async def list_messages(self, session_id: UUID) -> InquiryHistoryResponse:
-        session = await self.get_session(session_id)
-        messages = [
-            msg
-            for msg in self._storage.list_values("inquiry_messages")
-            if msg["session_id"] == str(session_id)
-        ]
-        messages.sort(key=lambda item: item["created_at"])
+        raw_session, messages = await self._storage.read(self._read_history, str(session_id))
+        if not raw_session:
+            raise HTTPException(status_code=404, detail="Session not found")
         return InquiryHistoryResponse(
-            session=session,
+            session=self._to_session_model(raw_session),
             messages=[self._to_message_model(msg) for msg in messages],
         )
 
+    async def history_version(self, session_id: UUID) -> int:
+        """Last-modified version of a session's history; 0 if it does not exist.
+
+        Appending a message updates the session's ``message_count`` in the
+        same transaction, so the session's own version covers its messages.
+        """
+
+        return await self._storage.last_modified("inquiry_session", str(session_id))
+
     async def post_message(
         self, session_id: UUID, payload: InquiryMessageCreate
     ) -> List[InquiryMessageResponse]:
-        session = self._storage.get("inquiry_sessions", str(session_id))
+        session = await self._storage.get("inquiry_sessions", str(session_id))
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
-        user_message = self._store_message(session_id, payload)
+        user_message = await self._store_message(session_id, payload)
         responses = [user_message]
         if payload.role == "user":
             reply = await self._generate_reply(session, payload.content)
-            responses.append(self._store_message(session_id, reply))
+            responses.append(await self._store_message(session_id, reply))
         return responses
 
     # ------------------------------------------------------------------
     # summary helpers
     # ------------------------------------------------------------------
     async def theme_summary(self, theme_id: UUID) -> InquirySummaryResponse:
-        theme = self._storage.get("themes", str(theme_id))
+        theme = await self._storage.get("themes", str(theme_id))
         if not theme:
             raise HTTPException(status_code=404, detail="Theme not found")
         sessions = await self.list_sessions(theme_id=theme_id)
@@ -111,7 +127,7 @@ class InquiryService:
     # ------------------------------------------------------------------
     # internal helpers
     # ------------------------------------------------------------------
-    def _store_message(
+    async def _store_message(
         self,
         session_id: UUID,
         payload: InquiryMessageCreate | InquiryMessageResponse,
@@ -127,38 +143,38 @@ class InquiryService:
                 "metadata": payload.metadata,
                 "created_at": datetime.utcnow().isoformat() + "Z",
             }
-        self._storage.insert(
+        await self._storage.transact(self._append_message, str(session_id), record)
+        return self._to_message_model(record)
+
+    def _append_message(
+        self, storage: JsonStorage, session_key: str, record: Dict[str, Any]
+    ) -> None:
+        storage.insert(
             "inquiry_messages",
             record,
             entity_type="inquiry_message",
             action="created",
         )
         # update message count on session
-        raw_session = self._storage.get("inquiry_sessions", str(session_id))
+        raw_session = storage.get("inquiry_sessions", session_key)
         if raw_session:
-            raw_session["message_count"] = int(raw_session.get("message_count", 0)) + 1
-            self._storage.update(
+            storage.update(
                 "inquiry_sessions",
-                str(session_id),
-                raw_session,
+                session_key,
+                {**raw_session, "message_count": int(raw_session.get("message_count", 0)) + 1},
                 entity_type="inquiry_session",
                 action="updated",
             )
-        return self._to_message_model(record)
 
     async def _generate_reply(
         self, session: Dict[str, Optional[str]], user_message: str
     ) -> InquiryMessageCreate:
-        theme_context = None
-        if session.get("theme_id"):
-            theme_context = self._storage.get("themes", session["theme_id"])
-        product_context = None
-        if session.get("product_id"):
-            product_context = self._storage.get("products", session["product_id"])
+        theme_context, product_context, related_products = await self._storage.read(
+            self._reply_context, session
+        )
         lines: List[str] = []
         if theme_context:
             lines.append(f"主题「{theme_context['title']}」的偏好：{theme_context.get('preference_text') or '未设置'}")
-            related_products = self._collect_products(theme_context["id"])
             if related_products:
                 lines.append("相关商品概览：")
                 for product in related_products:
@@ -178,7 +194,7 @@ class InquiryService:
             lines.append("偏好标签：" + "、".join(theme["preference_tags"]))
         if theme.get("preference_text"):
             lines.append("偏好描述：" + theme["preference_text"])
-        products = self._collect_products(theme["id"])
+        products = await self._storage.read(self._collect_products, theme["id"])
         if products:
             lines.append(f"共收集 {len(products)} 件商品：")
             for product in products:
@@ -187,15 +203,37 @@ class InquiryService:
             lines.append("尚未添加商品，建议通过右上角加号导入。")
         return "\n".join(lines)
 
-    def _collect_products(self, theme_id: str) -> List[Dict[str, object]]:
-        links = [
-            link
-            for link in self._storage.list_values("theme_products")
-            if link["theme_id"] == theme_id
-        ]
+    def _read_history(
+        self, snapshot: StorageSnapshot, session_key: str
+    ) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        raw_session = snapshot.get("inquiry_sessions", session_key)
+        if not raw_session:
+            return None, []
+        # the ordered index yields newest first; a history reads oldest first
+        messages = snapshot.scan("inquiry_messages", "created_at", partition=session_key)
+        return raw_session, messages[::-1]
+
+    def _reply_context(
+        self, snapshot: StorageSnapshot, session: Dict[str, Optional[str]]
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], List[Dict[str, object]]]:
+        theme_context = None
+        if session.get("theme_id"):
+            theme_context = snapshot.get("themes", session["theme_id"])
+        product_context = None
+        if session.get("product_id"):
+            product_context = snapshot.get("products", session["product_id"])
+        related_products = (
+            self._collect_products(snapshot, theme_context["id"]) if theme_context else []
+        )
+        return theme_context, product_context, related_products
+
+    def _collect_products(
+        self, snapshot: StorageSnapshot, theme_id: str
+    ) -> List[Dict[str, object]]:
+        links = snapshot.find("theme_products", "theme_id", theme_id)
         products: List[Dict[str, object]] = []
         for link in links:
-            product = self._storage.get("products", link["product_id"])
+            product = snapshot.get("products", link["product_id"])
             if product:
                 products.append(product)
         return products
@@ -221,5 +259,5 @@ _inquiry_service: Optional[InquiryService] = None
 def get_inquiry_service() -> InquiryService:
     global _inquiry_service
     if _inquiry_service is None:
-        _inquiry_service = InquiryService(get_storage())
+        _inquiry_service = InquiryService(get_async_storage())
     return _inquiry_service
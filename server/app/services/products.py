@@ -3,38 +3,208 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Dict, List, Optional
+from threading import Lock
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 from uuid import UUID, uuid4
 
-from ..db.storage import JsonStorage, get_storage
+from pydantic import ValidationError
+
+from ..core.cache import LRUCache
+from ..core.ndjson import Row, RowError
+from ..core.search import InvertedIndex
+from ..db.aio import AsyncStorage, get_async_storage
+from ..db.snapshot import StorageSnapshot
+from ..db.storage import JsonStorage
 from ..schemas.product import ProductCreate, ProductResponse
+from .catalog import Facets, ProductColumns, ProductFilter
+
+# validated ProductResponse models kept around, keyed by (id, version)
+MODEL_CACHE_SIZE = 4096
+
+# rows validated and written per storage commit by bulk_upsert
+BULK_CHUNK_SIZE = 500
+
+ProductRecord = Tuple[Optional[Dict[str, Any]], int]
+
+
+class _DerivedIndex:
+    """A structure derived from the product collection and how far it lags.
+
+    The storage commit hook only notes which products changed (it runs under
+    the storage lock); readers bring the structure up to date from their own
+    snapshot before using it. The structure is built from a full snapshot on
+    first use.
+    """
+
+    def __init__(
+        self, put: Callable[[Dict[str, Any]], None], remove: Callable[[str], None]
+    ) -> None:
+        self._put = put
+        self._remove = remove
+        self._built = False
+        # serialises use of the structure itself
+        self.lock = Lock()
+        # product id -> version of its latest change not yet applied
+        self._pending: Dict[str, int] = {}
+        self._pending_lock = Lock()
+
+    def note(self, product_id: str, version: int) -> None:
+        with self._pending_lock:
+            self._pending[product_id] = version
+
+    def refresh(self, snapshot: StorageSnapshot) -> None:
+        """Apply the pending changes ``snapshot`` already reflects; hold :attr:`lock`.
+
+        Changes committed after the snapshot stay pending, so a concurrent
+        reader with an older snapshot never applies stale content. Until the
+        first build, pending changes are only discarded: the build covers them.
+        """
+
+        with self._pending_lock:
+            visible = [
+                product_id
+                for product_id, version in self._pending.items()
+                if version <= snapshot.version
+            ]
+            for product_id in visible:
+                del self._pending[product_id]
+        if not self._built:
+            # the full build already reflects every change the snapshot does
+            for product in snapshot.list_values("products"):
+                self._put(product)
+            self._built = True
+            return
+        for product_id, product in zip(visible, snapshot.get_many("products", visible)):
+            if product is None:
+                self._remove(product_id)
+            else:
+                self._put(product)
 
 
 class ProductService:
-    def __init__(self, storage: JsonStorage) -> None:
+    def __init__(self, storage: AsyncStorage, *, model_cache_size: int = MODEL_CACHE_SIZE) -> None:
         self._storage = storage
+        self._models: LRUCache[ProductResponse] = LRUCache(model_cache_size)
+        # full-text index and columnar view of the catalogue, built on first
+        # use and then kept current from the storage's commit hook
+        self._search_index = InvertedIndex()
+        self._search = _DerivedIndex(
+            lambda product: self._search_index.put(product["id"], self._search_text(product)),
+            self._search_index.remove,
+        )
+        self._columns = ProductColumns()
+        self._catalog = _DerivedIndex(self._columns.put, self._columns.remove)
+        storage.backend.add_listener(self._on_commit)
 
     # ------------------------------------------------------------------
     # CRUD helpers
     # ------------------------------------------------------------------
-    async def list_products(self) -> List[ProductResponse]:
-        products = sorted(
-            self._storage.list_values("products"),
-            key=lambda item: item["updated_at"],
-            reverse=True,
-        )
-        return [ProductResponse.parse_obj(product) for product in products]
+    async def list_products(
+        self, query: ProductFilter = ProductFilter(), *, sort: str = "updated"
+    ) -> List[ProductResponse]:
+        if query.empty and sort == "updated":
+            products = await self._storage.read(
+                lambda snapshot: snapshot.scan("products", "updated_at")
+            )
+            return [ProductResponse.parse_obj(product) for product in products]
+        records = await self._storage.read(self._select, query, sort)
+        return [model for model in self.to_models(records) if model is not None]
+
+    async def facets(self, query: ProductFilter = ProductFilter()) -> Facets:
+        """Counts of the products matching ``query`` by currency, shop and tag."""
+
+        return await self._storage.read(self._facets, query)
 
     async def get_product(self, product_id: UUID) -> Optional[ProductResponse]:
-        raw = self._storage.get("products", str(product_id))
-        if not raw:
-            return None
-        return ProductResponse.parse_obj(raw)
+        (product,) = await self.get_many([product_id])
+        return product
+
+    async def get_many(
+        self, product_ids: Sequence[Union[UUID, str]]
+    ) -> List[Optional[ProductResponse]]:
+        """Validated products for ``product_ids`` in order, ``None`` where missing.
+
+        Reads every record in one snapshot and only validates products whose
+        ``(id, version)`` is not already in the model cache.
+        """
+
+        records = await self._storage.read(
+            self.read_records, [str(product_id) for product_id in product_ids]
+        )
+        return self.to_models(records)
+
+    @staticmethod
+    def read_records(
+        snapshot: StorageSnapshot, product_keys: Sequence[str]
+    ) -> List[ProductRecord]:
+        """``(raw, version)`` pairs for :meth:`to_models`, read from one snapshot."""
+
+        return list(
+            zip(
+                snapshot.get_many("products", product_keys),
+                snapshot.last_modified_many("product", product_keys),
+            )
+        )
+
+    def to_models(self, records: Sequence[ProductRecord]) -> List[Optional[ProductResponse]]:
+        """Turn :meth:`read_records` output into models, through the cache.
+
+        Must run on the event loop: the cache is not thread-safe.
+        """
+
+        models: List[Optional[ProductResponse]] = []
+        for raw, version in records:
+            if raw is None:
+                models.append(None)
+                continue
+            key = (raw["id"], version)
+            model = self._models.get(key) if version else None
+            if model is None:
+                model = ProductResponse.parse_obj(raw)
+                if version:
+                    self._models.put(key, model)
+            models.append(model)
+        return models
+
+    async def search(self, query: str, *, limit: int) -> List[ProductResponse]:
+        """Products matching ``query``, most relevant (BM25) first."""
+
+        records = await self._storage.read(self._search_records, query, limit)
+        return [model for model in self.to_models(records) if model is not None]
+
+    async def products_version(self) -> int:
+        return await self._storage.last_modified("product")
+
+    async def product_version(self, product_id: UUID) -> int:
+        """Last-modified version of a product; 0 if it does not exist."""
+
+        return await self._storage.last_modified("product", str(product_id))
 
     async def upsert_product(self, payload: ProductCreate) -> ProductResponse:
+        stored = await self._storage.transact(self.upsert_record, payload)
+        return ProductResponse.parse_obj(stored)
+
+    def upsert_record(self, storage: JsonStorage, payload: ProductCreate) -> Dict[str, Any]:
+        """Create or update a product and return the stored record.
+
+        Synchronous so that callers can run it inside a storage transaction
+        (see :meth:`AsyncStorage.transact`).
+        """
+
         now = datetime.utcnow()
         product_id = str(payload.id or uuid4())
-        existing = self._storage.get("products", product_id)
+        existing = storage.get("products", product_id)
         base = payload.dict(by_alias=True)
         base.update(
             {
@@ -46,7 +216,7 @@ class ProductService:
             base["created_at"] = now.isoformat() + "Z"
             if not base.get("tags"):
                 base["tags"] = self._generate_tags(base)
-            stored = self._storage.insert(
+            stored = storage.insert(
                 "products",
                 base,
                 entity_type="product",
@@ -56,23 +226,127 @@ class ProductService:
             base.setdefault("created_at", existing.get("created_at"))
             if not base.get("tags"):
                 base["tags"] = existing.get("tags") or self._generate_tags(base)
-            stored = self._storage.update(
+            stored = storage.update(
                 "products",
                 product_id,
                 base,
                 entity_type="product",
                 action="updated",
             )
-        return ProductResponse.parse_obj(stored)
+        return stored
+
+    async def bulk_upsert(
+        self, rows: AsyncIterable[Row], *, chunk_size: int = BULK_CHUNK_SIZE
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Create or update streamed product rows, yielding each chunk's results.
+
+        Rows are collected ``chunk_size`` at a time; each chunk is validated
+        and written on a storage worker in one transaction, so a catalogue
+        load costs one commit per chunk instead of one per product. The
+        results of a chunk are yielded once it is committed, one per row in
+        row order: ``{"row", "status": "created" | "updated", "id"}`` or
+        ``{"row", "status": "error", "error"}``. An invalid row does not
+        affect the rest of its chunk. A chunk is reported only once it is
+        durable, even when the background writer flushes commits later.
+        """
+
+        chunk: List[Row] = []
+        async for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield await self._write_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield await self._write_chunk(chunk)
+
+    async def _write_chunk(self, chunk: List[Row]) -> List[Dict[str, Any]]:
+        try:
+            results = await self._storage.transact(self._upsert_rows, chunk)
+        except Exception as exc:  # the whole chunk was rolled back
+            return [
+                {"row": number, "status": "error", "error": f"chunk not stored: {exc}"}
+                for number, _ in chunk
+            ]
+        await self._storage.wait_durable()
+        return results
+
+    def _upsert_rows(self, storage: JsonStorage, chunk: List[Row]) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
+        for number, value in chunk:
+            if isinstance(value, RowError):
+                results.append({"row": number, "status": "error", "error": str(value)})
+                continue
+            try:
+                payload = ProductCreate.parse_obj(value)
+            except ValidationError as exc:
+                error = "; ".join(
+                    f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}"
+                    for item in exc.errors()
+                )
+                results.append({"row": number, "status": "error", "error": error})
+                continue
+            existed = payload.id is not None and (
+                storage.get("products", str(payload.id)) is not None
+            )
+            stored = self.upsert_record(storage, payload)
+            results.append(
+                {
+                    "row": number,
+                    "status": "updated" if existed else "created",
+                    "id": stored["id"],
+                }
+            )
+        return results
 
     async def delete_product(self, product_id: UUID) -> None:
-        self._storage.delete(
+        await self._storage.delete(
             "products",
             str(product_id),
             entity_type="product",
             action="deleted",
         )
 
+    # ------------------------------------------------------------------
+    # search and columnar filtering
+    # ------------------------------------------------------------------
+    def _on_commit(self, changes: List[Dict[str, Any]]) -> None:
+        for change in changes:
+            if change["entity_type"] == "product":
+                self._search.note(change["entity_id"], change["version"])
+                self._catalog.note(change["entity_id"], change["version"])
+
+    def _search_records(
+        self, snapshot: StorageSnapshot, query: str, limit: int
+    ) -> List[ProductRecord]:
+        with self._search.lock:
+            self._search.refresh(snapshot)
+            hits = self._search_index.search(query, limit)
+        return self.read_records(snapshot, [product_id for product_id, _ in hits])
+
+    def _select(
+        self, snapshot: StorageSnapshot, query: ProductFilter, sort: str
+    ) -> List[ProductRecord]:
+        with self._catalog.lock:
+            self._catalog.refresh(snapshot)
+            product_ids = self._columns.select(query, sort)
+        return self.read_records(snapshot, product_ids)
+
+    def _facets(self, snapshot: StorageSnapshot, query: ProductFilter) -> Facets:
+        with self._catalog.lock:
+            self._catalog.refresh(snapshot)
+            return self._columns.facets(query)
+
+    @staticmethod
+    def _search_text(product: Dict[str, Any]) -> str:
+        parts = [str(product.get("title") or ""), str(product.get("description") or "")]
+        parts.extend(str(tag) for tag in product.get("tags") or ())
+        parameters = product.get("parameters") or {}
+        if isinstance(parameters, dict):
+            for key, value in parameters.items():
+                parts.append(str(key))
+                parts.append(str(value))
+        return "\n".join(parts)
+
     # ------------------------------------------------------------------
     # utilities
     # ------------------------------------------------------------------
@@ -92,5 +366,5 @@ _product_service: Optional[ProductService] = None
 def get_product_service() -> ProductService:
     global _product_service
     if _product_service is None:
-        _product_service = ProductService(get_storage())
+        _product_service = ProductService(get_async_storage())
     return _product_service
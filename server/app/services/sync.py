@@ -2,29 +2,281 @@
 
 from __future__ import annotations
 
-from typing import Optional
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+from uuid import UUID
 
-from ..db.storage import JsonStorage, get_storage
+from ..core.compression import EncodedBodyCache, encode_body
+from ..db.aio import AsyncStorage, get_async_storage
+from ..db.changelog import full_entry
+from ..db.snapshot import StorageSnapshot
 from ..schemas import ChangeEntry, SyncResponse
 
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+# raw log entries a filtered or coalesced page may scan before it stops and
+# hands back a cursor, so a sparse filter cannot turn into a full-log scan
+MAX_SCAN = 10 * MAX_PAGE_SIZE
+# longest long-poll a client may ask for, in seconds
+MAX_WAIT = 60.0
+# idle stream clients get a comment line this often so proxies keep the
+# connection open and dead clients are noticed
+STREAM_HEARTBEAT = 15.0
+# budget for cached, serialised sync pages (all content codings together)
+PAGE_CACHE_BYTES = 32 * 1024 * 1024
+# how update payloads are returned: the full entity, or the logged merge patch
+PAYLOAD_FORMATS = ("full", "patch")
+
 
 class SyncService:
-    def __init__(self, storage: JsonStorage) -> None:
+    def __init__(self, storage: AsyncStorage, *, page_cache_bytes: int = PAGE_CACHE_BYTES) -> None:
         self._storage = storage
+        self._page_cache = EncodedBodyCache(page_cache_bytes)
+
+    async def list_changes_encoded(
+        self,
+        since: int,
+        limit: int = DEFAULT_PAGE_SIZE,
+        *,
+        coalesce: bool = False,
+        entity_types: Optional[Sequence[str]] = None,
+        theme_id: Optional[UUID] = None,
+        payload_format: str = "full",
+        wait: float = 0.0,
+        accept_encoding: Optional[str] = None,
+    ) -> Tuple[bytes, Optional[str]]:
+        """Serialised (and possibly compressed) :meth:`list_changes` body.
+
+        Returns ``(body, content_encoding)``. A page that is followed by more
+        changes covers a version range that can no longer change, so its
+        body is cached and later requests for it skip the storage and model
+        work entirely. The open tail page is always built fresh, and so are
+        theme-scoped pages, whose product membership follows live links.
+        The key includes the compaction baseline, which is the only thing
+        that rewrites history.
+        """
+
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        key = None
+        if theme_id is None:
+            key = (
+                since,
+                limit,
+                coalesce,
+                tuple(sorted(set(entity_types or ()))),
+                payload_format,
+                self._storage.backend.changes_baseline,
+            )
+            cached = self._page_cache.get(key, accept_encoding)
+            if cached is not None:
+                return cached
+        response = await self.list_changes(
+            since,
+            limit,
+            coalesce=coalesce,
+            entity_types=entity_types,
+            theme_id=theme_id,
+            payload_format=payload_format,
+            wait=wait,
+        )
+        body = response.json().encode("utf-8")
+        if key is not None and response.has_more and key[-1] == response.baseline_version:
+            return self._page_cache.put(key, body, accept_encoding)
+        return encode_body(body, accept_encoding)
+
+    async def list_changes(
+        self,
+        since: int,
+        limit: int = DEFAULT_PAGE_SIZE,
+        *,
+        coalesce: bool = False,
+        entity_types: Optional[Sequence[str]] = None,
+        theme_id: Optional[UUID] = None,
+        payload_format: str = "full",
+        wait: float = 0.0,
+    ) -> SyncResponse:
+        """Return one page of changes after ``since``.
+
+        Updates are logged as merge patches; with ``payload_format="full"``
+        (and always when coalescing, where earlier patches are skipped) they
+        are materialised into the full entity. With ``wait`` > 0 an empty
+        page is held back (long-poll) until a commit produces something or
+        ``wait`` seconds pass.
+        """
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(max(wait, 0.0), MAX_WAIT)
+        while True:
+            response = await self._page(
+                since, limit, coalesce, entity_types, theme_id, payload_format
+            )
+            remaining = deadline - loop.time()
+            if response.changes or response.has_more or response.reset or remaining <= 0:
+                return response
+            await self._storage.wait_for_change(response.version, remaining)
+
+    async def stream(
+        self,
+        since: int,
+        *,
+        coalesce: bool = False,
+        entity_types: Optional[Sequence[str]] = None,
+        theme_id: Optional[UUID] = None,
+        payload_format: str = "full",
+        heartbeat: float = STREAM_HEARTBEAT,
+    ) -> AsyncIterator[str]:
+        """Yield Server-Sent Events with every page of changes after ``since``.
+
+        Each event carries a :class:`SyncResponse` as JSON and its
+        ``next_since`` as the event id, so a reconnecting client resumes via
+        ``Last-Event-ID``.
+        """
+
+        while True:
+            response = await self._page(
+                since, DEFAULT_PAGE_SIZE, coalesce, entity_types, theme_id, payload_format
+            )
+            if response.changes or response.reset:
+                yield f"id: {response.next_since}\nevent: changes\ndata: {response.json()}\n\n"
+            since = response.next_since
+            if response.has_more:
+                continue
+            if not await self._storage.wait_for_change(response.version, heartbeat):
+                yield ": keep-alive\n\n"
 
-    async def list_changes(self, since: int) -> SyncResponse:
-        changes = self._storage.list_changes_since(since)
+    async def _page(
+        self,
+        since: int,
+        limit: int,
+        coalesce: bool,
+        entity_types: Optional[Sequence[str]],
+        theme_id: Optional[UUID],
+        payload_format: str,
+    ) -> SyncResponse:
+        if payload_format not in PAYLOAD_FORMATS:
+            raise ValueError(f"payload_format must be one of {', '.join(PAYLOAD_FORMATS)}")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        version, baseline, changes, next_since, has_more = await self._storage.read(
+            self._read_changes,
+            since,
+            limit,
+            coalesce,
+            frozenset(entity_types or ()),
+            str(theme_id) if theme_id else None,
+            coalesce or payload_format == "full",
+        )
+        if coalesce:
+            # tombstones: the client only needs to know what to drop
+            changes = [
+                {**change, "payload": None} if change["action"] == "deleted" else change
+                for change in changes
+            ]
         return SyncResponse(
             since=since,
             changes=[ChangeEntry.parse_obj(change) for change in changes],
+            next_since=next_since,
+            has_more=has_more,
+            version=version,
+            baseline_version=baseline,
+            # a client that is paging through a full resync from 0 passes
+            # cursors below the baseline too; it already holds no stale state
+            # and can ignore the flag
+            reset=0 < since < baseline,
+        )
+
+    @staticmethod
+    def _read_changes(
+        snapshot: StorageSnapshot,
+        since: int,
+        limit: int,
+        coalesce: bool,
+        entity_types: frozenset,
+        theme_key: Optional[str],
+        materialize: bool,
+    ) -> Tuple[int, int, List[Dict[str, Any]], int, bool]:
+        """Select one page of changes.
+
+        Returns ``(version, baseline, changes, next_since, has_more)``.
+        ``next_since`` is the last *scanned* version, so entries a filter
+        skipped are not scanned again by the next page.
+        """
+
+        filtered = coalesce or bool(entity_types) or theme_key is not None
+        # one extra entry tells whether another page follows
+        scan = MAX_SCAN if filtered else limit + 1
+        window = snapshot.list_changes_since(since, scan)
+        scope = _ThemeScope(snapshot, theme_key) if theme_key is not None else None
+        selected: Dict[Any, Dict[str, Any]] = {}
+        cursor = since
+        has_more = len(window) >= scan
+        for change in window:
+            key = (change["entity_type"], change["entity_id"]) if coalesce else change["version"]
+            if len(selected) >= limit and key not in selected:
+                has_more = True
+                break
+            cursor = change["version"]
+            if entity_types and change["entity_type"] not in entity_types:
+                continue
+            if scope is not None and not scope.includes(change):
+                continue
+            # re-inserting moves a coalesced entity to its latest position
+            selected.pop(key, None)
+            selected[key] = change
+        changes = list(selected.values())
+        if materialize:
+            changes = [
+                full_entry(change, entity)
+                for change, entity in zip(changes, snapshot.materialize_many(changes))
+            ]
+        return (
+            snapshot.version,
+            snapshot.changes_baseline,
+            changes,
+            cursor,
+            has_more,
         )
 
 
+class _ThemeScope:
+    """Decides which changes belong to one theme.
+
+    Products and messages do not carry a theme id, so membership follows the
+    theme's current links and sessions plus those seen earlier in the page.
+    """
+
+    def __init__(self, snapshot: StorageSnapshot, theme_key: str) -> None:
+        self._theme_key = theme_key
+        self._products: Set[str] = {
+            link["product_id"] for link in snapshot.find("theme_products", "theme_id", theme_key)
+        }
+        self._sessions: Set[str] = {
+            session["id"] for session in snapshot.find("inquiry_sessions", "theme_id", theme_key)
+        }
+
+    def includes(self, change: Dict[str, Any]) -> bool:
+        entity_type = change["entity_type"]
+        # updates and deletions carry their foreign keys in ``refs``
+        payload = change.get("refs") or change.get("payload") or {}
+        if entity_type == "theme":
+            return change["entity_id"] == self._theme_key
+        if entity_type == "product":
+            return change["entity_id"] in self._products
+        if entity_type == "inquiry_message":
+            return payload.get("session_id") in self._sessions
+        if payload.get("theme_id") != self._theme_key:
+            return False
+        if entity_type == "theme_product":
+            self._products.add(payload["product_id"])
+        elif entity_type == "inquiry_session":
+            self._sessions.add(change["entity_id"])
+        return True
+
+
 _sync_service: Optional[SyncService] = None
 
 
 def get_sync_service() -> SyncService:
     global _sync_service
     if _sync_service is None:
-        _sync_service = SyncService(get_storage())
+        _sync_service = SyncService(get_async_storage())
     return _sync_service
@@ -2,13 +2,18 @@
 
 from __future__ import annotations
 
+import logging
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import UUID, uuid4
 
 from fastapi import HTTPException
 
-from ..db.storage import JsonStorage, get_storage
+from ..core.pagination import next_cursor
+from ..db.aio import AsyncStorage, get_async_storage
+from ..db.snapshot import StorageSnapshot
+from ..db.storage import Dependent, JsonStorage
+from ..schemas.product import ProductResponse
 from ..schemas.theme import (
     ThemeCreate,
     ThemeProductAddRequest,
@@ -16,11 +21,19 @@ from ..schemas.theme import (
     ThemeResponse,
     ThemeUpdate,
 )
-from .products import ProductService, get_product_service
+from .products import ProductRecord, ProductService, get_product_service
+
+logger = logging.getLogger(__name__)
+
+# decoded keyset cursor: (sort field value, id) of the last item seen
+Cursor = Tuple[Any, str]
+
+# records deleted together with their theme
+THEME_DEPENDENTS: Tuple[Dependent, ...] = (("theme_products", "theme_id", "theme_product"),)
 
 
 class ThemeService:
-    def __init__(self, storage: JsonStorage, product_service: ProductService) -> None:
+    def __init__(self, storage: AsyncStorage, product_service: ProductService) -> None:
         self._storage = storage
         self._products = product_service
 
@@ -33,24 +46,20 @@ class ThemeService:
         page: int,
         page_size: int,
         updated_after: Optional[str],
-    ) -> List[ThemeResponse]:
-        themes = self._storage.list_values("themes")
-        if updated_after:
-            cutoff = self._parse_dt(updated_after)
-            themes = [
-                item for item in themes if self._parse_dt(item["updated_at"]) > cutoff
-            ]
-        themes.sort(key=lambda item: item["updated_at"], reverse=True)
-        start = (page - 1) * page_size
-        end = start + page_size
-        sliced = themes[start:end]
-        return [self._to_model(item) for item in sliced]
+        after: Optional[Cursor] = None,
+    ) -> Tuple[List[ThemeResponse], Optional[str]]:
+        """One page of themes, newest first, and the cursor of the next page.
+
+        ``after`` (a decoded keyset cursor) takes precedence over ``page``.
+        """
+
+        themes, cursor = await self._storage.read(
+            self._list_themes, page, page_size, updated_after, after
+        )
+        return [self._to_model(item) for item in themes], cursor
 
     async def get_theme(self, theme_id: UUID) -> Optional[ThemeResponse]:
-        raw = self._storage.get("themes", str(theme_id))
-        if not raw:
-            return None
-        return self._to_model(raw)
+        return await self._storage.read(self._get_theme, str(theme_id))
 
     async def create_theme(self, payload: ThemeCreate) -> ThemeResponse:
         now = datetime.utcnow()
@@ -60,10 +69,11 @@ class ThemeService:
             "title": payload.title,
             "preference_tags": payload.preference.tags,
             "preference_text": payload.preference.description,
+            "product_count": 0,
             "created_at": now.isoformat() + "Z",
             "updated_at": now.isoformat() + "Z",
         }
-        stored = self._storage.insert(
+        stored = await self._storage.insert(
             "themes",
             data,
             entity_type="theme",
@@ -71,48 +81,23 @@ class ThemeService:
         )
         if payload.products:
             await self.add_products(UUID(theme_id), ThemeProductAddRequest(products=payload.products))
+            stored = await self._storage.get("themes", theme_id) or stored
         return self._to_model(stored)
 
     async def update_theme(self, theme_id: UUID, payload: ThemeUpdate) -> Optional[ThemeResponse]:
-        raw = self._storage.get("themes", str(theme_id))
-        if not raw:
-            return None
-        changed = False
-        if payload.title is not None and payload.title != raw.get("title"):
-            raw["title"] = payload.title
-            changed = True
-        if payload.preference:
-            raw["preference_tags"] = payload.preference.tags
-            raw["preference_text"] = payload.preference.description
-            changed = True
-        if changed:
-            raw["updated_at"] = datetime.utcnow().isoformat() + "Z"
-            stored = self._storage.update(
-                "themes",
-                str(theme_id),
-                raw,
-                entity_type="theme",
-                action="updated",
-            )
-        else:
-            stored = raw
-        return self._to_model(stored)
+        # read and write in one transaction so a concurrent link change cannot
+        # be overwritten with a stale product_count
+        stored = await self._storage.transact(self._update_theme, str(theme_id), payload)
+        return self._to_model(stored) if stored else None
 
     async def delete_theme(self, theme_id: UUID) -> None:
-        theme_key = str(theme_id)
-        existing = self._storage.get("themes", theme_key)
-        if not existing:
-            return
-        self._storage.delete("themes", theme_key, entity_type="theme", action="deleted")
-        # cascade delete theme products
-        for link in list(self._storage.list_values("theme_products")):
-            if link["theme_id"] == theme_key:
-                self._storage.delete(
-                    "theme_products",
-                    link["id"],
-                    entity_type="theme_product",
-                    action="deleted",
-                )
+        await self._storage.delete_cascade(
+            "themes",
+            str(theme_id),
+            entity_type="theme",
+            action="deleted",
+            dependents=THEME_DEPENDENTS,
+        )
 
     # ------------------------------------------------------------------
     # theme-product associations
@@ -123,117 +108,295 @@ class ThemeService:
         *,
         page: int,
         page_size: int,
-    ) -> List[ThemeProductResponse]:
-        theme_key = str(theme_id)
-        links = [
-            link
-            for link in self._storage.list_values("theme_products")
-            if link["theme_id"] == theme_key
-        ]
-        links.sort(key=lambda item: item["added_at"], reverse=True)
-        start = (page - 1) * page_size
-        end = start + page_size
-        sliced = links[start:end]
-        results: List[ThemeProductResponse] = []
-        for link in sliced:
-            product = await self._products.get_product(UUID(link["product_id"]))
-            if not product:
-                continue
-            results.append(
-                ThemeProductResponse(
-                    id=UUID(link["id"]),
-                    theme_id=theme_id,
-                    product=product,
-                    notes=link.get("notes"),
-                    position=link.get("position"),
-                    added_at=self._parse_dt(link["added_at"]),
-                )
+        after: Optional[Cursor] = None,
+    ) -> Tuple[List[ThemeProductResponse], Optional[str]]:
+        """One page of a theme's products, newest link first, and the next cursor."""
+
+        links, records, cursor = await self._storage.read(
+            self._read_theme_products, str(theme_id), page, page_size, after
+        )
+        products = self._products.to_models(records)
+        items = [
+            ThemeProductResponse(
+                id=UUID(link["id"]),
+                theme_id=theme_id,
+                product=product,
+                notes=link.get("notes"),
+                position=link.get("position"),
+                added_at=self._parse_dt(link["added_at"]),
             )
-        return results
+            for link, product in zip(links, products)
+            if product is not None
+        ]
+        return items, cursor
 
     async def add_products(
         self, theme_id: UUID, request: ThemeProductAddRequest
+    ) -> List[ThemeProductResponse]:
+        return await self._storage.transact(self._add_products, theme_id, request)
+
+    async def remove_product(self, theme_id: UUID, product_id: UUID) -> None:
+        await self._storage.transact(self._remove_product, str(theme_id), str(product_id))
+
+    async def repair_product_counts(self) -> int:
+        """Check every theme's links and stored ``product_count``.
+
+        Removes duplicate links to the same product (written before links
+        were unique), keeping the one the unique index resolves to, and fixes
+        counters that are missing or wrong. Returns how many themes were
+        repaired. Run on startup.
+        """
+
+        if not await self._storage.read(self._stale_product_counts):
+            return 0
+        repaired = await self._storage.transact(self._repair_product_counts)
+        logger.warning("repaired product links of %d theme(s)", repaired)
+        return repaired
+
+    # ------------------------------------------------------------------
+    # last-modified versions, for ETags
+    # ------------------------------------------------------------------
+    async def themes_version(self) -> int:
+        return await self._storage.read(self._themes_version)
+
+    async def theme_version(self, theme_id: UUID) -> int:
+        """Last-modified version of a theme; 0 if it does not exist."""
+
+        return await self._storage.read(self._theme_version, str(theme_id))
+
+    async def theme_products_version(self, theme_id: UUID) -> int:
+        return await self._storage.read(self._theme_products_version, str(theme_id))
+
+    # ------------------------------------------------------------------
+    # snapshot readers (see AsyncStorage.read)
+    # ------------------------------------------------------------------
+    # linking or unlinking products rewrites the theme's product_count, so
+    # theme responses depend on the theme records alone
+    @staticmethod
+    def _themes_version(snapshot: StorageSnapshot) -> int:
+        return snapshot.last_modified("theme")
+
+    @staticmethod
+    def _theme_version(snapshot: StorageSnapshot, theme_key: str) -> int:
+        return snapshot.last_modified("theme", theme_key)
+
+    @staticmethod
+    def _theme_products_version(snapshot: StorageSnapshot, theme_key: str) -> int:
+        return max(
+            snapshot.last_modified("theme", theme_key),
+            snapshot.last_modified("theme_product"),
+            snapshot.last_modified("product"),
+        )
+
+    def _list_themes(
+        self,
+        snapshot: StorageSnapshot,
+        page: int,
+        page_size: int,
+        updated_after: Optional[str],
+        after: Optional[Cursor],
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        offset = 0 if after is not None else (page - 1) * page_size
+        # one extra row tells whether another page follows
+        themes = snapshot.scan(
+            "themes",
+            "updated_at",
+            after=after,
+            above=self._parse_dt(updated_after) if updated_after else None,
+            offset=offset,
+            limit=page_size + 1,
+        )
+        return next_cursor(themes, "updated_at", page_size)
+
+    def _get_theme(self, snapshot: StorageSnapshot, theme_key: str) -> Optional[ThemeResponse]:
+        raw = snapshot.get("themes", theme_key)
+        if not raw:
+            return None
+        return self._to_model(raw)
+
+    @staticmethod
+    def _stale_product_counts(snapshot: StorageSnapshot) -> int:
+        stale = 0
+        for theme in snapshot.list_values("themes"):
+            links = snapshot.find("theme_products", "theme_id", theme["id"])
+            unique = {link["product_id"] for link in links}
+            if theme.get("product_count") != len(links) or len(unique) != len(links):
+                stale += 1
+        return stale
+
+    def _read_theme_products(
+        self,
+        snapshot: StorageSnapshot,
+        theme_key: str,
+        page: int,
+        page_size: int,
+        after: Optional[Cursor],
+    ) -> Tuple[List[Dict[str, Any]], List[ProductRecord], Optional[str]]:
+        links = snapshot.scan(
+            "theme_products",
+            "added_at",
+            partition=theme_key,
+            after=after,
+            offset=0 if after is not None else (page - 1) * page_size,
+            limit=page_size + 1,
+        )
+        links, cursor = next_cursor(links, "added_at", page_size)
+        records = self._products.read_records(snapshot, [link["product_id"] for link in links])
+        return links, records, cursor
+
+    # ------------------------------------------------------------------
+    # transaction bodies (see AsyncStorage.transact)
+    # ------------------------------------------------------------------
+    def _update_theme(
+        self, storage: JsonStorage, theme_key: str, payload: ThemeUpdate
+    ) -> Optional[Dict[str, Any]]:
+        raw = storage.get("themes", theme_key)
+        if not raw:
+            return None
+        raw = dict(raw)
+        changed = False
+        if payload.title is not None and payload.title != raw.get("title"):
+            raw["title"] = payload.title
+            changed = True
+        if payload.preference:
+            raw["preference_tags"] = payload.preference.tags
+            raw["preference_text"] = payload.preference.description
+            changed = True
+        if not changed:
+            return raw
+        raw["updated_at"] = datetime.utcnow().isoformat() + "Z"
+        return storage.update("themes", theme_key, raw, entity_type="theme", action="updated")
+
+    def _add_products(
+        self, storage: JsonStorage, theme_id: UUID, request: ThemeProductAddRequest
     ) -> List[ThemeProductResponse]:
         theme_key = str(theme_id)
-        if not self._storage.get("themes", theme_key):
+        # checked in the transaction that writes the links, so a concurrent
+        # delete cannot leave links (or upserted products) to a missing theme
+        if not storage.get("themes", theme_key):
             raise HTTPException(status_code=404, detail="Theme not found")
         responses: List[ThemeProductResponse] = []
+        added = 0
         for attachment in request.products:
-            product = await self._products.upsert_product(attachment.product)
-            link_id = str(uuid4())
-            record = {
-                "id": link_id,
-                "theme_id": theme_key,
-                "product_id": str(product.id),
-                "notes": attachment.notes,
-                "position": attachment.position,
-                "added_at": datetime.utcnow().isoformat() + "Z",
-            }
-            self._storage.insert(
-                "theme_products",
-                record,
-                entity_type="theme_product",
-                action="created",
+            product = ProductResponse.parse_obj(
+                self._products.upsert_record(storage, attachment.product)
+            )
+            # (theme_id, product_id) is unique: attaching a product again
+            # updates the existing link instead of adding a second one
+            link = storage.lookup(
+                "theme_products", {"theme_id": theme_key, "product_id": str(product.id)}
             )
+            if link is None:
+                link = storage.insert(
+                    "theme_products",
+                    {
+                        "id": str(uuid4()),
+                        "theme_id": theme_key,
+                        "product_id": str(product.id),
+                        "notes": attachment.notes,
+                        "position": attachment.position,
+                        "added_at": datetime.utcnow().isoformat() + "Z",
+                    },
+                    entity_type="theme_product",
+                    action="created",
+                )
+                added += 1
+            elif (link.get("notes"), link.get("position")) != (
+                attachment.notes,
+                attachment.position,
+            ):
+                link = storage.update(
+                    "theme_products",
+                    link["id"],
+                    {**link, "notes": attachment.notes, "position": attachment.position},
+                    entity_type="theme_product",
+                    action="updated",
+                )
             responses.append(
                 ThemeProductResponse(
-                    id=UUID(link_id),
+                    id=UUID(link["id"]),
                     theme_id=theme_id,
                     product=product,
-                    notes=attachment.notes,
-                    position=attachment.position,
-                    added_at=self._parse_dt(record["added_at"]),
+                    notes=link.get("notes"),
+                    position=link.get("position"),
+                    added_at=self._parse_dt(link["added_at"]),
                 )
             )
         # touch theme timestamp
-        raw_theme = self._storage.get("themes", theme_key)
-        if raw_theme:
-            raw_theme["updated_at"] = datetime.utcnow().isoformat() + "Z"
-            self._storage.update(
-                "themes",
-                theme_key,
-                raw_theme,
-                entity_type="theme",
-                action="updated",
-            )
+        self._touch_theme(storage, theme_key, added)
         return responses
 
-    async def remove_product(self, theme_id: UUID, product_id: UUID) -> None:
-        theme_key = str(theme_id)
-        product_key = str(product_id)
-        links = [
-            link
-            for link in self._storage.list_values("theme_products")
-            if link["theme_id"] == theme_key and link["product_id"] == product_key
-        ]
-        for link in links:
-            self._storage.delete(
-                "theme_products",
-                link["id"],
-                entity_type="theme_product",
-                action="deleted",
-            )
-        raw_theme = self._storage.get("themes", theme_key)
+    def _remove_product(self, storage: JsonStorage, theme_key: str, product_key: str) -> None:
+        link = storage.lookup("theme_products", {"theme_id": theme_key, "product_id": product_key})
+        if link is None:
+            return
+        storage.delete(
+            "theme_products",
+            link["id"],
+            entity_type="theme_product",
+            action="deleted",
+        )
+        self._touch_theme(storage, theme_key, -1)
+
+    def _repair_product_counts(self, storage: JsonStorage) -> int:
+        repaired = 0
+        for theme in storage.list_values("themes"):
+            links = storage.find("theme_products", "theme_id", theme["id"])
+            for link in links:
+                kept = storage.lookup(
+                    "theme_products", {"theme_id": theme["id"], "product_id": link["product_id"]}
+                )
+                if kept is not None and kept["id"] != link["id"]:
+                    storage.delete(
+                        "theme_products",
+                        link["id"],
+                        entity_type="theme_product",
+                        action="deleted",
+                    )
+            actual = storage.count("theme_products", "theme_id", theme["id"])
+            if theme.get("product_count") != actual:
+                storage.update(
+                    "themes",
+                    theme["id"],
+                    {**theme, "product_count": actual},
+                    entity_type="theme",
+                    action="updated",
+                )
+            elif len(links) == actual:
+                continue
+            repaired += 1
+        return repaired
+
+    # ------------------------------------------------------------------
+    # helpers
+    # ------------------------------------------------------------------
+    def _touch_theme(self, storage: JsonStorage, theme_key: str, product_delta: int = 0) -> None:
+        """Bump ``updated_at`` and adjust the denormalised ``product_count``.
+
+        Runs in the transaction that added or removed the links.
+        """
+
+        raw_theme = storage.get("themes", theme_key)
         if raw_theme:
-            raw_theme["updated_at"] = datetime.utcnow().isoformat() + "Z"
-            self._storage.update(
+            product_count = raw_theme.get("product_count")
+            if product_count is None:
+                product_count = storage.count("theme_products", "theme_id", theme_key)
+            else:
+                product_count = max(0, product_count + product_delta)
+            storage.update(
                 "themes",
                 theme_key,
-                raw_theme,
+                {
+                    **raw_theme,
+                    "product_count": product_count,
+                    "updated_at": datetime.utcnow().isoformat() + "Z",
+                },
                 entity_type="theme",
                 action="updated",
             )
 
-    # ------------------------------------------------------------------
-    # helpers
-    # ------------------------------------------------------------------
     def _to_model(self, payload: dict) -> ThemeResponse:
-        product_count = sum(
-            1
-            for item in self._storage.list_values("theme_products")
-            if item["theme_id"] == payload["id"]
-        )
-        return ThemeResponse.parse_obj({**payload, "product_count": product_count})
+        return ThemeResponse.parse_obj(payload)
 
     def _parse_dt(self, value: str) -> datetime:
         if value.endswith("Z"):
@@ -247,5 +410,5 @@ _theme_service: Optional[ThemeService] = None
 def get_theme_service() -> ThemeService:
     global _theme_service
     if _theme_service is None:
-        _theme_service = ThemeService(get_storage(), get_product_service())
+        _theme_service = ThemeService(get_async_storage(), get_product_service())
     return _theme_service
@@ -8,7 +8,8 @@ from uuid import uuid4
 
 from fastapi import HTTPException
 
-from ..db.storage import JsonStorage, get_storage
+from ..db.aio import AsyncStorage, get_async_storage
+from ..db.snapshot import StorageSnapshot
 from ..schemas import ToolDefinition, ToolInvocationRequest, ToolInvocationResponse
 
 
@@ -35,7 +36,7 @@ _DEFAULT_TOOLS: Dict[str, ToolDefinition] = {
 
 
 class ToolService:
-    def __init__(self, storage: JsonStorage) -> None:
+    def __init__(self, storage: AsyncStorage) -> None:
         self._storage = storage
 
     async def list_tools(self) -> List[ToolDefinition]:
@@ -48,7 +49,7 @@ class ToolService:
         if not definition:
             raise HTTPException(status_code=404, detail="Tool not found")
         now = datetime.utcnow().isoformat() + "Z"
-        response_payload = self._render_response(tool_id, request)
+        response_payload = await self._storage.read(self._render_response, tool_id, request)
         if definition.prompt:
             response_payload.setdefault("prompt", definition.prompt)
         record = {
@@ -60,7 +61,7 @@ class ToolService:
             "response_payload": response_payload,
             "created_at": now,
         }
-        stored = self._storage.insert(
+        stored = await self._storage.insert(
             "tool_invocations",
             record,
             entity_type="tool_invocation",
@@ -72,11 +73,11 @@ class ToolService:
     # helpers
     # ------------------------------------------------------------------
     def _render_response(
-        self, tool_id: str, request: ToolInvocationRequest
+        self, snapshot: StorageSnapshot, tool_id: str, request: ToolInvocationRequest
     ) -> Dict[str, object]:
-        theme = self._storage.get("themes", str(request.theme_id)) if request.theme_id else None
-        product = self._storage.get("products", str(request.product_id)) if request.product_id else None
-        products = self._collect_products(theme["id"]) if theme else []
+        theme = snapshot.get("themes", str(request.theme_id)) if request.theme_id else None
+        product = snapshot.get("products", str(request.product_id)) if request.product_id else None
+        products = self._collect_products(snapshot, theme["id"]) if theme else []
         if product and not products:
             products = [product]
         if tool_id == "compare_specs":
@@ -136,15 +137,13 @@ class ToolService:
                 eco_items.append(self._product_snapshot(product))
         return {"summary": "符合环保偏好的商品", "items": eco_items}
 
-    def _collect_products(self, theme_id: str) -> List[Dict[str, object]]:
-        links = [
-            link
-            for link in self._storage.list_values("theme_products")
-            if link["theme_id"] == theme_id
-        ]
+    def _collect_products(
+        self, snapshot: StorageSnapshot, theme_id: str
+    ) -> List[Dict[str, object]]:
+        links = snapshot.find("theme_products", "theme_id", theme_id)
         products: List[Dict[str, object]] = []
         for link in links:
-            product = self._storage.get("products", link["product_id"])
+            product = snapshot.get("products", link["product_id"])
             if product:
                 products.append(product)
         return products
@@ -165,5 +164,5 @@ _tool_service: Optional[ToolService] = None
 def get_tool_service() -> ToolService:
     global _tool_service
     if _tool_service is None:
-        _tool_service = ToolService(get_storage())
+        _tool_service = ToolService(get_async_storage())
     return _tool_service
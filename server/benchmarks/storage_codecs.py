@@ -0,0 +1,131 @@
+"""Compare storage codecs: snapshot size, save time and load (startup) time.
+
+Usage::
+
+    cd server && python -m benchmarks.storage_codecs [--products 20000] [--repeat 3]
+
+A synthetic document (themes, products, links, inquiry history and the
+matching change log) is written once per available codec. *save* is one
+full snapshot write (what a checkpoint costs), *load* is opening a
+:class:`~app.db.storage.JsonStorage` on that file, index building included.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from app.db.codec import available_codecs, encode_document
+from app.db.storage import COLLECTIONS, JsonStorage, utcnow
+
+
+def build_document(products: int) -> Dict[str, Any]:
+    document: Dict[str, Any] = {collection: {} for collection in COLLECTIONS}
+    changes: List[Dict[str, Any]] = []
+
+    def put(collection: str, entity_type: str, entity: Dict[str, Any]) -> None:
+        document[collection][entity["id"]] = entity
+        changes.append(
+            {
+                "version": len(changes) + 1,
+                "entity_type": entity_type,
+                "entity_id": entity["id"],
+                "action": "created",
+                "timestamp": utcnow(),
+                "payload": entity,
+            }
+        )
+
+    themes = [str(uuid4()) for _ in range(max(1, products // 50))]
+    for theme_id in themes:
+        put(
+            "themes",
+            "theme",
+            {
+                "id": theme_id,
+                "title": "露营装备",
+                "preference_tags": ["轻量", "防水"],
+                "preference_text": "预算两千以内，优先考虑收纳体积",
+                "created_at": utcnow(),
+                "updated_at": utcnow(),
+            },
+        )
+    for index in range(products):
+        product_id = str(uuid4())
+        put(
+            "products",
+            "product",
+            {
+                "id": product_id,
+                "title": f"超轻双人帐篷 {index}",
+                "price": 399.0 + index % 700,
+                "currency": "CNY",
+                "shop_name": "户外旗舰店",
+                "tags": ["户外", "露营", "轻量"],
+                "parameters": {"重量": "1.2kg", "材质": "20D 尼龙", "防水指数": "3000mm"},
+                "source_url": f"https://example.com/item/{index}",
+                "created_at": utcnow(),
+                "updated_at": utcnow(),
+            },
+        )
+        put(
+            "theme_products",
+            "theme_product",
+            {
+                "id": str(uuid4()),
+                "theme_id": themes[index % len(themes)],
+                "product_id": product_id,
+                "notes": None,
+                "position": index,
+                "added_at": utcnow(),
+            },
+        )
+    document["version"] = len(changes)
+    document["changes"] = changes
+    document["changes_baseline"] = 0
+    return document
+
+
+def run(products: int, repeat: int) -> List[Dict[str, Any]]:
+    document = build_document(products)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, codec in available_codecs().items():
+            path = Path(tmp) / f"{name}.storage"
+            path.write_bytes(encode_document(codec, document))
+            load = save = float("inf")
+            for _ in range(repeat):
+                started = time.perf_counter()
+                storage = JsonStorage(path, wal=False, codec=name)
+                load = min(load, time.perf_counter() - started)
+                started = time.perf_counter()
+                storage.checkpoint()
+                save = min(save, time.perf_counter() - started)
+                storage.close()
+            results.append(
+                {"codec": name, "bytes": path.stat().st_size, "load": load, "save": save}
+            )
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    print(f"{'codec':<12} {'size (MiB)':>11} {'load (s)':>9} {'save (s)':>9}")
+    for row in run(args.products, args.repeat):
+        print(
+            f"{row['codec']:<12} {row['bytes'] / 2**20:>11.2f} "
+            f"{row['load']:>9.3f} {row['save']:>9.3f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+from app.core.search import InvertedIndex, tokenize
+
+
+def test_documents_index_cjk_characters_and_bigrams():
+    assert tokenize("露营帐篷") == ["露", "营", "帐", "篷", "露营", "营帐", "帐篷"]
+
+
+def test_multi_character_queries_use_bigrams_only():
+    assert tokenize("露营帐篷", query=True) == ["露营", "营帐", "帐篷"]
+    assert tokenize("鞋", query=True) == ["鞋"]
+
+
+def test_single_character_query_matches_inside_longer_titles():
+    index = InvertedIndex()
+    index.put("boots", "防水登山鞋")
+    index.put("tent", "户外露营帐篷")
+
+    assert [doc_id for doc_id, _ in index.search("鞋", 10)] == ["boots"]
+    assert [doc_id for doc_id, _ in index.search("帐", 10)] == ["tent"]
+
+
+def test_multi_character_query_does_not_match_on_single_characters():
+    index = InvertedIndex()
+    index.put("tent", "露营帐篷")
+    index.put("pole", "帐杆配件")
+
+    assert [doc_id for doc_id, _ in index.search("帐篷", 10)] == ["tent"]
+    assert {doc_id for doc_id, _ in index.search("帐", 10)} == {"tent", "pole"}